@@ -1,4 +1,5 @@
 import sys
+import gzip
 import cmdy
 import pytest
 
@@ -24,6 +25,23 @@ variableStep chrom=chr span=1
 5\t6.0
 """
 
+def test_switch_base_collapse(python):
+    cmd = cmdy.echo("""\
+variableStep chrom=chr span=1
+1\t1
+2\t1.1
+3\t0.9
+4\t1
+10\t2
+""", _pipe=True) | python({"m": "wigtools"}, "switch-base", to=0,
+                          collapse=True, tolerance=0.25)
+    assert cmd.stdout == """\
+fixedStep chrom=chr span=4 start=0 step=4
+1.0
+fixedStep chrom=chr span=1 start=9 step=1
+2.0
+"""
+
 
 def test_sort(python):
     cmd = cmdy.echo("""\
@@ -43,6 +61,40 @@ variableStep chrom=chr span=1
 6\t6.0
 """
 
+def test_sort_chroms(python, tmp_path):
+    chroms = tmp_path / 'test_sort_chroms.sizes'
+    chroms.write_text("chr2\t100\nchr1\t100\n")
+    cmd = cmdy.echo("""\
+variableStep chrom=chr1 span=1
+1\t1
+variableStep chrom=chr2 span=1
+1\t2
+""", _pipe=True) | python({"m": "wigtools"}, "sort", chroms=chroms)
+    assert cmd.stdout == """\
+variableStep chrom=chr2 span=1
+1\t2.0
+variableStep chrom=chr1 span=1
+1\t1.0
+"""
+
+def test_sort_jobs(python, tmp_path):
+    infile = tmp_path / 'test_sort_jobs.wig'
+    outfile = tmp_path / 'test_sort_jobs.sorted.wig.gz'
+    infile.write_text("""\
+fixedStep chrom=chr2 start=1 step=1
+2
+fixedStep chrom=chr1 start=1 step=1
+1
+""")
+    python({"m": "wigtools"}, "sort", i=infile, o=outfile, jobs=2).stdout
+    with gzip.open(outfile, 'rt') as fgz:
+        assert fgz.read() == """\
+fixedStep chrom=chr1 start=1 step=1
+1
+fixedStep chrom=chr2 start=1 step=1
+2
+"""
+
 def test_stats(python):
     cmd = cmdy.echo("""\
 variableStep chrom=chr span=1
@@ -58,6 +110,44 @@ chr\t5\t6\t5.0\t6.0\t5.5\t5.5\t11.0\t2\t2
 chr\t1\t2\t1.0\t2.0\t1.5\t1.5\t3.0\t2\t2
 """
 
+def test_window(python):
+    cmd = cmdy.echo("""\
+variableStep chrom=chr span=2
+1\t1
+3\t2
+6\t4
+fixedStep chrom=chr2 start=1 step=1
+1
+2
+3
+""", _pipe=True) | python({"m": "wigtools"}, "window", size=4, stat="sum")
+    assert cmd.stdout == """\
+fixedStep chrom=chr span=4 start=1 step=4
+3.0
+4.0
+fixedStep chrom=chr2 span=4 start=1 step=4
+6.0
+"""
+
+def test_summarize(python, tmp_path):
+    qfile = tmp_path / 'test_summarize.bed'
+    qfile.write_text("""\
+chr\t2\t7
+chr2\t1\t2
+""")
+    cmd = cmdy.echo("""\
+variableStep chrom=chr span=2
+1\t1
+3\t2
+6\t4
+""", _pipe=True) | python({"m": "wigtools"}, "summarize",
+                          qfile=qfile, stats=["sum", "count"])
+    assert cmd.stdout == """\
+Chrom\tStart\tEnd\tsum\tcount
+chr\t2\t7\t6.5\t3
+chr2\t1\t2\t0.0\t0
+"""
+
 def test_query(python, tmp_path):
     qfile = tmp_path / 'test_query.bed'
     qfile.write_text("""\
@@ -77,6 +167,89 @@ variableStep chrom=chr span=1
 2\t2.0
 """
 
+def test_query_chr_prefix(python, tmp_path):
+    # chr1 and 1 are taken as the same chromosome
+    qfile = tmp_path / 'test_query_chr_prefix.bed'
+    qfile.write_text("1\t2\t8\n")
+    wigfile = tmp_path / 'test_query_chr_prefix.wig'
+    wigfile.write_text("fixedStep chrom=chr1 start=1 step=1\n1\n2\n")
+    cmd = python({"m": "wigtools"}, "query", qfile=qfile, i=wigfile)
+    assert cmd.stdout == """\
+fixedStep chrom=chr1 start=1 step=1 span=1
+1
+2
+"""
+
+def test_query_unsorted(python, tmp_path):
+    qfile = tmp_path / 'test_query_unsorted.bed'
+    qfile.write_text("""\
+chr\t5\t6
+chr\t1\t2
+""")
+    cmd = cmdy.echo("""\
+variableStep chrom=chr span=1
+5\t5
+6\t6
+variableStep chrom=chr span=1
+1\t1
+2\t2
+""", _pipe=True) | python({"m": "wigtools"}, "query", qfile=qfile)
+    assert cmd.stdout == """\
+variableStep chrom=chr span=1
+5\t5.0
+6\t6.0
+variableStep chrom=chr span=1
+1\t1.0
+2\t2.0
+"""
+
+def test_query_unsorted_file(python, tmp_path):
+    qfile = tmp_path / 'test_query_unsorted_file.bed'
+    qfile.write_text("""\
+chr\t1\t2
+chr\t5\t6
+""")
+    wigfile = tmp_path / 'test_query_unsorted_file.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr span=1
+5\t5
+6\t6
+variableStep chrom=chr span=1
+1\t1
+2\t2
+""")
+    # sorted regions with an unsorted regular file, whose blocks are copied
+    # without being parsed
+    cmd = python({"m": "wigtools"}, "query", qfile=qfile, i=wigfile)
+    assert cmd.stdout == """\
+variableStep chrom=chr span=1
+1\t1
+2\t2
+variableStep chrom=chr span=1
+5\t5
+6\t6
+"""
+
+def test_check_sorted(python, tmp_path):
+    wigfile = tmp_path / 'test_check_sorted.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr span=1
+5\t5
+variableStep chrom=chr span=1
+1\t1
+""")
+    cmd = python({"m": "wigtools"}, "check-sorted", i=wigfile, _raise=False)
+    assert cmd.rc == 1
+    assert "Not sorted: chr:1 appears after chr:5" in cmd.stderr
+
+    cmd = cmdy.echo("""\
+variableStep chrom=chr span=1
+1\t1
+variableStep chrom=chr span=1
+5\t5
+""", _pipe=True) | python({"m": "wigtools"}, "check-sorted")
+    assert cmd.rc == 0
+
 def test_reshape(python, tmp_path):
     qfile = tmp_path / 'test_query.bed'
     qfile.write_text("""\
@@ -99,6 +272,87 @@ variableStep chrom=chr span=1
 6\t6.0
 """
 
+def test_reshape_file(python, tmp_path):
+    qfile = tmp_path / 'test_reshape_file.bed'
+    qfile.write_text("chr\t1\t10\n")
+    wigfile = tmp_path / 'test_reshape_file.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr span=1
+1\t1
+2\t2
+variableStep chrom=chr span=1
+5\t5
+""")
+    # the blocks of regular files are reshaped, not copied
+    cmd = python({"m": "wigtools"}, "reshape", qfile=qfile, i=wigfile)
+    assert cmd.stdout == """\
+variableStep chrom=chr span=1
+1\t1.0
+2\t2.0
+5\t5.0
+"""
+
+def test_bigwig(python, tmp_path):
+    wigfile = tmp_path / 'test_bigwig.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr span=1
+1\t1
+2\t2
+variableStep chrom=chr span=1
+5\t5
+6\t6
+""")
+    sizesfile = tmp_path / 'test_bigwig.sizes'
+    sizesfile.write_text("chr\t100\n")
+    bwfile = tmp_path / 'test_bigwig.bw'
+    python({"m": "wigtools"}, "convert", i=wigfile, o=bwfile, to="bigwig",
+           chroms=sizesfile).stdout
+    qfile = tmp_path / 'test_bigwig.bed'
+    qfile.write_text("chr\t5\t5\n")
+    cmd = python({"m": "wigtools"}, "query", qfile=qfile, i=bwfile)
+    assert cmd.stdout == """\
+variableStep chrom=chr span=1
+5\t5.0
+6\t6.0
+"""
+
+def test_merge(python, tmp_path):
+    wigfile1 = tmp_path / 'test_merge1.wig'
+    wigfile1.write_text("""\
+variableStep chrom=chr span=2
+1\t1
+3\t2
+""")
+    wigfile2 = tmp_path / 'test_merge2.wig'
+    wigfile2.write_text("""\
+fixedStep chrom=chr start=2 step=1
+4
+6
+""")
+    cmd = python({"m": "wigtools"}, "merge", i=[wigfile1, wigfile2],
+                 op="max", fmt="bedgraph", base=0)
+    assert cmd.stdout == """\
+chr\t1\t2\t1.0
+chr\t2\t3\t4.0
+chr\t3\t4\t6.0
+chr\t4\t5\t2.0
+"""
+
+def test_transform(python, tmp_path):
+    wigfile = tmp_path / 'test_transform.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr
+1\t1
+2\t3
+""")
+    cmd = python({"m": "wigtools"}, "transform", i=wigfile,
+                 ops=["scale:2", "add:-1", "zscore"])
+    assert cmd.stdout == """\
+variableStep chrom=chr span=1
+1\t-1.0
+2\t1.0
+"""
+
 def test_split(python, tmp_path):
     outprefix = tmp_path / 'test_split' / 'out'
     cmdy.echo("""\
@@ -125,3 +379,8 @@ variableStep chrom=chr span=1
 5\t5.0
 6\t6.0
 """
+
+def test_handler_aliases():
+    import wigtools
+    for name in ("switch_base", "sort", "reshape", "query", "split"):
+        assert getattr(wigtools, name) is getattr(wigtools, name + "_cmd")
@@ -0,0 +1,303 @@
+import shutil
+import struct
+import subprocess
+import zlib
+import pytest
+from wigtools import bigwig
+from wigtools.wiggle import Wiggle, WiggleUnsortedFile
+from wigtools.index import fetch_bigwig
+from wigtools.bigwig import (BigWigFile, BigWigWriter, WiggleBigWigError,
+                             is_bigwig, read_chrom_sizes, write_bigwig)
+
+WIGGLE = """\
+fixedStep chrom=chr1 start=11 step=10 span=5
+1.5
+2.5
+3.5
+4.5
+variableStep chrom=chr1 span=2
+101\t1.0
+105\t2.0
+120\t3.0
+fixedStep chrom=chr2 start=1 step=1 span=1
+0.5
+0.25
+"""
+CHROM_SIZES = {"chr1": 1000, "chr2": 100, "chr3": 50}
+
+@pytest.fixture
+def wigfile(tmp_path):
+    path = tmp_path / 'test_wiggle_bigwig.wig'
+    path.write_text(WIGGLE)
+    return path
+
+@pytest.fixture
+def bwfile(wigfile, tmp_path):
+    path = tmp_path / 'test_wiggle_bigwig.bw'
+    assert write_bigwig(Wiggle.iter_blocks(wigfile), path, CHROM_SIZES) == 3
+    return path
+
+def test_read_chrom_sizes(tmp_path):
+    sizesfile = tmp_path / 'test_wiggle_bigwig.sizes'
+    sizesfile.write_text("# comment\nchr1\t1000\n\nchr2 100 extra\n")
+    assert read_chrom_sizes(sizesfile) == {"chr1": 1000, "chr2": 100}
+
+def test_read_write(wigfile, bwfile):
+    assert is_bigwig(bwfile)
+    assert not is_bigwig(wigfile)
+
+    with BigWigFile(bwfile) as bwf:
+        # chromosomes without data are not saved
+        assert bwf.chroms == {"chr1": (0, 1000), "chr2": (1, 100)}
+        bases, minimum, maximum, total, _ = bwf.summary
+        assert bases == 4 * 5 + 3 * 2 + 2
+        assert (minimum, maximum) == (0.25, 4.5)
+        assert total == pytest.approx(12 * 5 + 6 * 2 + .75)
+
+    wiggle = Wiggle(bwfile)
+    assert wiggle.stringify() == Wiggle(wigfile).stringify()
+    wiggle0 = Wiggle(bwfile, base=0)
+    assert list(wiggle0.blocks) == ["chr1:10", "chr1:100", "chr2:0"]
+
+def test_write_errors(wigfile, tmp_path):
+    with pytest.raises(WiggleBigWigError):
+        write_bigwig(Wiggle.iter_blocks(wigfile),
+                     tmp_path / 'test_wiggle_bigwig_nochrom.bw',
+                     {"chr1": 1000})
+    with pytest.raises(WiggleBigWigError):
+        write_bigwig(Wiggle.iter_blocks(wigfile),
+                     tmp_path / 'test_wiggle_bigwig_exceed.bw',
+                     {"chr1": 100, "chr2": 100})
+
+def test_write_unsorted(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_bigwig_unsorted.wig'
+    wigfile.write_text("fixedStep chrom=chr1 start=501 step=1\n1\n"
+                       "fixedStep chrom=chr1 start=1 step=1\n1\n")
+    with pytest.raises(WiggleUnsortedFile):
+        write_bigwig(Wiggle.iter_blocks(wigfile),
+                     tmp_path / 'test_wiggle_bigwig_unsorted.bw',
+                     CHROM_SIZES)
+    wigfile.write_text("fixedStep chrom=chr1 start=1 step=1\n1\n"
+                       "fixedStep chrom=chr2 start=1 step=1\n1\n"
+                       "fixedStep chrom=chr1 start=501 step=1\n1\n")
+    with pytest.raises(WiggleUnsortedFile):
+        write_bigwig(Wiggle.iter_blocks(wigfile),
+                     tmp_path / 'test_wiggle_bigwig_unsorted.bw',
+                     CHROM_SIZES)
+
+    # fine once sorted, with the zoom records found by the index
+    wigfile.write_text("fixedStep chrom=chr1 start=500001 step=1\n" +
+                       "2\n" * 1000 +
+                       "fixedStep chrom=chr1 start=1 step=1\n" +
+                       "1\n" * 1000)
+    wiggle = Wiggle(wigfile)
+    wiggle.sort()
+    bwfile = tmp_path / 'test_wiggle_bigwig_sorted.bw'
+    write_bigwig(wiggle.blocks.values(), bwfile, {"chr1": 1000000})
+    with BigWigFile(bwfile) as bwf:
+        assert bwf.zoom_stats(("chr1", 0, 200000), 0, ['mean', 'bp']) == dict(
+            mean=1., bp=1000
+        )
+
+def test_bedgraph_section(tmp_path):
+    bwfile = tmp_path / 'test_wiggle_bigwig_bedgraph.bw'
+    with BigWigWriter(bwfile, {"chr1": 1000}) as writer:
+        writer._chrom_id("chr1")
+        items = ((10, 20, 1.0), (20, 30, 2.0), (50, 55, 3.0))
+        writer._write_section(
+            struct.pack("<IIIIIBBH", 0, 10, 55, 0, 0,
+                        bigwig.SECTION_BEDGRAPH, 0, len(items)) +
+            b"".join(struct.pack("<IIf", *item) for item in items),
+            0, 10, 55
+        )
+    blocks = list(Wiggle(bwfile, base=0).blocks.values())
+    assert [(block.start, block.span, list(block.data))
+            for block in blocks] == [(10, 10, [1., 2.]), (50, 5, [3.])]
+    assert list(blocks[0].regions) == [10, 20]
+
+def test_multilevel_trees(monkeypatch, tmp_path):
+    monkeypatch.setattr(bigwig, "ITEMS_PER_SLOT", 2)
+    monkeypatch.setattr(bigwig, "BLOCK_SIZE", 3)
+    wigfile = tmp_path / 'test_wiggle_bigwig_multilevel.wig'
+    wigfile.write_text("".join(
+        f"fixedStep chrom=chr{i} start=1 step=1 span=1\n" +
+        "".join(f"{j}\n" for j in range(20))
+        for i in range(1, 12)
+    ))
+    bwfile = tmp_path / 'test_wiggle_bigwig_multilevel.bw'
+    write_bigwig(Wiggle.iter_blocks(wigfile), bwfile,
+                 {f"chr{i}": 100 for i in range(1, 12)})
+
+    with BigWigFile(bwfile) as bwf:
+        assert len(bwf.chroms) == 11
+        # 110 sections of 2 items
+        assert len(bwf.query_sections([("chr7", 1, 100)])) == 10
+        assert len(bwf.query_sections([("chr7", 3, 6)])) == 2
+    assert Wiggle(bwfile).stringify() == Wiggle(wigfile).stringify()
+
+def test_fetch_bigwig(bwfile):
+    wiggle = fetch_bigwig(bwfile, [("chr1", 100, 102), ("chr3", 1, 10)])
+    assert list(wiggle.blocks) == ["chr1:101"]
+    wiggle = fetch_bigwig(bwfile, [("chr2", 0, 1)], qbase=0)
+    assert list(wiggle.blocks) == ["chr2:1"]
+
+def test_zoom(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_bigwig_zoom.wig'
+    wigfile.write_text("fixedStep chrom=chr1 start=1 step=1 span=1\n" +
+                       "".join(f"{i % 10}\n" for i in range(10000)))
+    bwfile = tmp_path / 'test_wiggle_bigwig_zoom.bw'
+    write_bigwig(Wiggle.iter_blocks(wigfile), bwfile, {"chr1": 20000})
+
+    with BigWigFile(bwfile) as bwf:
+        assert [level[0] for level in bwf.zoom_levels][:3] == [4, 16, 64]
+        # too small for any zoom levels
+        assert bwf.zoom_stats(("chr1", 1, 10), 1, ['mean']) is None
+        zstats = bwf.zoom_stats(("chr1", 1, 20000), 1,
+                                ['min', 'max', 'mean', 'bp', 'coverage'])
+        assert zstats == dict(min=0, max=9, mean=pytest.approx(4.5),
+                              bp=10000, coverage=.5)
+        # records partially in the region are weighted
+        zstats = bwf.zoom_stats(("chr1", 1001, 3000), 1, ['mean', 'std'])
+        assert zstats['mean'] == pytest.approx(4.5, rel=1e-3)
+        assert zstats['std'] == pytest.approx(8.25 ** .5, rel=1e-3)
+
+
+@pytest.fixture
+def zoomfile(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_bigwig_spec.wig'
+    wigfile.write_text("fixedStep chrom=chr1 start=1 step=1 span=1\n" +
+                       "".join(f"{i % 10}\n" for i in range(10000)))
+    bwfile = tmp_path / 'test_wiggle_bigwig_spec.bw'
+    write_bigwig(Wiggle.iter_blocks(wigfile), bwfile, {"chr1": 20000})
+    return bwfile
+
+def _spec_leaves(data, offset):
+    """Get the (offset, size) of the items of an R-tree from the spec,
+    returning the item count in its header as well"""
+    magic, _, item_count = struct.unpack_from("<IIQ", data, offset)
+    assert magic == 0x2468ACE0
+    leaves = []
+    nodes = [offset + 48]
+    while nodes:
+        node = nodes.pop(0)
+        is_leaf, _, count = struct.unpack_from("<BBH", data, node)
+        for i in range(count):
+            if is_leaf:
+                leaves.append(struct.unpack_from("<QQ", data,
+                                                 node + 4 + i * 32 + 16))
+            else:
+                nodes.append(struct.unpack_from("<Q", data,
+                                                node + 4 + i * 24 + 16)[0])
+    return item_count, leaves
+
+def test_spec_layout(zoomfile):
+    # checked against the layout in the bigWig spec (Kent et al. 2010),
+    # without the readers of the module
+    data = zoomfile.read_bytes()
+    (magic, version, zoom_levels, chrom_tree_offset, data_offset,
+     index_offset, field_count, defined_field_count, autosql_offset,
+     summary_offset, uncompress_buf_size, _) = struct.unpack_from(
+         "<IHHQQQHHQQIQ", data
+     )
+    assert magic == 0x888FFC26
+    assert version >= 4
+    assert (field_count, defined_field_count, autosql_offset) == (0, 0, 0)
+    assert struct.unpack_from("<I", data, chrom_tree_offset)[0] == 0x78CA8C91
+    assert struct.unpack_from("<Qdddd", data, summary_offset) == (
+        10000, 0., 9., 45000., 285000.
+    )
+
+    # the data count is the number of the data sections
+    item_count, sections = _spec_leaves(data, index_offset)
+    assert struct.unpack_from("<Q", data, data_offset)[0] == item_count
+    assert item_count == len(sections) == 10
+    nitems = 0
+    for offset, size in sections:
+        content = zlib.decompress(data[offset:offset + size])
+        assert len(content) <= uncompress_buf_size
+        (_, start, end, step, span, section_type, _,
+         count) = struct.unpack_from("<IIIIIBBH", content)
+        assert (step, span, section_type) == (1, 1, 3)
+        assert end - start == count
+        nitems += count
+    assert nitems == 10000
+
+    assert 0 < zoom_levels <= 10
+    reductions = []
+    for i in range(zoom_levels):
+        (reduction, reserved, zoom_offset,
+         zoom_index_offset) = struct.unpack_from("<IIQQ", data, 64 + i * 24)
+        assert reserved == 0
+        reductions.append(reduction)
+        # the zoom data count is the number of the zoom records
+        zoom_count = struct.unpack_from("<I", data, zoom_offset)[0]
+        zoom_sections = _spec_leaves(data, zoom_index_offset)[1]
+        records = b"".join(zlib.decompress(data[offset:offset + size])
+                           for offset, size in zoom_sections)
+        assert zoom_offset + 4 <= zoom_sections[0][0]
+        assert len(records) == zoom_count * 32
+        assert zoom_count == -(-10000 // reduction)
+        bases = [record[3] for record in struct.iter_unpack("<IIIIffff",
+                                                            records)]
+        assert sum(bases) == 10000
+    assert reductions == sorted(reductions)
+
+def test_pybigwig(wigfile, bwfile, zoomfile):
+    try:
+        import pyBigWig as pybigwig
+    except ImportError: # not installed, or built without numpy around
+        pytest.skip("pyBigWig not available")
+    bwf = pybigwig.open(str(bwfile))
+    try:
+        assert bwf.chroms() == {"chr1": 1000, "chr2": 100}
+        header = bwf.header()
+        assert header["nBasesCovered"] == 4 * 5 + 3 * 2 + 2
+        # pyBigWig truncates the summary values in the header to integers
+        assert (header["minVal"], header["maxVal"]) == (0, 4)
+        assert bwf.stats("chr2", type="min", exact=True) == [.25]
+        assert list(bwf.intervals("chr1")) == [
+            (10, 15, 1.5), (20, 25, 2.5), (30, 35, 3.5), (40, 45, 4.5),
+            (100, 102, 1.0), (104, 106, 2.0), (119, 121, 3.0)
+        ]
+        assert list(bwf.intervals("chr2")) == [(0, 1, .5), (1, 2, .25)]
+    finally:
+        bwf.close()
+
+    bwf = pybigwig.open(str(zoomfile))
+    try:
+        assert bwf.header()["nLevels"] == len(
+            BigWigFile(zoomfile).zoom_levels
+        )
+        # summarized by the zoom levels
+        assert bwf.stats("chr1", 0, 10000, type="mean") == [
+            pytest.approx(4.5)
+        ]
+        assert bwf.stats("chr1", 0, 10000, type="max") == [9.]
+    finally:
+        bwf.close()
+
+@pytest.mark.skipif(not shutil.which("bigWigInfo"),
+                    reason="UCSC bigWigInfo not found")
+def test_ucsc_bigwiginfo(zoomfile):
+    info = dict(
+        line.split(":", 1) for line in subprocess.run(
+            ["bigWigInfo", str(zoomfile)], check=True,
+            stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout.splitlines() if ":" in line
+    )
+    assert int(info["version"]) >= 4
+    assert int(info["zoomLevels"]) == len(BigWigFile(zoomfile).zoom_levels)
+    assert int(info["chromCount"]) == 1
+    assert int(info["basesCovered"].replace(",", "")) == 10000
+    assert float(info["mean"]) == pytest.approx(4.5)
+    assert (float(info["min"]), float(info["max"])) == (0., 9.)
+
+@pytest.mark.skipif(not shutil.which("bigWigToBedGraph"),
+                    reason="UCSC bigWigToBedGraph not found")
+def test_ucsc_bigwigtobedgraph(bwfile, tmp_path):
+    bedfile = tmp_path / 'test_wiggle_bigwig_ucsc.bedGraph'
+    subprocess.run(["bigWigToBedGraph", str(bwfile), str(bedfile)],
+                   check=True)
+    assert bedfile.read_text().splitlines()[:2] == [
+        "chr1\t10\t15\t1.5", "chr1\t20\t25\t2.5"
+    ]
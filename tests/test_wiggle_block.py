@@ -1,6 +1,6 @@
 import pytest
 from wigtools.wiggle import WiggleBlock, WiggleInvalidDataLine, \
-    WiggleUnsupportedStringifyFormat
+    WiggleUnsupportedStringifyFormat, FixedStepRegions
 
 def test_init():
     block = WiggleBlock(is_fixed=True, chrom="chr")
@@ -32,6 +32,23 @@ def test_end():
     block2.data = [1.1, 2.1]
     assert block2.end == 2
 
+def test_fixed_step_regions():
+    block = WiggleBlock(is_fixed=True, chrom="chr", start=10, step=5, span=5)
+    block.take_chunk("1\n2\n3\n")
+    regions = block.regions
+    assert isinstance(regions, FixedStepRegions)
+    assert len(regions) == 3
+    assert regions[-1] == 20
+    assert 15 in regions
+    assert 16 not in regions
+    assert regions == [10, 15, 20]
+    assert block.end == 24
+
+    # end cache is reset and the view follows the new data
+    block.take("4\n")
+    assert block.end == 29
+    assert regions[-1] == 25
+
 def test_block_id():
     block = WiggleBlock(is_fixed=True, chrom="chr", start=1, step=1)
     assert block.block_id == "chr:1"
@@ -152,6 +169,12 @@ def test_subset():
     ssblock = block.subset(("chr", 2, 4))
     assert ssblock.regions == [2, 3]
     assert ssblock.data == [.55, 2.1]
+    assert block.subset_data(("chr", 2, 4)) == [.55, 2.1]
+    assert list(block.subset_data(("chr", 2, 4), partial="whole")) == [
+        1.1, 2.1
+    ]
+    assert list(block.subset_data(("chr", 1, 3), qbase=0)) == [.55, 1.05]
+    assert not block.subset_data(("chr2", 2, 4))
 
     ssblock2 = block.subset(("chr", 2, 4), partial="whole")
     assert ssblock2.regions == [2, 3]
@@ -190,3 +213,90 @@ def test_stats():
 
     block.take("6.1\n")
     assert pytest.approx(block.stats("median")["median"]) == 3.6
+
+    block.take("0\n") # 13, 14
+    assert block.stats(["median", "std", "nonzero", "coverage"]) == dict(
+        median=pytest.approx(3.1),
+        std=pytest.approx(2.021617861),
+        nonzero=6,
+        coverage=1.0
+    )
+
+def test_region_sums():
+    block = WiggleBlock(is_fixed=True, chrom="chr", start=1, step=2, span=2)
+    block.take_parsed([1., 2., 3.]) # 1-2, 3-4, 5-6
+    assert list(block.cumsum) == [0., 1., 3., 6.]
+    assert list(block.cumsum_sq) == [0., 1., 5., 14.]
+    assert block.region_sums(("chr", 2, 5)) == (3, .5 + 2. + 1.5, None)
+    assert block.region_sums(("chr", 2, 5), partial="whole",
+                             squares=True) == (3, 6., 14.)
+    assert block.region_sums(("chr", 2, 5), squares=True)[2] == (
+        .25 + 4. + 2.25
+    )
+    assert block.region_sums(("chr", 7, 9)) == (0, 0., None)
+
+    # reset when data is taken in
+    block.take_parsed([4.])
+    assert list(block.cumsum) == [0., 1., 3., 6., 10.]
+    assert block.region_sums(("chr", 1, 8)) == (4, 10., None)
+
+def test_compact():
+    block = WiggleBlock(is_fixed=False, chrom="chr", compact=True)
+    block.take("1\t1.1\n")
+    block.take("3\t2.1\n")
+
+    assert block.data.typecode == 'd'
+    assert block._regions.typecode == 'q'
+    assert list(block.data) == [1.1, 2.1]
+    assert list(block.regions) == [1, 3]
+    assert block.end == 3
+    assert block._stringify_to_wiggle() == """\
+variableStep chrom=chr span=1
+1	1.1
+3	2.1
+"""
+    ssblock = block.subset(("chr", 2, 3))
+    assert ssblock.compact
+    assert list(ssblock.data) == [2.1]
+    assert block.stats(["sum", "count"]) == dict(sum=1.1 + 2.1, count=2)
+
+def test_take_chunk():
+    block = WiggleBlock(is_fixed=True, chrom="chr", start=1, step=1)
+    block.take_chunk("1.1\n\n2.1\n")
+    block.take_chunk("3.1")
+    assert block.data == [1.1, 2.1, 3.1]
+    assert block.end == 3
+
+    with pytest.raises(WiggleInvalidDataLine):
+        block.take_chunk("1\t2\n")
+    with pytest.raises(WiggleInvalidDataLine):
+        block.take_chunk("1\n \n")
+
+    block2 = WiggleBlock(is_fixed=False, chrom="chr", compact=True)
+    block2.take_chunk(b"10\t1.1\r\n20 2.1\r\n")
+    assert list(block2.data) == [1.1, 2.1]
+    assert list(block2.regions) == [10, 20]
+    assert block2.start == 10
+
+    with pytest.raises(WiggleInvalidDataLine):
+        block2.take_chunk("30\t3.1\n3.1\n")
+    # 1 column + 3 columns
+    with pytest.raises(WiggleInvalidDataLine):
+        block2.take_chunk("3.1\n30\t3.1\t4\n")
+
+def test_stringify_in_chunks(monkeypatch):
+    from wigtools import wiggle
+    monkeypatch.setattr(wiggle, "STRINGIFY_CHUNK_SIZE", 2)
+    block = WiggleBlock(is_fixed=False, chrom="chr", span=2)
+    block.take_chunk("1\t1.1\n3\t2.1\n5\t3.1\n")
+
+    assert list(block._iter_wiggle_chunks(0)) == [
+        "variableStep chrom=chr span=2\n",
+        "0\t1.1\n2\t2.1\n",
+        "4\t3.1\n",
+    ]
+    assert block.stringify(base=0, fmt="bedgraph") == """\
+chr	0	1	1.1
+chr	2	3	2.1
+chr	4	5	3.1
+"""
@@ -0,0 +1,92 @@
+import pytest
+from wigtools.wiggle import Wiggle
+from wigtools.collapse import collapse_blocks
+
+WIGGLE = """\
+variableStep chrom=chr1
+1\t1
+2\t1
+3\t1
+4\t1
+5\t1
+6\t2
+10\t3
+20\t4
+30\t5
+40\t6
+variableStep chrom=chr1
+41\t6
+42\t7
+fixedStep chrom=chr2 start=1 step=10 span=5
+1
+2
+"""
+
+@pytest.fixture
+def wigfile(tmp_path):
+    path = tmp_path / 'test_wiggle_collapse.wig'
+    path.write_text(WIGGLE)
+    return path
+
+def _per_base(blocks):
+    """Expand the blocks to the values of each base"""
+    ret = {}
+    for block in blocks:
+        for pos, value in zip(block.regions, block.data):
+            for i in range(block.span):
+                ret[(block.chrom, pos + i)] = value
+    return ret
+
+def _collapse(wigfile, *args, **kwargs):
+    return list(collapse_blocks(Wiggle.iter_blocks(wigfile, compact=True),
+                                *args, **kwargs))
+
+def test_collapse_blocks(wigfile):
+    blocks = _collapse(wigfile)
+    assert _per_base(blocks) == _per_base(Wiggle.iter_blocks(wigfile))
+    assert "".join(block.stringify() for block in blocks) == """\
+fixedStep chrom=chr1 span=5 start=1 step=5
+1.0
+variableStep chrom=chr1 span=1
+6\t2.0
+fixedStep chrom=chr1 span=1 start=10 step=10
+3.0
+4.0
+5.0
+6.0
+variableStep chrom=chr1 span=1
+41\t6.0
+42\t7.0
+fixedStep chrom=chr2 span=5 start=1 step=10
+1.0
+2.0
+"""
+
+def test_collapse_blocks_tolerance(wigfile):
+    blocks = _collapse(wigfile, 1.)
+    assert (blocks[0].start, blocks[0].span, list(blocks[0].data)) == (
+        1, 6, [1.5]
+    )
+    # the runs over the tolerance are not merged
+    assert _per_base(_collapse(wigfile, .5)) == pytest.approx(
+        _per_base(Wiggle.iter_blocks(wigfile))
+    )
+
+def test_collapse_blocks_bedgraph(wigfile):
+    # every run of two or more data points is merged
+    blocks = _collapse(wigfile, min_run=2)
+    assert "".join(block.stringify(fmt="bedgraph")
+                   for block in blocks).splitlines()[-4:] == [
+        "chr1\t40\t41\t6.0",
+        "chr1\t42\t42\t7.0",
+        "chr2\t1\t5\t1.0",
+        "chr2\t11\t15\t2.0",
+    ]
+
+def test_collapse_blocks_size(wigfile):
+    blocks = _collapse(wigfile, block_size=2)
+    assert max(len(block.data) for block in blocks) == 2
+    assert _per_base(blocks) == _per_base(Wiggle.iter_blocks(wigfile))
+
+def test_collapse_blocks_empty():
+    assert list(collapse_blocks([])) == []
@@ -0,0 +1,76 @@
+import gzip
+import pytest
+from wigtools.wiggle import Wiggle, open_output
+from wigtools.index import build_index, fetch_blocks
+from wigtools.compress import (BGZF_BLOCK_SIZE, WiggleCompressionError,
+                               detect_compression, open_input,
+                               output_compression, to_virtual_offsets)
+
+WIGGLE = "".join(
+    f"fixedStep chrom=chr{chrom} start=1 step=10 span=5\n" +
+    "".join(f"{i / 7:.6f}\n" for i in range(20000))
+    for chrom in (1, 2, 3)
+)
+
+@pytest.fixture(params=[1, 3])
+def bgzfile(request, tmp_path):
+    path = tmp_path / 'test_wiggle_compress.wig.gz'
+    with open_output(path, jobs=request.param) as fout:
+        fout.write(WIGGLE)
+    return path
+
+def test_output_compression():
+    assert output_compression("a.wig.gz") == "bgzf"
+    assert output_compression("a.wig.BGZ") == "bgzf"
+    assert output_compression("a.wig.zst") == "zstd"
+    assert output_compression("a.wig") is None
+    assert output_compression("/dev/stdout") is None
+
+def test_bgzf(bgzfile, tmp_path):
+    assert detect_compression(bgzfile) == "bgzf"
+    # readable by any gzip reader
+    with gzip.open(bgzfile, 'rt') as fgz:
+        assert fgz.read() == WIGGLE
+
+    for jobs in (1, 4):
+        with open_input(bgzfile, binary=False, jobs=jobs) as fin:
+            assert fin.read() == WIGGLE
+
+    gzfile = tmp_path / 'test_wiggle_compress_gzip.gz'
+    with gzip.open(gzfile, 'wt') as fgz:
+        fgz.write(WIGGLE)
+    assert detect_compression(gzfile) == "gzip"
+    with open_input(gzfile, jobs=2) as fin:
+        assert fin.read() == WIGGLE.encode()
+
+    assert detect_compression(tmp_path / 'nonexisting') is None
+
+def test_virtual_offsets(bgzfile):
+    data = WIGGLE.encode()
+    offsets = [0, 100, BGZF_BLOCK_SIZE, len(data) - 10]
+    with open_input(bgzfile) as fin:
+        for offset, voffset in zip(offsets,
+                                   to_virtual_offsets(bgzfile, offsets)):
+            fin.seek(voffset)
+            assert fin.read(10) == data[offset:offset + 10]
+
+def test_index_bgzf(bgzfile, tmp_path):
+    records = build_index(bgzfile)
+    assert [record.chrom for record in records] == ["chr1", "chr2", "chr3"]
+    assert records[1].offset > 1 << 16
+    # decompressed by threads
+    assert build_index(bgzfile, jobs=2) == records
+
+    blocks = list(fetch_blocks(bgzfile, records[::-1]))
+    assert [block.chrom for block in blocks] == ["chr3", "chr2", "chr1"]
+    assert len(blocks[0].data) == 20000
+    assert blocks[0].data[-1] == pytest.approx(19999 / 7)
+
+    wiggle = Wiggle(bgzfile)
+    assert list(wiggle.blocks) == ["chr1:1", "chr2:1", "chr3:1"]
+
+    gzfile = tmp_path / 'test_wiggle_compress_index.gz'
+    with gzip.open(gzfile, 'wt') as fgz:
+        fgz.write(WIGGLE)
+    with pytest.raises(WiggleCompressionError):
+        build_index(gzfile)
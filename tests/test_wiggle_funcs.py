@@ -1,4 +1,3 @@
-import hashlib
 import pytest
 from wigtools import wiggle
 
@@ -62,14 +61,77 @@ def test_intersect_regions(reg1, reg2, base1, base2, expected):
     assert wiggle._intersect_regions(reg1, reg2, base1, base2) == expected
 
 @pytest.mark.parametrize("chrom,expected", [
-    ("1", 1),
-    ("X", 23),
-    ("Y", 24),
-    ("M", 25),
-    ("MT", 26),
-    ("27", 27),
-    ("chr99", 99),
-    ("abc", int(hashlib.sha1(b"abc").hexdigest(), 16) % (10 ** 8)),
+    ("1", (1, 1, ())),
+    ("X", (1, 23, ())),
+    ("Y", (1, 24, ())),
+    ("M", (1, 25, ())),
+    ("MT", (1, 26, ())),
+    ("27", (1, 27, ())),
+    ("chr99", (1, 99, ())),
+    ("abc", (2, 0, ("abc",))),
+    ("chrUn_12", (2, 0, ("Un_", 12, ""))),
 ])
 def test_chrom_to_sortable(chrom, expected):
-    assert wiggle._chrom_to_sortable(chrom) == expected
\ No newline at end of file
+    assert wiggle._chrom_to_sortable(chrom) == expected
+
+def test_chrom_to_sortable_order():
+    chroms = ["scaffold_10", "chrY", "chr10", "1", "chr1", "chr2",
+              "scaffold_2", "chrM", "chrUn_1", "abc"]
+    assert sorted(chroms, key=lambda chrom: (wiggle._chrom_to_sortable(chrom),
+                                             chrom)) == [
+        "1", "chr1", "chr2", "chr10", "chrY", "chrM", "chrUn_1", "abc",
+        "scaffold_2", "scaffold_10"
+    ]
+    # deterministic regardless of the order given
+    assert sorted(reversed(chroms),
+                  key=wiggle._chrom_to_sortable)[2:] == [
+        "chr2", "chr10", "chrY", "chrM", "chrUn_1", "abc",
+        "scaffold_2", "scaffold_10"
+    ]
+
+def test_chrom_order(tmp_path):
+    chromfile = tmp_path / 'test_chrom_order.fai'
+    chromfile.write_text("# comment\nchrY\t10\nchr2\t10\nchr1\t5\n")
+    chroms = wiggle.read_chrom_order(chromfile)
+    assert chroms == ["chrY", "chr2", "chr1"]
+
+    wiggle.set_chrom_order(chroms)
+    try:
+        assert wiggle._chrom_to_sortable("chrY") == (0, 0, ())
+        assert wiggle._chrom_to_sortable("chr1") == (0, 2, ())
+        # not in the order, put after them
+        assert wiggle._chrom_to_sortable("chr3") == (1, 3, ())
+        assert wiggle.WiggleBlock(is_fixed=True,
+                                  chrom="chr2").chrom_key == (0, 1, ())
+    finally:
+        wiggle.set_chrom_order(None)
+    assert wiggle._chrom_to_sortable("chrY") == (1, 24, ())
+
+def test_iter_block_stats_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(wiggle, "STATS_TASK_SIZE", 3)
+    wigfile = tmp_path / 'test_wiggle_funcs_block_stats.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr2 span=2
+5\t5
+7\t6
+fixedStep chrom=chr start=1 step=1
+1
+2
+3
+4
+variableStep chrom=chr3
+1\t1.5
+""")
+    wbinfile = tmp_path / 'test_wiggle_funcs_block_stats.wbin'
+    wiggle.Wiggle(wigfile, compact=True).save_wbin(wbinfile)
+
+    serial = list(wiggle.iter_block_stats(
+        wiggle.Wiggle.iter_blocks(wigfile), ["sum", "bp"]
+    ))
+    assert serial == [("chr2", 5, 8, dict(sum=11.0, bp=4)),
+                      ("chr", 1, 4, dict(sum=10.0, bp=4)),
+                      ("chr3", 1, 1, dict(sum=1.5, bp=1))]
+    # data of wbin files are memoryviews
+    assert list(wiggle.iter_block_stats(
+        wiggle.Wiggle.iter_blocks(wbinfile), ["sum", "bp"], jobs=2
+    )) == serial
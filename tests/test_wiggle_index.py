@@ -0,0 +1,115 @@
+import os
+import sys
+import pytest
+from wigtools.index import build_index, write_index, read_index, \
+    fetch_blocks, fetch_wiggle, index_file, query_records, copy_blocks
+
+WIGGLE = """\
+variableStep chrom=chr span=2
+1\t1.0
+3\t2.0
+
+5\t3.0
+fixedStep chrom=chr start=10 step=2 span=2
+1.0
+2.0
+3.0
+fixedStep chrom=chr start=100 step=1
+variableStep chrom=chr2
+5\t5.0
+"""
+
+@pytest.fixture
+def wigfile(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_index.wig'
+    wigfile.write_text(WIGGLE)
+    return wigfile
+
+def test_build_index(wigfile):
+    records = build_index(wigfile)
+    assert len(records) == 3
+    assert [(rec.chrom, rec.start, rec.end, rec.nlines)
+            for rec in records] == [("chr", 1, 6, 3),
+                                    ("chr", 10, 15, 3),
+                                    ("chr2", 5, 5, 1)]
+    assert [record.end for record in build_index(wigfile, base=0)] == [
+        7, 16, 6
+    ]
+    assert records[1].is_fixed
+    assert records[1].step == 2
+    assert records[0].offset == 0
+    content = wigfile.read_bytes()
+    assert content[records[1].offset:].startswith(b"fixedStep chrom=chr start=10")
+    assert content[records[2].offset:
+                   records[2].offset + records[2].length] == (
+                       b"variableStep chrom=chr2\n5\t5.0\n"
+                   )
+
+def test_write_read_index(wigfile):
+    assert read_index(wigfile) is None
+    idxfile = write_index(wigfile)
+    assert idxfile == index_file(wigfile)
+
+    records = read_index(wigfile)
+    assert records == build_index(wigfile)
+    # ends are converted to the base
+    assert read_index(wigfile, base=0)[0].end == 7
+
+    # outdated
+    stat = os.stat(wigfile)
+    os.utime(wigfile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert read_index(wigfile) is None
+
+def test_fetch(wigfile):
+    records = build_index(wigfile)
+    blocks = list(fetch_blocks(wigfile, records[1:], compact=True))
+    assert [block.block_id for block in blocks] == ["chr:10", "chr2:5"]
+    assert list(blocks[0].data) == [1.0, 2.0, 3.0]
+
+    wiggle = fetch_wiggle(wigfile, [("chr2", 1, 10), ("chr", 12, 13)],
+                          records)
+    assert list(wiggle.blocks) == ["chr:10", "chr2:5"]
+
+    reshaped = wiggle.reshape([("chr", 12, 13)])
+    assert reshaped.blocks["chr:12"].regions == [12]
+    assert reshaped.blocks["chr:12"].data == [2.0]
+
+def test_query_records(wigfile):
+    records = build_index(wigfile)
+    # in the order of the regions, each block once
+    found = query_records(records, [("chr2", 1, 10), ("chr", 5, 12),
+                                    ("chr", 1, 2)])
+    assert [(rec.chrom, rec.start) for rec in found] == [
+        ("chr2", 5), ("chr", 1), ("chr", 10)
+    ]
+    assert query_records(records, [("chr", 9, 10)], qbase=0) == [records[1]]
+
+@pytest.mark.parametrize("sendfile_min_size", [1 << 20, 1])
+def test_copy_blocks(wigfile, tmp_path, monkeypatch, sendfile_min_size):
+    # wigtools.index is shadowed by the index command in wigtools
+    monkeypatch.setattr(sys.modules["wigtools.index"], "SENDFILE_MIN_SIZE",
+                        sendfile_min_size)
+    records = build_index(wigfile)
+    outfile = tmp_path / 'test_wiggle_index_copy.wig'
+    with open(outfile, 'wb') as fout:
+        assert copy_blocks(wigfile, records[::-1], fout, add_span=True) == 3
+    assert outfile.read_text() == """\
+variableStep chrom=chr2 span=1
+5\t5.0
+fixedStep chrom=chr start=10 step=2 span=2
+1.0
+2.0
+3.0
+variableStep chrom=chr span=2
+1\t1.0
+3\t2.0
+
+5\t3.0
+"""
+
+def test_index_module():
+    # the index command of the CLI does not shadow the submodule
+    import wigtools
+    from wigtools import index
+    assert index is sys.modules["wigtools.index"]
+    assert callable(wigtools.index_cmd)
@@ -0,0 +1,90 @@
+import pytest
+from wigtools.wiggle import Wiggle, WiggleUnsortedFile
+from wigtools.merging import WiggleUnsupportedMergeOperation, merge_blocks
+
+TRACK1 = """\
+fixedStep chrom=chr1 start=1 step=10 span=10
+1
+2
+3
+variableStep chrom=chr2
+5\t1
+"""
+TRACK2 = """\
+variableStep chrom=chr1 span=5
+3\t10
+15\t20
+100\t7
+"""
+TRACK3 = """\
+variableStep chrom=chr1 span=1
+2\t4
+3\t6
+4\t8
+fixedStep chrom=chr3 start=10 step=1 span=1
+1
+"""
+
+@pytest.fixture
+def tracks(tmp_path):
+    paths = []
+    for i, content in enumerate((TRACK1, TRACK2, TRACK3)):
+        path = tmp_path / f'test_wiggle_merging_{i}.wig'
+        path.write_text(content)
+        paths.append(path)
+    return paths
+
+def _per_base(blocks):
+    """Expand the blocks to the values of each base"""
+    ret = {}
+    for block in blocks:
+        for pos, value in zip(block.regions, block.data):
+            for i in range(block.span):
+                assert (block.chrom, pos + i) not in ret
+                ret[(block.chrom, pos + i)] = value
+    return ret
+
+def _brute_force(paths, op):
+    values = {}
+    for path in paths:
+        for key, value in _per_base(Wiggle.iter_blocks(path)).items():
+            values.setdefault(key, []).append(value)
+    funcs = dict(sum=sum, max=max, min=min, count=len,
+                 mean=lambda vals: sum(vals) / len(vals))
+    return {key: float(funcs[op](vals)) for key, vals in values.items()}
+
+@pytest.mark.parametrize("op", ["sum", "mean", "max", "min", "count"])
+@pytest.mark.parametrize("chunk_size", [None, 3, 7])
+def test_merge_blocks(tracks, op, chunk_size):
+    blocks = list(merge_blocks([Wiggle.iter_blocks(path) for path in tracks],
+                               op, chunk_size=chunk_size))
+    assert _per_base(blocks) == pytest.approx(_brute_force(tracks, op))
+    assert [block.chrom for block in blocks][-2:] == ["chr2", "chr3"]
+    if chunk_size != 3:
+        # the segments cut by the chunks are joined back
+        assert [(block.start, block.span, len(block.data))
+                for block in blocks[:4]] == [(1, 1, 4), (5, 3, 2), (11, 4, 1),
+                                             (15, 5, 1)]
+
+def test_merge_blocks_chunk_points(tracks):
+    # blocks have at most chunk_size data points
+    blocks = list(merge_blocks([Wiggle.iter_blocks(tracks[2])],
+                               "sum", chunk_size=2))
+    assert [len(block.data) for block in blocks] == [2, 1, 1]
+
+def test_merge_blocks_base0(tracks):
+    blocks = list(merge_blocks(
+        [Wiggle.iter_blocks(path, base=0) for path in tracks[:2]], "sum",
+        base=0
+    ))
+    assert blocks[0].base == 0
+    assert (blocks[0].start, blocks[0].span) == (1, 2)
+
+def test_merge_blocks_errors(tracks, tmp_path):
+    with pytest.raises(WiggleUnsupportedMergeOperation):
+        list(merge_blocks([Wiggle.iter_blocks(tracks[0])], "median"))
+
+    unsorted = tmp_path / 'test_wiggle_merging_unsorted.wig'
+    unsorted.write_text(TRACK1 + TRACK2)
+    with pytest.raises(WiggleUnsortedFile):
+        list(merge_blocks([Wiggle.iter_blocks(unsorted)], "sum"))
@@ -0,0 +1,115 @@
+import pytest
+from wigtools.wiggle import Wiggle
+from wigtools.index import build_index
+from wigtools.sorting import parse_size, sort_records, copy_sorted_blocks, \
+    iter_sorted_blocks, can_copy_sorted, check_sorted
+
+WIGGLE = """\
+track name=test
+variableStep chrom=chr2 span=1
+5\t5
+variableStep chrom=chr1
+3\t1
+4\t2
+fixedStep chrom=chr1 start=1 step=1
+7
+8
+variableStep chrom=chr1
+3\t9
+variableStep chrom=chr1 span=2
+10\t1"""
+
+@pytest.fixture
+def wigfile(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_sorting.wig'
+    wigfile.write_text(WIGGLE)
+    return wigfile
+
+@pytest.mark.parametrize("size, expected", [
+    (100, 100),
+    ("100", 100),
+    ("1k", 1024),
+    ("1.5M", 1536 * 1024),
+    ("2GB", 2 << 30),
+])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+def test_parse_size_error():
+    with pytest.raises(ValueError):
+        parse_size("1X")
+
+def test_sort_records(wigfile):
+    records = sort_records(build_index(wigfile))
+    # the second chr1:3 is dropped
+    assert [(record.chrom, record.start) for record in records] == [
+        ("chr1", 1), ("chr1", 3), ("chr1", 10), ("chr2", 5)
+    ]
+
+def test_sort_records_same_key(tmp_path):
+    # chr1 and 1 share the sort key of the chromosome, but are kept apart
+    wigfile = tmp_path / 'test_wiggle_sorting_same_key.wig'
+    wigfile.write_text("variableStep chrom=chr1\n5\t1\n"
+                       "variableStep chrom=1\n1\t1\n"
+                       "variableStep chrom=chr1\n1\t1\n"
+                       "variableStep chrom=1\n5\t1\n")
+    records = sort_records(build_index(wigfile))
+    assert [(record.chrom, record.start) for record in records] == [
+        ("1", 1), ("1", 5), ("chr1", 1), ("chr1", 5)
+    ]
+    assert check_sorted(wigfile) is not None
+    blocks = iter_sorted_blocks(Wiggle.iter_blocks(wigfile, compact=True))
+    assert [block.block_id for block in blocks] == [
+        "1:1", "1:5", "chr1:1", "chr1:5"
+    ]
+
+def test_copy_sorted_blocks(wigfile, tmp_path):
+    assert can_copy_sorted(wigfile)
+    outfile = tmp_path / 'test_wiggle_sorting_copied.wig'
+    assert copy_sorted_blocks(wigfile, outfile) == 4
+    assert outfile.read_text() == """\
+fixedStep chrom=chr1 start=1 step=1
+7
+8
+variableStep chrom=chr1
+3\t1
+4\t2
+variableStep chrom=chr1 span=2
+10\t1
+variableStep chrom=chr2 span=1
+5\t5
+"""
+
+@pytest.mark.parametrize("max_memory", [1, 1 << 30])
+def test_iter_sorted_blocks(wigfile, tmp_path, max_memory):
+    wiggle = Wiggle(wigfile, compact=True)
+    wiggle.sort()
+    blocks = list(iter_sorted_blocks(Wiggle.iter_blocks(wigfile,
+                                                        compact=True),
+                                     max_memory, tmpdir=tmp_path))
+    assert [block.block_id for block in blocks] == list(wiggle.blocks)
+    assert "".join(block.stringify() for block in blocks) == \
+        wiggle.stringify()
+    # temporary files are removed
+    assert list(tmp_path.iterdir()) == [wigfile]
+
+def test_copy_sorted_unchanged(wigfile, tmp_path):
+    sortedfile = tmp_path / 'test_wiggle_sorting_sorted.wig'
+    copy_sorted_blocks(wigfile, sortedfile)
+    sortedfile.write_text("track name=sorted\n" + sortedfile.read_text())
+    outfile = tmp_path / 'test_wiggle_sorting_unchanged.wig'
+    assert copy_sorted_blocks(sortedfile, outfile) == 4
+    assert outfile.read_text() == sortedfile.read_text()
+
+def test_check_sorted(wigfile, tmp_path):
+    prev, block = check_sorted(wigfile)
+    assert (prev.chrom, prev.start) == ("chr2", 5)
+    assert (block.chrom, block.start) == ("chr1", 3)
+
+    sortedfile = tmp_path / 'test_wiggle_sorting_check.wig'
+    copy_sorted_blocks(wigfile, sortedfile)
+    assert check_sorted(sortedfile) is None
+
+    wbinfile = tmp_path / 'test_wiggle_sorting_check.wbin'
+    Wiggle(wigfile).save_wbin(wbinfile)
+    assert check_sorted(wbinfile)[1].block_id == "chr1:3"
@@ -0,0 +1,61 @@
+import pytest
+from wigtools.wiggle import Wiggle
+from wigtools.splitting import (WiggleUnsupportedSplitMode, block_outfile,
+                                split_blocks)
+
+WIGGLE = """\
+variableStep chrom=chr2 span=1
+1\t1
+2\t2
+fixedStep chrom=chr1 start=11 step=10 span=5
+1.5
+2.5
+variableStep chrom=chr2 span=1
+5\t5
+6\t6
+fixedStep chrom=chr3 start=1 step=1 span=1
+0.5
+"""
+
+@pytest.fixture
+def wigfile(tmp_path):
+    path = tmp_path / 'test_wiggle_splitting.wig'
+    path.write_text(WIGGLE)
+    return path
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_split_by_block(wigfile, tmp_path, jobs):
+    outprefix = str(tmp_path / f'block{jobs}')
+    assert split_blocks(Wiggle.iter_blocks(wigfile), outprefix,
+                        jobs=jobs) == 4
+    blocks = list(Wiggle.iter_blocks(wigfile))
+    assert block_outfile(outprefix, blocks[1]) == outprefix + "_chr1_11_25.wig"
+    for block in blocks:
+        with open(block_outfile(outprefix, block)) as fout:
+            assert fout.read() == block.stringify()
+
+@pytest.mark.parametrize("jobs,max_open", [(1, 64), (1, 1), (2, 1)])
+def test_split_by_chrom(wigfile, tmp_path, jobs, max_open):
+    outprefix = str(tmp_path / f'chrom{jobs}_{max_open}')
+    # leftovers of previous runs are overwritten
+    with open(outprefix + "_chr2.wig", "w") as fout:
+        fout.write("previous\n")
+    assert split_blocks(Wiggle.iter_blocks(wigfile), outprefix, by="chrom",
+                        jobs=jobs, max_open=max_open) == 3
+
+    with open(outprefix + "_chr2.wig") as fout:
+        assert fout.read() == """\
+variableStep chrom=chr2 span=1
+1\t1.0
+2\t2.0
+variableStep chrom=chr2 span=1
+5\t5.0
+6\t6.0
+"""
+    with open(outprefix + "_chr3.wig") as fout:
+        assert fout.read() == "fixedStep chrom=chr3 span=1 start=1 step=1\n0.5\n"
+
+def test_split_unsupported(wigfile, tmp_path):
+    with pytest.raises(WiggleUnsupportedSplitMode):
+        split_blocks(Wiggle.iter_blocks(wigfile), str(tmp_path / 'x'),
+                     by="region")
@@ -0,0 +1,73 @@
+import random
+import pytest
+from array import array
+from wigtools.stats import quantile, P2Quantile, StatsAccumulator, \
+    WiggleUnsupportedStatistic, block_stats
+
+@pytest.mark.parametrize("values, prob, expected", [
+    ([3, 1, 2], .5, 2),
+    ([4, 1, 3, 2], .5, 2.5),
+    ([5, 5, 5, 1], .5, 5),
+    ([1, 2, 3, 4, 5], .25, 2),
+    ([4, 3, 2, 1], .75, 3.25),
+    ([7], .25, 7),
+])
+def test_quantile(values, prob, expected):
+    assert quantile(values, prob) == pytest.approx(expected)
+
+def test_p2_quantile():
+    rand = random.Random(8525)
+    values = [rand.random() for _ in range(10000)]
+    sketch = P2Quantile(.5)
+    assert sketch.value() != sketch.value() # nan
+    for value in values[:3]:
+        sketch.add(value)
+    # exact for less than 5 values
+    assert sketch.value() == quantile(values[:3], .5)
+    for value in values[3:]:
+        sketch.add(value)
+    assert sketch.value() == pytest.approx(quantile(values, .5), abs=.02)
+
+def test_accumulator():
+    acc = StatsAccumulator(["min", "max", "mean", "std", "sum", "count",
+                            "nonzero", "median", "q25", "q75"])
+    acc.update([2., 0.])
+    acc.update(array('f', [4., 6., 0.]))
+    acc.update([])
+    assert acc.result() == dict(
+        min=0., max=6., mean=2.4, sum=12., count=5, nonzero=3,
+        std=pytest.approx(2.33238075), median=2., q25=0., q75=4.
+    )
+
+    with pytest.raises(WiggleUnsupportedStatistic):
+        StatsAccumulator(["mode"])
+
+def test_accumulator_precision():
+    # the squared deviations are shifted, not taken from the raw squares
+    acc = StatsAccumulator(["std", "mean", "min", "max"])
+    acc.update([1e9 + 1., 1e9 + 3.])
+    acc.update(array('d', [1e9 + 5., 1e9 + 7.]))
+    assert acc.result() == dict(std=pytest.approx(5 ** .5), mean=1e9 + 4.,
+                                min=1e9 + 1., max=1e9 + 7.)
+
+def test_accumulator_update_sums():
+    acc = StatsAccumulator(["mean", "std", "count"])
+    acc.update([2., 0.])
+    acc.update_sums(3, 10., 52.) # 4, 6, 0
+    acc.update_sums(0, 0.)
+    assert acc.result() == dict(mean=2.4, count=5,
+                                std=pytest.approx(2.33238075))
+
+def test_block_stats():
+    assert block_stats([1., 0., 3.], span=2, what=["bp", "coverage"],
+                       length=10) == dict(bp=6, coverage=.6)
+    assert block_stats([3., 1., 2.], what="median", approx=True) == dict(
+        median=2.
+    )
+
+def test_stats_module():
+    # the stats command of the CLI does not shadow the submodule
+    import wigtools
+    from wigtools import stats
+    assert type(wigtools.stats) is type(stats) is type(random)
+    assert stats.StatsAccumulator is StatsAccumulator
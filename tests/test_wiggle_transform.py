@@ -0,0 +1,98 @@
+import math
+import pytest
+from wigtools.wiggle import Wiggle, WiggleBlock
+from wigtools.transform import (WiggleTransformError, load_summary,
+                                parse_operation, summary_file,
+                                transform_blocks)
+
+WIGGLE = """\
+variableStep chrom=chr1
+1\t1
+2\t3
+fixedStep chrom=chr2 start=1 step=1
+0
+10
+"""
+
+@pytest.fixture
+def wigfile(tmp_path):
+    path = tmp_path / 'test_wiggle_transform.wig'
+    path.write_text(WIGGLE)
+    return path
+
+def _transform(wigfile, *operations):
+    return [list(block.data) for block in transform_blocks(
+        Wiggle.iter_blocks(wigfile, compact=True), operations, wigfile
+    )]
+
+@pytest.mark.parametrize("compact", [True, False])
+def test_apply(compact):
+    block = WiggleBlock(is_fixed=True, chrom="chr1", start=1, step=1,
+                        compact=compact)
+    block.take_parsed([1., 2., 3.])
+    assert block.cumsum[-1] == 6.
+    assert block.apply(lambda values: map((2.).__mul__, values),
+                       lambda values: map((1.).__add__, values)) is block
+    assert list(block.data) == [3., 5., 7.]
+    assert isinstance(block.data, list) is not compact
+    # the cached sums are reset
+    assert block.cumsum[-1] == 15.
+
+def test_parse_operation():
+    assert parse_operation("scale:2") == ("scale", [2.])
+    assert parse_operation("clip::10") == ("clip", [None, 10.])
+    assert parse_operation("log") == ("log", [])
+    for spec in ("sqrt", "scale", "scale:a", "log1p:2", "clip:1:2:3",
+                 "log:0", "log:1"):
+        with pytest.raises(WiggleTransformError):
+            parse_operation(spec)
+
+def test_one_pass(wigfile):
+    assert _transform(wigfile, "scale:2", "add:1") == [[3., 7.], [1., 21.]]
+    assert _transform(wigfile, "clip:1:2") == [[1., 2.], [1., 2.]]
+    assert _transform(wigfile, "clip::2", "abs", "log1p") == [
+        [math.log1p(1), math.log1p(2)], [0., math.log1p(2)]
+    ]
+    assert _transform(wigfile, "add:1", "log:2") == [
+        [1., 2.], [0., pytest.approx(math.log2(11))]
+    ]
+    with pytest.raises(WiggleTransformError, match="apply log to"):
+        _transform(wigfile, "log")
+    with pytest.raises(WiggleTransformError, match="apply log1p to"):
+        _transform(wigfile, "add:-2", "log1p")
+    # the error of log1p is not reported as that of the log chained after
+    with pytest.raises(WiggleTransformError, match="apply log1p to"):
+        _transform(wigfile, "add:-2", "log1p", "log")
+    assert not (wigfile.parent / summary_file(wigfile.name)).exists()
+
+def test_two_pass(wigfile, capsys):
+    assert _transform(wigfile, "cpm") == [
+        [pytest.approx(1e6 / 14), pytest.approx(3e6 / 14)],
+        [0., pytest.approx(1e7 / 14)]
+    ]
+    # standardized by the values clipped first
+    zscores = _transform(wigfile, "clip::2", "zscore")
+    assert zscores == [[-1., 1.], [-1., 1.]]
+    assert "Summarizing" in capsys.readouterr().err
+
+    # summaries are cached
+    assert _transform(wigfile, "clip::2", "zscore") == zscores
+    assert "Summarizing" not in capsys.readouterr().err
+    summary = load_summary(wigfile, [("clip", [None, 2.])], [None])
+    assert summary["chr1"]["mean"] == 1.5
+
+    # outdated once the file changes
+    wigfile.write_text(WIGGLE.replace("10", "4"))
+    assert _transform(wigfile, "cpm")[1] == [0., pytest.approx(4e6 / 8)]
+    assert "Summarizing" in capsys.readouterr().err
+
+def test_two_pass_stream(wigfile):
+    with pytest.raises(WiggleTransformError):
+        list(transform_blocks(Wiggle.iter_blocks(wigfile), ["zscore"]))
+
+def test_transform_module():
+    # the transform command of the CLI does not shadow the submodule
+    import wigtools
+    from wigtools import transform
+    assert type(wigtools.transform) is type(math)
+    assert transform.transform_blocks is transform_blocks
@@ -0,0 +1,56 @@
+import pytest
+from wigtools.wiggle import Wiggle
+from wigtools.wbin import is_wbin, read_wbin, write_wbin
+
+WIGGLE = """\
+variableStep chrom=chr span=2
+1\t1.5
+3\t2.0
+3000000000\t3.0
+fixedStep chrom=chr2 start=10 step=2 span=2
+1.0
+2.25
+"""
+
+@pytest.fixture
+def wiggle(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_wbin.wig'
+    wigfile.write_text(WIGGLE)
+    return Wiggle(wigfile, compact=True)
+
+def test_is_wbin(tmp_path, wiggle):
+    assert not is_wbin(wiggle.wigfile)
+    assert not is_wbin(tmp_path / 'nonexisting')
+
+    wbinfile = tmp_path / 'test_wiggle_wbin.wbin'
+    assert wiggle.save_wbin(wbinfile) == 2
+    assert is_wbin(wbinfile)
+
+def test_read_write(tmp_path, wiggle):
+    wbinfile = tmp_path / 'test_wiggle_wbin_read_write.wbin'
+    write_wbin(wiggle.blocks.values(), wbinfile)
+    blocks = list(read_wbin(wbinfile))
+    assert len(blocks) == 2
+
+    meta, data, regions = blocks[0]
+    assert meta == dict(chrom="chr", start=1, step=None, span=2,
+                        is_fixed=False)
+    assert isinstance(data, memoryview)
+    assert data.readonly
+    assert list(data) == [1.5, 2.0, 3.0]
+    # delta overflows int32
+    assert regions.tolist() == [1, 3, 3000000000]
+
+    meta, data, regions = blocks[1]
+    assert meta["is_fixed"]
+    assert regions is None
+    assert list(data) == [1.0, 2.25]
+
+def test_wiggle_load_wbin(tmp_path, wiggle):
+    wbinfile = tmp_path / 'test_wiggle_wbin_load.wbin'
+    wiggle.save_wbin(wbinfile, float32=True)
+
+    wiggle2 = Wiggle(wbinfile)
+    assert list(wiggle2.blocks) == ["chr:1", "chr2:10"]
+    assert wiggle2.blocks["chr:1"].regions == [1, 3, 3000000000]
+    assert wiggle2.stringify() == wiggle.stringify()
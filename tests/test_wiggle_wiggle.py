@@ -1,7 +1,8 @@
 from pathlib import Path
 import pytest
 from remotedata import remotedata
-from wigtools.wiggle import Wiggle, WiggleUnsortedFile, WiggleReshapeError
+from wigtools.wiggle import Wiggle, WiggleUnsortedFile, WiggleReshapeError, \
+    WiggleBlock, intersect_blocks, iter_windows, BlockIndex
 
 @pytest.fixture
 def here():
@@ -37,6 +38,29 @@ def test_read(rdata):
     assert wiggle.blocks['chr:1'].regions == list(i+1 for i in range(23))
     assert wiggle.blocks['chr:28'].regions == list(i+28 for i in range(9))
 
+def test_iter_blocks(tmp_path):
+    wigfile = tmp_path / 'test_wiggle_wiggle_iter_blocks.wig'
+    wigfile.write_text("""\
+variableStep chrom=chr span=1
+1	1
+2	2
+fixedStep chrom=chr start=10 step=1
+variableStep chrom=chr span=1
+5	5
+
+6	6
+""")
+    blocks = Wiggle.iter_blocks(wigfile)
+    block = next(blocks)
+    assert block.block_id == 'chr:1'
+    assert block.data == [1.0, 2.0]
+    # empty blocks are skipped
+    block = next(blocks)
+    assert block.block_id == 'chr:5'
+    assert block.regions == [5, 6]
+    with pytest.raises(StopIteration):
+        next(blocks)
+
 def test_stringify(rdata, tmp_path):
     wigfile = rdata.get("tests/wigs/main.wig")
     wiggle = Wiggle(wigfile)
@@ -103,6 +127,77 @@ def test_query(rdata):
     assert wiggle2.blocks['chr:1'].start == 1
     assert wiggle2.blocks['chr:1'].end == 23
 
+def test_intersect_blocks_streaming(rdata):
+    blocks = Wiggle.iter_blocks(rdata.get("tests/wigs/main.wig"))
+    regions = iter([("chr", 1, 3), ("chr", 2, 4), ("chr", 30, 31)])
+    results = list(intersect_blocks(blocks, regions))
+    assert [block_id for block_id, _ in results] == ['chr:1', 'chr:28']
+
+    blocks = Wiggle.iter_blocks(rdata.get("tests/wigs/main.wig"))
+    results = list(intersect_blocks(blocks, [("chr", 22, 29)], reshape=True))
+    assert len(results) == 1
+    assert results[0][0] == 'chr:22'
+    assert results[0][1].regions == [22, 23, 28, 29]
+    assert results[0][1].data == [2.0, 1.0, 2.0, 3.0]
+
+def test_block_index(rdata):
+    wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
+    # 1-23, 28-36
+    index = BlockIndex(reversed(list(wiggle.blocks.values())))
+    assert len(index) == 2
+    assert [block.block_id for block in index.query(("chr", 20, 30))] == [
+        "chr:1", "chr:28"
+    ]
+    assert index.query(("chr", 24, 27)) == []
+    assert index.query(("chr", 23, 27), qbase=0) == []
+    assert index.query(("chr1", 1, 100)) == []
+
+def test_sort_sorted(rdata):
+    wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
+    blocks = wiggle.blocks
+    wiggle.sort()
+    # not rebuilt
+    assert wiggle.blocks is blocks
+
+def test_query_unsorted(rdata):
+    wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
+    # push the first block to the end
+    wiggle.blocks["chr:1"] = wiggle.blocks.pop("chr:1")
+    wiggle2 = wiggle.query([
+        ("chr", 30, 31),
+        ("chr", 1, 4),
+        ("chr", 35, 36),
+    ])
+    assert list(wiggle2.blocks) == ['chr:28', 'chr:1']
+
+    reshaped = wiggle.reshape([
+        ("chr", 35, 36),
+        ("chr", 2, 5),
+    ])
+    assert list(reshaped.blocks) == ["chr:35", "chr:2"]
+    assert reshaped.blocks["chr:35"].data == [4.0, 2.0]
+    assert reshaped.blocks["chr:2"].regions == [2, 3, 4, 5]
+
+def test_summarize(rdata):
+    wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
+    # push the first block to the end
+    wiggle.blocks["chr:1"] = wiggle.blocks.pop("chr:1")
+    summary = list(wiggle.summarize([
+        ("chr", 35, 36),
+        ("chr", 22, 29),
+        ("chr", 24, 27),
+        ("chr2", 1, 10),
+    ], what=["sum", "count"]))
+    assert summary == [
+        (("chr", 35, 36), dict(sum=6.0, count=2)),
+        (("chr", 22, 29), dict(sum=8.0, count=4)),
+        (("chr", 24, 27), dict(sum=0.0, count=0)),
+        (("chr2", 1, 10), dict(sum=0.0, count=0)),
+    ]
+
+    (_, stats), = wiggle.summarize([("chr", 1, 4)], what="max")
+    assert stats == dict(max=6.0)
+
 def test_intersect_unsorted(rdata):
 
     wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
@@ -151,6 +246,21 @@ def test_reshape(rdata):
     assert reshaped.blocks["chr:35"].regions == [35,36]
     assert reshaped.blocks["chr:35"].data == [4.0,2.0]
 
+def test_reshape_no_data(rdata):
+    # 1-23
+    # 28-36
+    regions = [("chr", 2, 3), ("chr", 24, 27), ("chr", 40, 50),
+               ("chr2", 1, 10)]
+    wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
+    reshaped = wiggle.reshape(regions)
+    assert list(reshaped.blocks) == ["chr:2"]
+
+    # the regions without data are skipped by streaming as well
+    blocks = Wiggle.iter_blocks(rdata.get("tests/wigs/main.wig"))
+    results = list(intersect_blocks(blocks, regions, reshape=True))
+    assert [block_id for block_id, _ in results] == ["chr:2"]
+    assert "span=None" not in results[0][1].stringify()
+
 def test_reshape_partially_overlapping_block(rdata):
     wiggle = Wiggle(rdata.get("tests/wigs/main.wig"))
     # 1-23
@@ -215,3 +325,102 @@ fixedStep chrom=chr start=3000 step=100 span=200
         wiggle.reshape([
             ("chr", 1000, 4000)
         ])
+
+def test_iter_chunks_mmap_and_stream(tmp_path, monkeypatch):
+    from wigtools import wiggle as wiggle_module
+    monkeypatch.setattr(wiggle_module, "READ_CHUNK_SIZE", 7)
+    wigfile = tmp_path / 'test_wiggle_wiggle_iter_chunks.wig'
+    wigfile.write_text("""\
+track name=test
+variableStep chrom=chr span=1
+1\t1
+20\t2
+fixedStep chrom=chr start=30 step=1
+1000000
+3""")
+
+    chunks = list(wiggle_module._iter_chunks(wigfile))
+    assert all(isinstance(chunk, memoryview)
+               for _, chunk, _ in chunks if chunk is not None)
+    streamed = list(wiggle_module._iter_stream_chunks(wigfile, binary=True))
+
+    def joined(chunks):
+        ret = []
+        for meta_line, chunk, offset in chunks:
+            if meta_line is not None:
+                ret.append((meta_line, offset))
+            elif ret and isinstance(ret[-1], bytes):
+                ret[-1] += bytes(chunk)
+            else:
+                ret.append(bytes(chunk))
+        return ret
+
+    assert joined(chunks) == joined(streamed) == [
+        b"track name=test\n",
+        (b"variableStep chrom=chr span=1\n", 16),
+        b"1\t1\n20\t2\n",
+        (b"fixedStep chrom=chr start=30 step=1\n", 55),
+        b"1000000\n3",
+    ]
+
+    blocks = list(Wiggle.iter_blocks(wigfile))
+    assert blocks[0].regions == [1, 20]
+    assert blocks[1].data == [1000000.0, 3.0]
+
+def test_iter_blocks_parallel(tmp_path, monkeypatch):
+    from wigtools import wiggle as wiggle_module
+    monkeypatch.setattr(wiggle_module, "READ_CHUNK_SIZE", 8)
+    wigfile = tmp_path / 'test_wiggle_wiggle_parallel.wig'
+    wigfile.write_text("""\
+track name=test
+variableStep chrom=chr span=2
+1\t1
+20\t2
+40\t3.5
+fixedStep chrom=chr start=100 step=10
+1
+2
+3
+4
+fixedStep chrom=chr2 start=1 step=1
+variableStep chrom=chr3
+5\t5
+""")
+    serial = list(Wiggle.iter_blocks(wigfile, compact=True))
+    parallel = list(Wiggle.iter_blocks(wigfile, compact=True, jobs=2))
+    assert [block.block_id for block in parallel] == [
+        "chr:1", "chr:100", "chr3:5"
+    ]
+    assert parallel == serial
+    assert Wiggle(wigfile, jobs=2).stringify() == Wiggle(wigfile).stringify()
+
+def test_iter_windows():
+    block1 = WiggleBlock(is_fixed=False, chrom="chr", span=2)
+    block1.take_parsed([1., 2., 4.], [1, 3, 6])
+    block2 = WiggleBlock(is_fixed=True, chrom="chr", start=8, step=1)
+    block2.take_parsed([8., 8.])
+    block3 = WiggleBlock(is_fixed=True, chrom="chr2", start=3, step=1)
+    block3.take_parsed([1.])
+
+    windows = list(iter_windows([block1, block2, block3], 4, stat="sum"))
+    assert [(block.chrom, block.start, block.step, block.span)
+            for block in windows] == [("chr", 1, 4, 4), ("chr2", 1, 4, 4)]
+    # windows across blocks
+    assert list(windows[0].data) == [3., 4. + 8., 8.]
+    assert list(windows[1].data) == [1.]
+
+    windows = list(iter_windows([block1, block2], 4, step=2,
+                                stat="max", partial="whole"))
+    assert list(windows[0].regions) == [1, 3, 5, 7, 9]
+    assert list(windows[0].data) == [2., 4., 8., 8., 8.]
+
+    # window at 5 has no data
+    windows = list(iter_windows([block1], 1, stat="sum"))
+    assert [list(block.regions) for block in windows] == [[1, 2, 3, 4],
+                                                          [6, 7]]
+    assert list(windows[1].data) == [2., 2.]
+
+    with pytest.raises(WiggleUnsortedFile):
+        list(iter_windows([block2, block1], 4))
+    with pytest.raises(WiggleUnsortedFile):
+        list(iter_windows([block1, block3, block2], 4))
@@ -1,4 +1,5 @@
 """A set of tools for wiggle file"""
+import sys
 from diot import Diot
 from pyparam import commands
 from wigtools import functional
@@ -16,32 +17,93 @@ SWITCH_BASE_COMMAND.to.desc = ("Either 0 or 1. "
                                "Switch the coordinate base to `<to>`, "
                                "implying the original base `1-<to>`")
 SWITCH_BASE_COMMAND.i = "/dev/stdin"
-SWITCH_BASE_COMMAND.i.desc = "The input wiggle file"
+SWITCH_BASE_COMMAND.i.desc = ("The input wiggle file, which can be gzip, "
+                              "BGZF or zstd compressed")
 SWITCH_BASE_COMMAND.o = "/dev/stdout"
-SWITCH_BASE_COMMAND.o.desc = "The output wiggle file"
+SWITCH_BASE_COMMAND.o.desc = ("The output wiggle file, compressed if it "
+                              "ends with `.gz` (BGZF), `.bgz`, `.zst` or "
+                              "`.zstd`")
+SWITCH_BASE_COMMAND.jobs = 1
+SWITCH_BASE_COMMAND.jobs.desc = [
+    "Number of processes to parse the input file. Only used when the input "
+    "is a regular wiggle file.",
+    "For compressed input and output files, the number of threads to "
+    "decompress and compress them."
+]
+SWITCH_BASE_COMMAND.collapse = False
+SWITCH_BASE_COMMAND.collapse.desc = (
+    "Collapse the output: runs of adjacent data points with the same "
+    "values are merged into wider spans, and data points with a constant "
+    "step are written as fixedStep blocks"
+)
+SWITCH_BASE_COMMAND.tolerance = 0.0
+SWITCH_BASE_COMMAND.tolerance.desc = (
+    "With `--collapse`, also merge the runs of which the values differ by "
+    "at most this, using the middle of the range of the values (lossy)"
+)
 
 # sort the wiggle file by chrom and start
 commands.sort = ("Sort the blocks in a wiggle file by chrom and start. "
                  "Chromosomes will be sorted the way `sort -V` does.")
 commands.sort.i = SWITCH_BASE_COMMAND.i
 commands.sort.o = SWITCH_BASE_COMMAND.o
+commands.sort.chroms.desc = ("A file with chromosomes in the first column, "
+                             "such as a `.fai` or `chrom.sizes` file. "
+                             "If given, chromosomes will be sorted in "
+                             "that order.")
+commands.sort['max-memory'] = "1G"
+commands.sort['max-memory'].desc = [
+    "The memory budget for the blocks to sort, such as `512M` or `2G`. "
+    "Sorted runs of blocks are spilled to temporary files and merged "
+    "when exceeded.",
+    "Only used when the input is not a regular wiggle file (i.e. a pipe "
+    "or a wbin file). Blocks of regular wiggle files are sorted by their "
+    "locations and copied without parsing."
+]
+commands.sort.tmpdir.desc = ("The directory for the temporary files. "
+                             "Default: the system temporary directory")
+commands.sort.jobs = 1
+commands.sort.jobs.desc = ("Number of threads to decompress the input "
+                           "file and to compress the output file, if they "
+                           "are compressed")
 commands.sort._hbald = False
 
+# check if a wiggle file is sorted
+commands['check-sorted'] = ("Check if the blocks in a wiggle file are "
+                            "sorted by chrom and start. Exits with 1 "
+                            "if not.")
+commands['check-sorted'].i = SWITCH_BASE_COMMAND.i
+commands['check-sorted'].chroms = commands.sort.chroms
+commands['check-sorted'].jobs = 1
+commands['check-sorted'].jobs.desc = ("Number of threads to decompress the "
+                                      "input file, if it is compressed")
+commands['check-sorted']._hbald = False
+
 commands.stats = ("Statistics for data in a wiggle file for each block")
 commands.stats.i = SWITCH_BASE_COMMAND.i
 commands.stats.o = SWITCH_BASE_COMMAND.o
 commands.stats.base = 1
 commands.stats.base.desc = "The coordinate base of the input and output file"
 commands.stats.stats = []
-commands.stats.stats.desc = ("The data stats for each region. "
-                             "Default: ['min', 'max', 'mean', "
-                             "'median', 'sum', 'count', 'bp']")
+commands.stats.stats.desc = [
+    "The data stats for each region. "
+    "Default: ['min', 'max', 'mean', 'median', 'sum', 'count', 'bp']",
+    "Other available stats: `std` (population standard deviation), "
+    "`q25` and `q75` (the quartiles), `nonzero` (number of data points "
+    "with non-zero values) and `coverage` (fraction of the bases of the "
+    "block covered by the data points)"
+]
 commands.stats.stats.callback = lambda opt: (
     opt.set_value(['min', 'max', 'mean', 'median', 'sum', 'count', 'bp'])
     if not opt.value else None
 )
 commands.stats.nohead = False
 commands.stats.nohead.desc = "Don't put a header for output file."
+commands.stats.approx = False
+commands.stats.approx.desc = ("Estimate the median and the quartiles with "
+                              "the P² algorithm in constant memory, "
+                              "instead of selecting them exactly")
+commands.stats.jobs = SWITCH_BASE_COMMAND.jobs
 commands.stats._hbald = False
 
 # reshape: generate a new wiggle file in the query regions,
@@ -56,6 +118,10 @@ commands.reshape.qbase.desc = "The coordinate base of `qfile`"
 commands.reshape.qbase.callback = lambda opt, ps: (
     opt.set_value(ps.base.value) if opt.value is None else None
 )
+commands.reshape.chroms = commands.sort.chroms
+commands.reshape.jobs = SWITCH_BASE_COMMAND.jobs
+commands.reshape.collapse = SWITCH_BASE_COMMAND.collapse
+commands.reshape.tolerance = SWITCH_BASE_COMMAND.tolerance
 commands.reshape.partial = "fraction"
 commands.reshape.partial.desc = [
     "How to assign the data for partially overlapping regions",
@@ -70,44 +136,237 @@ commands.query.o = SWITCH_BASE_COMMAND.o
 commands.query.base = commands.stats.base
 commands.query.qfile = commands.query.qfile
 commands.query.qbase = commands.query.qbase
+commands.query.chroms = commands.sort.chroms
+commands.query.jobs = SWITCH_BASE_COMMAND.jobs
+
+# summarize
+commands.summarize = ("Calculate the statistics of the data in each "
+                      "query region")
+commands.summarize.i = SWITCH_BASE_COMMAND.i
+commands.summarize.o = SWITCH_BASE_COMMAND.o
+commands.summarize.base = commands.stats.base
+commands.summarize.qfile = commands.reshape.qfile
+commands.summarize.qbase = commands.reshape.qbase
+commands.summarize.stats = commands.stats.stats
+commands.summarize.partial = commands.reshape.partial
+commands.summarize.nohead = commands.stats.nohead
+commands.summarize.approx = commands.stats.approx
+commands.summarize.jobs = SWITCH_BASE_COMMAND.jobs
+
+# index
+commands.index = ("Build an index file for a wiggle file, so that `query` and "
+                  "`reshape` only read the blocks they need")
+commands.index.i.required = True
+commands.index.i.desc = ("The input wiggle file. Must be a regular file, "
+                         "uncompressed or BGZF compressed.")
+commands.index.o.desc = ("The output index file. "
+                         "Default: `<i>.idx`, which is detected by "
+                         "`query` and `reshape`")
+commands.index.jobs = 1
+commands.index.jobs.desc = ("Number of threads to decompress the input "
+                            "file, if it is BGZF compressed")
+
+# convert
+commands.convert = "Convert a wiggle file to other formats"
+commands.convert.i = "/dev/stdin"
+commands.convert.i.desc = "The input wiggle file, wbin file or bigWig file"
+commands.convert.o = "/dev/stdout"
+commands.convert.o.desc = ("The output file. "
+                           "Must be a regular file for wbin and bigwig "
+                           "formats")
+commands.convert.to = "wbin"
+commands.convert.to.desc = [
+    "The format to convert to",
+    "- `wbin`: A binary format that loads almost instantly, which is "
+    "detected and used as the input by all commands",
+    "- `wiggle`: The wiggle format",
+    "- `bedgraph`: The bedGraph format",
+    "- `bigwig`: The bigWig format, with the sizes of chromosomes given "
+    "by `--chroms`",
+]
+commands.convert.float32 = False
+commands.convert.float32.desc = ("Save the values as float32 instead of "
+                                 "float64 for wbin format")
+commands.convert.chroms.desc = ("A file with the sizes of chromosomes in "
+                                "the first two columns, such as a `.fai` "
+                                "or `chrom.sizes` file. Required for "
+                                "bigwig format.")
+commands.convert.jobs = SWITCH_BASE_COMMAND.jobs
 
 # split
 commands.split = "Split blocks into different files"
 commands.split.i = SWITCH_BASE_COMMAND.i
 commands.split.outprefix.required = True
 commands.split.outprefix.desc = ("The output prefix. Blocks will be saved to "
-                                 "`outprefix`_<chr>_<start>.wig")
+                                 "`outprefix`_<chr>_<start>_<end>.wig, or "
+                                 "`outprefix`_<chr>.wig with `--by chrom`")
+commands.split.by = "block"
+commands.split.by.desc = [
+    "How to split the blocks:",
+    "- `block`: One file for each block",
+    "- `chrom`: One file for each chromosome, with the blocks in the order "
+    "of the input file",
+]
+commands.split.jobs = SWITCH_BASE_COMMAND.jobs
 
 # window: make blocks with given window
+commands.window = ("Bin the data of a wiggle file into fixed-size windows "
+                   "along the chromosomes")
+commands.window.i = SWITCH_BASE_COMMAND.i
+commands.window.o = SWITCH_BASE_COMMAND.o
+commands.window.base = commands.stats.base
+commands.window.size.required = True
+commands.window.size.type = int
+commands.window.size.desc = "The size of the windows"
+commands.window.step.type = int
+commands.window.step.desc = ("The step of the windows. "
+                             "Default: `<size>`, non-overlapping windows")
+commands.window.stat = "mean"
+commands.window.stat.desc = ("The statistic of the data in each window. "
+                             "Any of the stats of `stats` command")
+commands.window.partial = commands.reshape.partial
+commands.window.fmt = "wiggle"
+commands.window.fmt.desc = ("The output format, `wiggle`, `bedgraph` or "
+                             "`bigwig`")
+commands.window.chroms = commands.convert.chroms
+commands.window.jobs = SWITCH_BASE_COMMAND.jobs
 
-def switch_base(opts):
+# merge: combine multiple tracks
+commands.merge = ("Merge the data of multiple sorted wiggle files "
+                  "position by position")
+commands.merge.i.required = True
+commands.merge.i.type = list
+commands.merge.i.desc = ("The input wiggle files, sorted by chrom and "
+                         "start. They can be compressed as well.")
+commands.merge.o = SWITCH_BASE_COMMAND.o
+commands.merge.base = commands.stats.base
+commands.merge.op = "mean"
+commands.merge.op.desc = [
+    "The operation to merge the values of the files covering a position:",
+    "- `sum`, `mean`, `max`, `min`: Of the values of the files covering it",
+    "- `count`: The number of the files covering it",
+    "Positions not covered by any files are left out."
+]
+commands.merge.fmt = commands.window.fmt
+commands.merge.chroms = commands.convert.chroms
+commands.merge.jobs = 1
+commands.merge.jobs.desc = ("Number of threads to compress the output "
+                            "file, if it is compressed")
+commands.merge.collapse = SWITCH_BASE_COMMAND.collapse
+commands.merge.tolerance = SWITCH_BASE_COMMAND.tolerance
+
+# transform: change the values
+commands.transform = ("Transform the values of a wiggle file by a chain "
+                      "of operations in one pass")
+commands.transform.i = SWITCH_BASE_COMMAND.i
+commands.transform.o = SWITCH_BASE_COMMAND.o
+commands.transform.ops.required = True
+commands.transform.ops.type = list
+commands.transform.ops.desc = [
+    "The operations to apply in order, with the arguments separated by "
+    "colons:",
+    "- `scale:<factor>`: Multiply the values by the factor",
+    "- `add:<value>`: Add the value to the values",
+    "- `abs`: Take the absolute values",
+    "- `log[:<base>]`: Take the logarithms (natural by default) of the "
+    "values, which must be positive",
+    "- `log1p`: Take the natural logarithms of the values plus 1",
+    "- `clip:<min>:<max>`: Limit the values to the range, "
+    "either can be empty",
+    "- `cpm`: Scale the values so that they sum up to a million",
+    "- `zscore`: Standardize the values by the mean and the standard "
+    "deviation of each chromosome",
+    "`cpm` and `zscore` need a regular input file, which is read first "
+    "for the summary of the values, cached in `<input>.wsum`.",
+]
+commands.transform.jobs = SWITCH_BASE_COMMAND.jobs
+commands.transform.collapse = SWITCH_BASE_COMMAND.collapse
+commands.transform.tolerance = SWITCH_BASE_COMMAND.tolerance
+
+def switch_base_cmd(opts):
     """Switch the coordinate base of a wiggle file"""
-    functional.switch_base(opts.i, opts.o, from_base=1-opts.to, to_base=opts.to)
+    functional.switch_base(opts.i, opts.o, from_base=1-opts.to, to_base=opts.to,
+                           jobs=opts.jobs, collapse=opts.collapse,
+                           tolerance=opts.tolerance)
 
-def sort(opts):
+def sort_cmd(opts):
     """Sort the blocks in a wiggle file by chrom and start."""
-    functional.sort(opts.i, opts.o)
+    functional.sort(opts.i, opts.o, chroms=opts.chroms,
+                    max_memory=opts['max-memory'], tmpdir=opts.tmpdir,
+                    jobs=opts.jobs)
 
-def reshape(opts):
+def check_sorted_cmd(opts):
+    """Check if the blocks in a wiggle file are sorted by chrom and start"""
+    sys.exit(0 if functional.check_sorted(opts.i, chroms=opts.chroms,
+                                            jobs=opts.jobs) else 1)
+
+def reshape_cmd(opts):
     """Summarize data in a wiggle file for the regions in given region file"""
     functional.reshape(opts.i, opts.o, base=opts.base,
                        qfile=opts.qfile, qbase=opts.qbase,
-                       partial=opts.partial)
+                       partial=opts.partial, chroms=opts.chroms,
+                       jobs=opts.jobs, collapse=opts.collapse,
+                       tolerance=opts.tolerance)
 
-def stats(opts):
+def stats_cmd(opts):
     """Statistics for data in a wiggle file for each block"""
-    functional.stats(opts.i, opts.o, opts.base, opts.stats, not opts.nohead)
+    functional.stats(opts.i, opts.o, opts.base, opts.stats, not opts.nohead,
+                     approx=opts.approx, jobs=opts.jobs)
 
-def query(opts):
+def query_cmd(opts):
     """Find the blocks that intersect with the query regions"""
     functional.query(opts.i, opts.o, opts.base,
-                     qfile=opts.qfile, qbase=opts.qbase)
+                     qfile=opts.qfile, qbase=opts.qbase, chroms=opts.chroms,
+                     jobs=opts.jobs)
+
+def summarize_cmd(opts):
+    """Calculate the statistics of the data in each query region"""
+    functional.summarize(opts.i, opts.o, opts.base,
+                         qfile=opts.qfile, qbase=opts.qbase,
+                         statistics=opts.stats, partial=opts.partial,
+                         header=not opts.nohead, approx=opts.approx,
+                         jobs=opts.jobs)
+
+def index_cmd(opts):
+    """Build an index file for a wiggle file"""
+    functional.index(opts.i, opts.o, jobs=opts.jobs)
 
-def split(opts):
+def convert_cmd(opts):
+    """Convert a wiggle file to other formats"""
+    functional.convert(opts.i, opts.o, opts.to, opts.float32,
+                       chroms=opts.chroms, jobs=opts.jobs)
+
+def window_cmd(opts):
+    """Bin the data of a wiggle file into fixed-size windows"""
+    functional.window(opts.i, opts.o, opts.base, size=opts.size,
+                      step=opts.step, stat=opts.stat, partial=opts.partial,
+                      fmt=opts.fmt, chroms=opts.chroms, jobs=opts.jobs)
+
+def merge_cmd(opts):
+    """Merge the data of multiple sorted wiggle files"""
+    functional.merge(opts.i, opts.o, opts.base, op=opts.op, fmt=opts.fmt,
+                     chroms=opts.chroms, jobs=opts.jobs,
+                     collapse=opts.collapse, tolerance=opts.tolerance)
+
+def transform_cmd(opts):
+    """Transform the values of a wiggle file"""
+    functional.transform(opts.i, opts.o, opts.ops, jobs=opts.jobs,
+                         collapse=opts.collapse, tolerance=opts.tolerance)
+
+def split_cmd(opts):
     """Split blocks into different files"""
-    functional.split(opts.i, opts.outprefix)
+    functional.split(opts.i, opts.outprefix, by=opts.by, jobs=opts.jobs)
+
+# the names of the handlers before they were suffixed, except stats, which
+# is the submodule now
+switch_base = switch_base_cmd
+sort = sort_cmd
+reshape = reshape_cmd
+query = query_cmd
+split = split_cmd
 
 def main():
     """Main entry"""
     command, opts, _ = commands._parse(dict_wrapper=Diot)
-    globals()[command.replace('-', '_')](opts)
+    # handlers are suffixed to not shadow the submodules, such as index
+    globals()[command.replace('-', '_') + '_cmd'](opts)
@@ -0,0 +1,781 @@
+"""bigWig files (the indexed binary format of UCSC), read and written in
+pure Python.
+
+Layout of a bigWig file written here:
+    the header, and the headers of the zoom levels
+    the total summary of the data
+    the number of data sections, followed by the data sections, each of
+        at most ITEMS_PER_SLOT items of a chromosome, zlib compressed
+    the R-tree index of the data sections
+    the B+ tree of the chromosomes
+    for each zoom level: the summaries of the data in bins of the
+        reduction level, in compressed sections, and their R-tree index
+
+Coordinates are 0-based and half-open in bigWig files. The values are
+saved as float32.
+"""
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import groupby
+from tempfile import TemporaryFile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+BIGWIG_MAGIC = 0x888FFC26
+BPT_MAGIC = 0x78CA8C91
+CIRTREE_MAGIC = 0x2468ACE0
+BIGWIG_VERSION = 4
+
+# items of the data sections and zoom sections
+ITEMS_PER_SLOT = 1024
+# children of the nodes of the R-trees and the B+ tree
+BLOCK_SIZE = 256
+MAX_ZOOM_LEVELS = 10
+# the reduction levels are multiplied by this
+ZOOM_FACTOR = 4
+# least number of zoom records in a region to summarize it with a zoom level
+ZOOM_MIN_BINS = 16
+# statistics that can be estimated from the zoom levels
+ZOOM_STATISTICS = ('min', 'max', 'mean', 'std', 'bp', 'coverage')
+
+SECTION_BEDGRAPH = 1
+SECTION_VARIABLE_STEP = 2
+SECTION_FIXED_STEP = 3
+
+HEADER = "IHHQQQHHQQIQ"
+ZOOM_HEADER = "IIQQ"
+SUMMARY = "Qdddd"
+BPT_HEADER = "IIIIQQ"
+CIR_HEADER = "IIQIIIIQII"
+NODE_HEADER = "BBH"
+CIR_LEAF_ITEM = "IIIIQQ"
+CIR_NODE_ITEM = "IIIIQ"
+SECTION_HEADER = "IIIIIBBH"
+ZOOM_RECORD = "IIIIffff"
+
+class WiggleBigWigError(Exception):
+    """When a bigWig file is invalid or cannot be written"""
+
+def is_bigwig(path) -> bool:
+    """Tell if a file is a bigWig file.
+    Only regular files are checked, since pipes cannot be peeked"""
+    try:
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as fin:
+            magic = fin.read(4)
+    except (OSError, TypeError):
+        return False
+    return len(magic) == 4 and BIGWIG_MAGIC in (
+        struct.unpack("<I", magic)[0], struct.unpack(">I", magic)[0]
+    )
+
+def read_chrom_sizes(chromfile) -> Dict[str, int]:
+    """Read the sizes of chromosomes from the first two columns of a file,
+    for example, a `.fai` or a `chrom.sizes` file"""
+    sizes = {}
+    with open(chromfile) as fchrom:
+        for line in fchrom:
+            line = line.strip()
+            if not line or line[:1] == '#':
+                continue
+            parts = line.split()
+            sizes[parts[0]] = int(parts[1])
+    return sizes
+
+def _size(fmt: str) -> int:
+    """The size of a struct format, without any alignment"""
+    return struct.calcsize("<" + fmt)
+
+def _floats(data: bytes, swap: bool) -> array:
+    values = array('f', data)
+    if swap:
+        values.byteswap()
+    return values
+
+def _uints(data: bytes, swap: bool) -> array:
+    values = array('I', data)
+    if swap:
+        values.byteswap()
+    return values
+
+class BigWigFile:
+    """Read a bigWig file, with only the sections needed being read and
+    decompressed, located by the R-tree index"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        magic = self._file.read(4)
+        for endian in "<>":
+            if struct.unpack(endian + "I", magic)[0] == BIGWIG_MAGIC:
+                self._endian = endian
+                break
+        else:
+            self._file.close()
+            raise WiggleBigWigError(f"Not a bigWig file: {path}")
+        self._swap = (endian == "<") != (sys.byteorder == "little")
+
+        (_, _, nzooms, chrom_tree_offset, _, self._index_offset,
+         _, _, _, summary_offset, self._uncompress_size,
+         _) = self._unpack(HEADER, 0)
+        # (reduction, index offset) of the zoom levels
+        self.zoom_levels = []
+        for i in range(nzooms):
+            reduction, _, _, index_offset = self._unpack(
+                ZOOM_HEADER, _size(HEADER) +
+                i * _size(ZOOM_HEADER)
+            )
+            self.zoom_levels.append((reduction, index_offset))
+        self.summary = (self._unpack(SUMMARY, summary_offset)
+                        if summary_offset else None)
+
+        # chromosome name => (id, size)
+        self.chroms = {}
+        self._read_chrom_tree(chrom_tree_offset)
+        self._chrom_names = {chrom_id: chrom for chrom, (chrom_id, _)
+                             in self.chroms.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the file"""
+        self._file.close()
+
+    def _unpack(self, fmt: str, offset: int = None) -> Tuple:
+        """Read and unpack the values at offset (default: current one)"""
+        fmt = self._endian + fmt
+        if offset is not None:
+            self._file.seek(offset)
+        return struct.unpack(fmt, self._file.read(struct.calcsize(fmt)))
+
+    def _read_chrom_tree(self, offset: int):
+        _, _, key_size, _, _, _ = self._unpack(BPT_HEADER, offset)
+        self._read_chrom_node(self._file.tell(), key_size)
+
+    def _read_chrom_node(self, offset: int, key_size: int):
+        is_leaf, _, count = self._unpack(NODE_HEADER, offset)
+        item_fmt = f"{key_size}s" + ("II" if is_leaf else "Q")
+        items = [self._unpack(item_fmt) for _ in range(count)]
+        for item in items:
+            if is_leaf:
+                chrom = item[0].rstrip(b"\0").decode()
+                self.chroms[chrom] = (item[1], item[2])
+            else:
+                self._read_chrom_node(item[1], key_size)
+
+    def _iter_index(self,
+                    offset: int,
+                    query: Tuple = None) -> Iterator[Tuple[int, int]]:
+        """Find the (offset, size) of the sections in the R-tree index at
+        offset overlapping with the query (chrom id, start, end), or all
+        the sections if query is None"""
+        yield from self._iter_index_node(
+            offset + _size(CIR_HEADER), query
+        )
+
+    def _iter_index_node(self, offset: int,
+                         query: Tuple) -> Iterator[Tuple[int, int]]:
+        is_leaf, _, count = self._unpack(NODE_HEADER, offset)
+        item_fmt = CIR_LEAF_ITEM if is_leaf else CIR_NODE_ITEM
+        items = [self._unpack(item_fmt) for _ in range(count)]
+        for item in items:
+            if query is not None and not (
+                    (item[0], item[1]) < (query[0], query[2]) and
+                    (item[2], item[3]) > (query[0], query[1])
+            ):
+                continue
+            if is_leaf:
+                yield item[4], item[5]
+            else:
+                yield from self._iter_index_node(item[4], query)
+
+    def _read_section(self, offset: int, size: int) -> bytes:
+        self._file.seek(offset)
+        data = self._file.read(size)
+        return zlib.decompress(data) if self._uncompress_size else data
+
+    def _query(self, index_offset: int, region: Tuple,
+               qbase: int) -> List[Tuple[int, int]]:
+        """Find the sections overlapping with a region in the given base"""
+        chrom = self.chroms.get(region[0])
+        if chrom is None:
+            return []
+        return list(self._iter_index(
+            index_offset, (chrom[0], region[1] - qbase, region[2])
+        ))
+
+    def _iter_pieces(self, sections: Iterable[Tuple[int, int]],
+                     base: int) -> Iterator[Tuple]:
+        """Parse the sections into pieces of (chrom, is_fixed, start, step,
+        span, data, regions) with the positions in the given base.
+        bedGraph sections are split into pieces of the same span."""
+        endian = self._endian
+        header_size = _size(SECTION_HEADER)
+        for offset, size in sections:
+            data = self._read_section(offset, size)
+            (chrom_id, start, _, step, span, kind, _,
+             count) = struct.unpack(endian + SECTION_HEADER,
+                                    data[:header_size])
+            chrom = self._chrom_names[chrom_id]
+            items = data[header_size:]
+            if kind == SECTION_FIXED_STEP:
+                yield (chrom, True, start + base, step, span,
+                       _floats(items[:count * 4], self._swap), None)
+            elif kind == SECTION_VARIABLE_STEP:
+                items = items[:count * 8]
+                yield (chrom, False, None, None, span,
+                       _floats(items, self._swap)[1::2],
+                       [pos + base for pos in
+                        _uints(items, self._swap)[0::2]])
+            elif kind == SECTION_BEDGRAPH:
+                items = items[:count * 12]
+                positions = _uints(items, self._swap)
+                starts = positions[0::3]
+                values = _floats(items, self._swap)[2::3]
+                spans = [end - pos for pos, end in
+                         zip(starts, positions[1::3])]
+                index = 0
+                for span, group in groupby(spans):
+                    size = len(list(group))
+                    yield (chrom, False, None, None, span,
+                           values[index:index + size],
+                           [pos + base for pos in
+                            starts[index:index + size]])
+                    index += size
+            else:
+                raise WiggleBigWigError(f"Unknown type of data section: "
+                                        f"{kind}")
+
+    def iter_blocks(self, sections: Iterable[Tuple[int, int]] = None,
+                    base: int = 1) -> Iterator[Tuple[dict, array, list]]:
+        """Iterate over the blocks of the sections (default: all of them),
+        as (meta, data, regions), with the positions in the given base.
+
+        Adjacent sections that continue each other (the same chromosome,
+        type and span, and for fixedStep ones, the same step without gaps)
+        are joined into one block, as they are split from one by writers.
+        """
+        if sections is None:
+            sections = self._iter_index(self._index_offset)
+        meta = data = regions = None
+        for (chrom, is_fixed, start, step, span,
+             values, starts) in self._iter_pieces(sections, base):
+            if meta is not None and (
+                    meta["chrom"] == chrom and
+                    meta["is_fixed"] == is_fixed and
+                    meta["span"] == span and (
+                        meta["step"] == step and
+                        meta["start"] + len(data) * step == start
+                        if is_fixed else starts[0] > regions[-1]
+                    )
+            ):
+                data.extend(array('d', values))
+                if not is_fixed:
+                    regions.extend(starts)
+                continue
+            if meta is not None:
+                yield meta, data, regions
+            meta = dict(chrom=chrom, start=start, step=step, span=span,
+                        is_fixed=is_fixed)
+            data = array('d', values)
+            regions = starts
+        if meta is not None:
+            yield meta, data, regions
+
+    def query_sections(self, regions: Iterable[Tuple],
+                       qbase: int = 1) -> List[Tuple[int, int]]:
+        """Find the (offset, size) of the sections overlapping with any of
+        the regions, ordered by their offsets"""
+        sections = set()
+        for region in regions:
+            sections.update(self._query(self._index_offset, region, qbase))
+        return sorted(sections)
+
+    def _zoom_level(self, length: int) -> Optional[Tuple[int, int]]:
+        """Get the coarsest zoom level with at least ZOOM_MIN_BINS bins in
+        a region of the length"""
+        ret = None
+        for reduction, index_offset in self.zoom_levels:
+            if reduction * ZOOM_MIN_BINS <= length and (
+                    ret is None or reduction > ret[0]
+            ):
+                ret = reduction, index_offset
+        return ret
+
+    def zoom_summary(self, region: Tuple,
+                     qbase: int = 1) -> Optional[Tuple]:
+        """Summarize the data in the region from the zoom levels, with the
+        records partially in the region weighted by their overlapping
+        fractions.
+        Returns the bases covered, the min, the max, the sum and the sum of
+        squares of the values (weighted by the bases), or None if no zoom
+        levels fit the region."""
+        start, end = region[1] - qbase, region[2]
+        level = self._zoom_level(end - start)
+        if level is None:
+            return None
+        record_fmt = self._endian + ZOOM_RECORD
+        record_size = struct.calcsize(record_fmt)
+        bases = total = total_sq = 0.
+        minimum = maximum = float('nan')
+        for offset, size in self._query(level[1], region, qbase):
+            data = self._read_section(offset, size)
+            for (_, rstart, rend, count, rmin, rmax, rsum,
+                 rsum_sq) in struct.iter_unpack(
+                     record_fmt,
+                     data[:len(data) // record_size * record_size]
+                 ):
+                overlap = min(rend, end) - max(rstart, start)
+                if overlap <= 0 or not count:
+                    continue
+                fraction = overlap / (rend - rstart)
+                bases += count * fraction
+                total += rsum * fraction
+                total_sq += rsum_sq * fraction
+                if not minimum <= rmin:
+                    minimum = rmin
+                if not maximum >= rmax:
+                    maximum = rmax
+        return bases, minimum, maximum, total, total_sq
+
+    def zoom_stats(self, region: Tuple, qbase: int = 1,
+                   what=None) -> Optional[dict]:
+        """Estimate the ZOOM_STATISTICS of the data in the region from the
+        zoom levels, None if no zoom levels fit the region"""
+        summary = self.zoom_summary(region, qbase)
+        if summary is None:
+            return None
+        bases, minimum, maximum, total, total_sq = summary
+        length = region[2] - region[1] + qbase
+        mean = total / bases if bases else float('nan')
+        ret = {}
+        for stat in what:
+            if stat == 'min':
+                ret[stat] = minimum
+            elif stat == 'max':
+                ret[stat] = maximum
+            elif stat == 'mean':
+                ret[stat] = mean
+            elif stat == 'std':
+                ret[stat] = (max(0., total_sq / bases - mean * mean) ** .5
+                             if bases else float('nan'))
+            elif stat == 'bp':
+                ret[stat] = bases
+            elif stat == 'coverage':
+                ret[stat] = (min(bases, length) / length
+                             if length else float('nan'))
+            else:
+                raise WiggleBigWigError(f"Statistic cannot be estimated "
+                                        f"from zoom levels: {stat}")
+        return ret
+
+def _chunks(items: List, size: int) -> List[List]:
+    return [items[i:i + size] for i in range(0, len(items), size)] or [[]]
+
+def _bounds(items: List[Tuple]) -> Tuple:
+    """The bounds (start chrom, start, end chrom, end) of R-tree items"""
+    if not items:
+        return (0, 0, 0, 0)
+    start = min((item[0], item[1]) for item in items)
+    end = max((item[2], item[3]) for item in items)
+    return start + end
+
+def _write_cir_tree(fout, items: List[Tuple], end_offset: int):
+    """Write the R-tree index of the sections, with the items being
+    (start chrom, start, end chrom, end, offset, size)"""
+    items = sorted(items)
+    # the leaf nodes first, each node is (bounds, children)
+    levels = [[(_bounds(chunk), chunk) for chunk in
+               _chunks(items, BLOCK_SIZE)]]
+    while len(levels[-1]) > 1:
+        levels.append([(_bounds([node[0] for node in chunk]), chunk)
+                       for chunk in _chunks(levels[-1], BLOCK_SIZE)])
+    levels.reverse()
+
+    fout.write(struct.pack("<" + CIR_HEADER, CIRTREE_MAGIC, BLOCK_SIZE,
+                           len(items), *levels[0][0][0], end_offset,
+                           ITEMS_PER_SLOT, 0))
+    # the offsets of the nodes of the next level
+    offset = fout.tell() + sum(
+        _size(NODE_HEADER) +
+        len(node[1]) * _size(CIR_NODE_ITEM)
+        for node in levels[0]
+    ) * (len(levels) > 1)
+    for depth, level in enumerate(levels):
+        is_leaf = depth == len(levels) - 1
+        if is_leaf:
+            for _, chunk in level:
+                fout.write(struct.pack("<" + NODE_HEADER, 1, 0, len(chunk)))
+                for item in chunk:
+                    fout.write(struct.pack("<" + CIR_LEAF_ITEM, *item))
+            continue
+        child_size = _size(CIR_LEAF_ITEM if depth == len(levels) - 2
+                                     else CIR_NODE_ITEM)
+        for _, chunk in level:
+            fout.write(struct.pack("<" + NODE_HEADER, 0, 0, len(chunk)))
+            for bounds, children in chunk:
+                fout.write(struct.pack("<" + CIR_NODE_ITEM, *bounds, offset))
+                offset += (_size(NODE_HEADER) +
+                           len(children) * child_size)
+
+def _write_chrom_tree(fout, chroms: List[Tuple[bytes, int, int]]):
+    """Write the B+ tree of the chromosomes, with the chroms being
+    (name, id, size) sorted by name"""
+    key_size = max([len(chrom[0]) for chrom in chroms] or [1])
+    block_size = max(1, min(BLOCK_SIZE, len(chroms)))
+    # the leaf nodes first, each node is (first key, children)
+    levels = [[(chunk[0][0] if chunk else b"", chunk)
+               for chunk in _chunks(chroms, block_size)]]
+    while len(levels[-1]) > 1:
+        levels.append([(chunk[0][0], chunk)
+                       for chunk in _chunks(levels[-1], block_size)])
+    levels.reverse()
+
+    fout.write(struct.pack("<" + BPT_HEADER, BPT_MAGIC, block_size,
+                           key_size, 8, len(chroms), 0))
+    key_fmt = f"{key_size}s"
+    offset = fout.tell() + sum(
+        4 + len(node[1]) * (key_size + 8) for node in levels[0]
+    ) * (len(levels) > 1)
+    for depth, level in enumerate(levels):
+        for _, chunk in level:
+            if depth == len(levels) - 1:
+                fout.write(struct.pack("<" + NODE_HEADER, 1, 0, len(chunk)))
+                for name, chrom_id, size in chunk:
+                    fout.write(struct.pack("<" + key_fmt + "II",
+                                           name, chrom_id, size))
+                continue
+            fout.write(struct.pack("<" + NODE_HEADER, 0, 0, len(chunk)))
+            for key, children in chunk:
+                fout.write(struct.pack("<" + key_fmt + "Q", key, offset))
+                offset += 4 + len(children) * (key_size + 8)
+
+class _ZoomLevel: # pylint: disable=too-many-instance-attributes
+    """Summarize the data in the bins of a reduction level, with the
+    records of the bins passed to the next (coarser) level, and save the
+    sections of the records to a temporary file"""
+
+    def __init__(self, reduction: int, next_level: "_ZoomLevel" = None):
+        self.reduction = reduction
+        self.next_level = next_level
+        self.file = TemporaryFile()
+        # the R-tree items of the sections, offsets in the temporary file
+        self.index = []
+        self.count = 0
+        self.max_section_size = 0
+        self._records = []
+        self._record = None
+
+    def add(self, # pylint: disable=too-many-arguments
+            chrom_id: int, start: int, end: int, bases: float,
+            minimum: float, maximum: float, total: float, total_sq: float):
+        """Add the summary of the data in [start, end), which must be in
+        one bin"""
+        record = self._record
+        if (record is not None and record[0] == chrom_id and
+                record[1] == start // self.reduction):
+            record[2] = min(record[2], start)
+            record[3] = max(record[3], end)
+            record[4] += bases
+            record[5] = min(record[5], minimum)
+            record[6] = max(record[6], maximum)
+            record[7] += total
+            record[8] += total_sq
+            return
+        self._flush_record()
+        self._record = [chrom_id, start // self.reduction, start, end,
+                        bases, minimum, maximum, total, total_sq]
+
+    def _flush_record(self):
+        record = self._record
+        if record is None:
+            return
+        self._record = None
+        if self.next_level:
+            self.next_level.add(record[0], *record[2:])
+        if self._records and (record[0] != self._records[-1][0] or
+                              len(self._records) >= ITEMS_PER_SLOT):
+            self._flush_section()
+        self._records.append(record)
+        self.count += 1
+
+    def _flush_section(self):
+        records = self._records
+        if not records:
+            return
+        self._records = []
+        content = b"".join(
+            struct.pack("<" + ZOOM_RECORD, record[0], record[2], record[3],
+                        min(int(record[4]), 0xffffffff), *record[5:])
+            for record in records
+        )
+        self.max_section_size = max(self.max_section_size, len(content))
+        compressed = zlib.compress(content)
+        self.index.append((records[0][0],
+                           min(record[2] for record in records),
+                           records[0][0],
+                           max(record[3] for record in records),
+                           self.file.tell(), len(compressed)))
+        self.file.write(compressed)
+
+    def finish(self):
+        """Flush the records and the sections left"""
+        self._flush_record()
+        self._flush_section()
+        if self.next_level:
+            self.next_level.finish()
+
+    def close(self):
+        """Close the temporary file, and the ones of the next levels"""
+        self.file.close()
+        if self.next_level:
+            self.next_level.close()
+
+class BigWigWriter: # pylint: disable=too-many-instance-attributes
+    """Write the blocks to a bigWig file in one pass.
+    The data sections are written as the blocks come, and the zoom levels
+    are summarized alongside, so the blocks must be sorted: the blocks of a
+    chromosome adjacent, by their starts. Otherwise WiggleUnsortedFile is
+    raised, since the indexes and the zoom records would be broken"""
+
+    def __init__(self, outfile, chrom_sizes: Dict[str, int]):
+        self.chrom_sizes = chrom_sizes
+        self._fout = open(outfile, 'wb')
+        # chromosome name => id, in the order of appearance
+        self._chrom_ids = {}
+        self._index = []
+        self._max_section_size = 0
+        self._zoom = None
+        # bases covered, min, max, sum and sum of squares of all data
+        self._summary = [0, float('nan'), float('nan'), 0., 0.]
+        self._nitems = 0
+        # the chromosome id and the 0-based start of the last block
+        self._last = None
+
+        self._fout.write(b"\0" * (_size(HEADER) +
+                                  MAX_ZOOM_LEVELS *
+                                  _size(ZOOM_HEADER) +
+                                  _size(SUMMARY)))
+        self._data_offset = self._fout.tell()
+        # the number of sections, filled at the end
+        self._fout.write(b"\0" * 8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _chrom_id(self, chrom: str) -> int:
+        if chrom not in self._chrom_ids:
+            if chrom not in self.chrom_sizes:
+                raise WiggleBigWigError(f"Size of chromosome not found: "
+                                        f"{chrom}")
+            self._chrom_ids[chrom] = len(self._chrom_ids)
+        return self._chrom_ids[chrom]
+
+    def _init_zoom(self, block):
+        """Set up the zoom levels, with the first reduction level from
+        the spacing of the data of the first block"""
+        reduction = ZOOM_FACTOR * max(block.span,
+                                      block.step if block.is_fixed else 1)
+        level = None
+        for i in reversed(range(MAX_ZOOM_LEVELS)):
+            level = _ZoomLevel(reduction * ZOOM_FACTOR ** i, level)
+        self._zoom = level
+
+    def write(self, block):
+        """Write a block, split into sections of ITEMS_PER_SLOT items"""
+        if not block.data:
+            return
+        if self._zoom is None:
+            self._init_zoom(block)
+        chrom_id = self._chrom_id(block.chrom)
+        # 0-based starts
+        starts = (range(block.start - block.base,
+                        block.start - block.base +
+                        len(block.data) * block.step, block.step)
+                  if block.is_fixed
+                  else [pos - block.base for pos in block.regions])
+        span = block.span
+        self._check_order(block, chrom_id, starts[0])
+        if starts[-1] + span > self.chrom_sizes[block.chrom]:
+            raise WiggleBigWigError(
+                f"Block {block.block_id} exceeds the size of chromosome: "
+                f"{self.chrom_sizes[block.chrom]}"
+            )
+
+        for i in range(0, len(block.data), ITEMS_PER_SLOT):
+            values = array('f', block.data[i:i + ITEMS_PER_SLOT])
+            sstarts = starts[i:i + ITEMS_PER_SLOT]
+            if block.is_fixed:
+                content = struct.pack(
+                    "<" + SECTION_HEADER, chrom_id, sstarts[0],
+                    sstarts[-1] + span, block.step, span, SECTION_FIXED_STEP,
+                    0, len(values)
+                ) + _to_little(values)
+            else:
+                items = array('I', sstarts)
+                content = struct.pack(
+                    "<" + SECTION_HEADER, chrom_id, sstarts[0],
+                    sstarts[-1] + span, 0, span, SECTION_VARIABLE_STEP,
+                    0, len(values)
+                ) + _interleave(items, values)
+            self._write_section(content, chrom_id, sstarts[0],
+                                max(sstarts) + span)
+            self._summarize(chrom_id, sstarts, span, values)
+
+    def _check_order(self, block, chrom_id: int, start: int):
+        """Make sure the blocks of a chromosome are adjacent and sorted by
+        their starts, the chromosome ids being in the order of appearance"""
+        last = self._last
+        self._last = (chrom_id, start)
+        if last is None or (chrom_id, start) >= last:
+            return
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from wigtools.wiggle import WiggleUnsortedFile
+        if chrom_id != last[0]:
+            raise WiggleUnsortedFile(
+                f"Blocks of chromosome {block.chrom} are not adjacent, "
+                "sort the file before writing it to bigWig."
+            )
+        raise WiggleUnsortedFile(
+            f"Current wiggle file is not sorted. Region {block.block_id} "
+            f"appears after {block.chrom}:{last[1] + block.base}, "
+            "sort the file before writing it to bigWig."
+        )
+
+    def _write_section(self, content: bytes, chrom_id: int,
+                       start: int, end: int):
+        self._max_section_size = max(self._max_section_size, len(content))
+        compressed = zlib.compress(content)
+        self._index.append((chrom_id, start, chrom_id, end,
+                            self._fout.tell(), len(compressed)))
+        self._fout.write(compressed)
+
+    def _summarize(self, chrom_id: int, starts: Iterable[int], span: int,
+                   values: array):
+        """Update the total summary and the zoom levels with the items"""
+        summary = self._summary
+        summary[0] += span * len(values)
+        if not summary[1] <= min(values):
+            summary[1] = min(values)
+        if not summary[2] >= max(values):
+            summary[2] = max(values)
+        summary[3] += sum(values) * span
+        summary[4] += sum(value * value for value in values) * span
+        self._nitems += len(values)
+
+        level = self._zoom
+        reduction = level.reduction
+        for start, value in zip(starts, values):
+            end = start + span
+            if start // reduction == (end - 1) // reduction:
+                level.add(chrom_id, start, end, span, value, value,
+                          value * span, value * value * span)
+                continue
+            while start < end:
+                cut = min(end, (start // reduction + 1) * reduction)
+                bases = cut - start
+                level.add(chrom_id, start, cut, bases, value, value,
+                          value * bases, value * value * bases)
+                start = cut
+
+    def close(self):
+        """Write the indexes and the zoom levels, and fill the header"""
+        if self._fout.closed:
+            return
+        try:
+            self._finish()
+        finally:
+            self._fout.close()
+            if self._zoom:
+                self._zoom.close()
+
+    def _finish(self):
+        fout = self._fout
+        index_offset = fout.tell()
+        _write_cir_tree(fout, self._index, index_offset)
+
+        chrom_tree_offset = fout.tell()
+        _write_chrom_tree(fout, sorted(
+            (chrom.encode(), chrom_id, self.chrom_sizes[chrom])
+            for chrom, chrom_id in self._chrom_ids.items()
+        ))
+
+        zoom_headers = []
+        max_section_size = self._max_section_size
+        level = self._zoom
+        if level:
+            level.finish()
+        # keep the levels that reduce the data by at least half
+        nrecords = self._nitems
+        while level:
+            if level.count and level.count * 2 <= nrecords:
+                nrecords = level.count
+                max_section_size = max(max_section_size,
+                                       level.max_section_size)
+                zoom_offset = fout.tell()
+                fout.write(struct.pack("<I", level.count))
+                level.file.seek(0)
+                while True:
+                    content = level.file.read(1 << 20)
+                    if not content:
+                        break
+                    fout.write(content)
+                zoom_index_offset = fout.tell()
+                _write_cir_tree(fout, [
+                    item[:4] + (item[4] + zoom_offset + 4, item[5])
+                    for item in level.index
+                ], zoom_index_offset)
+                zoom_headers.append((level.reduction, 0, zoom_offset,
+                                     zoom_index_offset))
+            level = level.next_level
+
+        fout.seek(0)
+        summary_offset = (_size(HEADER) +
+                          MAX_ZOOM_LEVELS * _size(ZOOM_HEADER))
+        fout.write(struct.pack("<" + HEADER, BIGWIG_MAGIC, BIGWIG_VERSION,
+                               len(zoom_headers), chrom_tree_offset,
+                               self._data_offset, index_offset, 0, 0, 0,
+                               summary_offset, max_section_size, 0))
+        for zoom_header in zoom_headers:
+            fout.write(struct.pack("<" + ZOOM_HEADER, *zoom_header))
+        fout.seek(summary_offset)
+        summary = [0 if value != value else value # nan without data
+                   for value in self._summary]
+        fout.write(struct.pack("<" + SUMMARY, *summary))
+        fout.seek(self._data_offset)
+        fout.write(struct.pack("<Q", len(self._index)))
+
+def _to_little(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _interleave(starts: array, values: array) -> bytes:
+    """Interleave the starts (uint32) and the values (float32) of the
+    items of a variableStep section"""
+    items = array('I', bytes(8 * len(values)))
+    items[0::2] = starts
+    items[1::2] = array('I', values.tobytes())
+    return _to_little(items)
+
+def write_bigwig(blocks: Iterable, outfile,
+                 chrom_sizes: Dict[str, int]) -> int:
+    """Save the blocks to a bigWig file with the sizes of the chromosomes.
+    Returns the number of blocks written."""
+    nblocks = 0
+    with BigWigWriter(outfile, chrom_sizes) as writer:
+        for block in blocks:
+            writer.write(block)
+            nblocks += 1
+    return nblocks
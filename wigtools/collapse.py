@@ -0,0 +1,147 @@
+"""Collapse the data of the blocks into fewer lines for output"""
+from itertools import chain
+from typing import Iterable, Iterator, List, Tuple
+from wigtools.wiggle import WiggleBlock
+
+# min number of data points of a run to merge them into one, or to make
+# a fixedStep block out of them, which saves more lines than the meta
+# lines added
+COLLAPSE_MIN_RUN = 4
+# max number of data points of the collapsed blocks
+COLLAPSE_BLOCK_SIZE = 1 << 20
+
+def _iter_points(blocks: Iterable[WiggleBlock]) -> Iterator[Tuple]:
+    """Flatten the blocks into (chrom, position, span, value)"""
+    for block in blocks:
+        chrom = block.chrom
+        span = block.span
+        for pos, value in zip(block.regions, block.data):
+            yield chrom, pos, span, value
+
+def _iter_runs(points: Iterable[Tuple],
+               tolerance: float,
+               min_run: int) -> Iterator[Tuple]:
+    """Merge the runs of at least min_run adjacent data points, of which
+    the values differ by at most tolerance, into (chrom, position, length,
+    value), with the value being the middle of the range of the values.
+    Other data points are yielded as they are. Only the first min_run data
+    points of a run are kept."""
+    run = []
+    count = 0
+    low = high = None
+    for point in points:
+        chrom, pos, span, value = point
+        if run:
+            first = run[0]
+            if (chrom == first[0] and span == first[2] and
+                    pos == first[1] + count * span and
+                    max(high, value) - min(low, value) <= tolerance):
+                if count < min_run:
+                    run.append(point)
+                count += 1
+                low, high = min(low, value), max(high, value)
+                continue
+            yield from _finish_run(run, count, low, high, min_run)
+        run = [point]
+        count = 1
+        low = high = value
+    if run:
+        yield from _finish_run(run, count, low, high, min_run)
+
+def _finish_run(run: List[Tuple],
+                count: int,
+                low: float,
+                high: float,
+                min_run: int) -> Iterator[Tuple]:
+    """Merge a run of count data points if it is long enough"""
+    if count < min_run:
+        yield from run
+        return
+    chrom, pos, span, value = run[0]
+    yield (chrom, pos, span * count,
+           value if low == high else (low + high) / 2.)
+
+def _group_blocks(chrom: str,
+                  length: int,
+                  items: List[Tuple[int, float]],
+                  base: int,
+                  compact: bool,
+                  min_run: int) -> Iterator[WiggleBlock]:
+    """Make the blocks of the ascending data points of the same length.
+    The runs of at least min_run data points with a constant step (or all
+    of them) go to fixedStep blocks, and the rest to variableStep ones."""
+    variable = []
+
+    def _variable_block():
+        block = WiggleBlock(base=base, is_fixed=False, chrom=chrom,
+                            span=length, compact=compact)
+        block.take_parsed([value for _, value in variable],
+                          [pos for pos, _ in variable])
+        variable.clear()
+        return block
+
+    i = 0
+    nitems = len(items)
+    while i < nitems:
+        j = i + 1
+        step = length
+        if j < nitems:
+            step = items[j][0] - items[i][0]
+            while j < nitems and items[j][0] - items[j - 1][0] == step:
+                j += 1
+        if j - i < min_run and (i, j) != (0, nitems):
+            variable.append(items[i])
+            i += 1
+            continue
+        if variable:
+            yield _variable_block()
+        block = WiggleBlock(base=base, is_fixed=True, chrom=chrom,
+                            start=items[i][0], step=step, span=length,
+                            compact=compact)
+        block.take_parsed([value for _, value in items[i:j]])
+        yield block
+        i = j
+    if variable:
+        yield _variable_block()
+
+def collapse_blocks(blocks: Iterable[WiggleBlock],
+                    tolerance: float = 0.,
+                    min_run: int = COLLAPSE_MIN_RUN,
+                    block_size: int = COLLAPSE_BLOCK_SIZE
+                    ) -> Iterator[WiggleBlock]:
+    """Collapse the data of the blocks into fewer lines to write.
+
+    Runs of at least min_run adjacent data points (one ending where the
+    next one starts) with the same values, or values differing by at most
+    tolerance (lossy, the middle of the range is taken), are merged into
+    one with a wider span. The data points are then regrouped into blocks
+    by their spans, where the runs of at least min_run of them with a
+    constant step are written as fixedStep blocks and the others as
+    variableStep ones. Adjacent blocks on the same chromosome can be
+    joined, as long as the positions ascend.
+
+    For bedGraph output, where each data point is a line anyway, a
+    min_run of 2 merges all runs. The blocks are streamed, with at most
+    block_size data points kept for a collapsed block. All blocks must be
+    in the same coordinate base."""
+    tolerance = tolerance or 0.
+    blocks = iter(blocks)
+    first = next(blocks, None)
+    if first is None:
+        return
+    base, compact = first.base, first.compact
+    points = _iter_points(chain([first], blocks))
+
+    chrom = length = None
+    items = []
+    for ichrom, pos, ilength, value in _iter_runs(points, tolerance, min_run):
+        if items and (ichrom != chrom or ilength != length or
+                      pos < items[-1][0] + length or
+                      len(items) >= block_size):
+            yield from _group_blocks(chrom, length, items, base, compact,
+                                     min_run)
+            items = []
+        chrom, length = ichrom, ilength
+        items.append((pos, value))
+    if items:
+        yield from _group_blocks(chrom, length, items, base, compact, min_run)
@@ -0,0 +1,405 @@
+"""Compressed (gzip, BGZF and zstd) wiggle files.
+
+BGZF (the format of bgzip) is a series of gzip members of at most 64KB of
+data each, which can be read by any gzip reader. Since the members are
+independent, they are compressed and decompressed by a pool of threads
+(zlib releases the GIL), and a position in the file can be located by a
+virtual offset: the offset of the member in the compressed file shifted
+left by 16 bits, plus the offset in the uncompressed data of the member.
+
+zstd files need the `zstandard` package.
+"""
+import gzip
+import io
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+from wigtools.parallel import ordered_imap
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# output files are compressed by their suffixes. BGZF is written for
+# .gz files, since it can be read by any gzip reader.
+COMPRESSION_SUFFIXES = {".gz": "bgzf", ".bgz": "bgzf",
+                        ".zst": "zstd", ".zstd": "zstd"}
+
+# max size of the uncompressed data of a BGZF member, the same as bgzip
+BGZF_BLOCK_SIZE = 0xff00
+# number of BGZF members to compress or decompress in a task
+BGZF_TASK_BLOCKS = 64
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000"
+                         "000000000000")
+# size of the chunks to read ahead from gzip and zstd streams
+READ_AHEAD_SIZE = 1 << 22
+ZSTD_LEVEL = 3
+
+class WiggleCompressionError(Exception):
+    """When a compressed file is corrupted or cannot be handled"""
+
+def _sniff(head: bytes) -> Optional[str]:
+    """Detect the compression from the first bytes of a file"""
+    if head[:2] == GZIP_MAGIC:
+        # FEXTRA flag with a BC subfield first, as bgzip writes
+        if len(head) >= 14 and head[3] & 4 and head[12:14] == b"BC":
+            return "bgzf"
+        return "gzip"
+    if head[:4] == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+def detect_compression(path) -> Optional[str]:
+    """Detect the compression of a regular file by its magic bytes:
+    'bgzf', 'gzip', 'zstd' or None if not compressed.
+    Other files (i.e. pipes) cannot be peeked without consuming them, and
+    are detected while being opened by open_input."""
+    try:
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as fin:
+            return _sniff(fin.read(BGZF_HEADER.size))
+    except (OSError, TypeError):
+        return None
+
+def output_compression(path) -> Optional[str]:
+    """Get the compression of an output file by its suffix"""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(str(path))[1].lower())
+
+def _import_zstd():
+    try:
+        import zstandard # pylint: disable=import-outside-toplevel
+    except ImportError as exc: # pragma: no cover
+        raise WiggleCompressionError(
+            "zstd files need the `zstandard` package: "
+            "pip install zstandard"
+        ) from exc
+    return zstandard
+
+def _read_bgzf_block(fileobj) -> bytes:
+    """Read the raw bytes of the next BGZF member, empty at the end"""
+    header = fileobj.read(12)
+    if not header:
+        return b""
+    if len(header) < 12 or header[:2] != GZIP_MAGIC or not header[3] & 4:
+        raise WiggleCompressionError("Not a BGZF member.")
+    xlen = header[10] | header[11] << 8
+    extra = fileobj.read(xlen)
+    pos = 0
+    bsize = None
+    while pos + 4 <= len(extra):
+        slen = extra[pos + 2] | extra[pos + 3] << 8
+        if extra[pos:pos + 2] == b"BC":
+            bsize = extra[pos + 4] | extra[pos + 5] << 8
+            break
+        pos += 4 + slen
+    if bsize is None:
+        raise WiggleCompressionError("BGZF member without its size.")
+    rest = fileobj.read(bsize + 1 - 12 - xlen)
+    if len(rest) < bsize + 1 - 12 - xlen:
+        raise WiggleCompressionError("Truncated BGZF member.")
+    return header + extra + rest
+
+def _inflate_bgzf_block(block: bytes) -> bytes:
+    """Decompress the raw bytes of a BGZF member"""
+    xlen = block[10] | block[11] << 8
+    return zlib.decompress(block[12 + xlen:-8], -15)
+
+def _inflate_bgzf_blocks(blocks: List[bytes]) -> List[bytes]:
+    return [_inflate_bgzf_block(block) for block in blocks]
+
+def _deflate_bgzf_block(data: bytes, level: int = 6) -> bytes:
+    """Compress data of at most BGZF_BLOCK_SIZE bytes to a BGZF member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    return (BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                             len(cdata) + 25) +
+            cdata +
+            struct.pack("<II", zlib.crc32(data), len(data)))
+
+def _deflate_bgzf_blocks(data: bytes) -> bytes:
+    return b"".join(_deflate_bgzf_block(data[pos:pos + BGZF_BLOCK_SIZE])
+                    for pos in range(0, len(data), BGZF_BLOCK_SIZE))
+
+def iter_bgzf_offsets(path) -> Iterator[Tuple[int, int]]:
+    """Scan the headers of the BGZF members of a file for their offsets
+    in the compressed file and their sizes of the uncompressed data,
+    without decompressing them"""
+    with open(path, 'rb') as fin:
+        coffset = 0
+        while True:
+            header = fin.read(BGZF_HEADER.size)
+            if not header:
+                break
+            if _sniff(header) != "bgzf":
+                raise WiggleCompressionError("Not a BGZF member.")
+            bsize = BGZF_HEADER.unpack(header)[-1]
+            fin.seek(coffset + bsize + 1 - 4)
+            usize = struct.unpack("<I", fin.read(4))[0]
+            yield coffset, usize
+            coffset += bsize + 1
+
+def to_virtual_offsets(path, offsets: Iterable[int]) -> List[int]:
+    """Convert the sorted offsets in the uncompressed data of a BGZF file
+    to virtual offsets"""
+    ustarts = []
+    cstarts = []
+    ustart = 0
+    for coffset, usize in iter_bgzf_offsets(path):
+        if usize:
+            ustarts.append(ustart)
+            cstarts.append(coffset)
+            ustart += usize
+    ret = []
+    for offset in offsets:
+        i = bisect_right(ustarts, offset) - 1
+        ret.append(cstarts[i] << 16 | (offset - ustarts[i]))
+    return ret
+
+class BgzfReader(io.RawIOBase):
+    """Read a BGZF file, with the members decompressed by `jobs` threads.
+    seek() takes a virtual offset."""
+
+    def __init__(self, fileobj, jobs: int = 1):
+        super().__init__()
+        self._fileobj = fileobj
+        self.jobs = jobs
+        self._data = b""
+        self._pos = 0
+        self._blocks = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _iter_tasks(self) -> Iterator[List[bytes]]:
+        blocks = iter(lambda: _read_bgzf_block(self._fileobj), b"")
+        while True:
+            task = list(islice(blocks, BGZF_TASK_BLOCKS))
+            if not task:
+                return
+            yield task
+
+    def _iter_blocks(self) -> Iterator[bytes]:
+        if self.jobs > 1:
+            results = ordered_imap(_inflate_bgzf_blocks, self._iter_tasks(),
+                                   self.jobs,
+                                   executor_class=ThreadPoolExecutor)
+            for blocks in results:
+                yield from blocks
+        else:
+            for block in iter(lambda: _read_bgzf_block(self._fileobj), b""):
+                yield _inflate_bgzf_block(block)
+
+    def _next_block(self) -> bool:
+        """Load the data of the next non-empty member, False at the end"""
+        if self._blocks is None:
+            self._blocks = self._iter_blocks()
+        for data in self._blocks:
+            if data:
+                self._data = data
+                self._pos = 0
+                return True
+        self._data = b""
+        self._pos = 0
+        return False
+
+    def read(self, size=-1) -> bytes:
+        """Read size bytes, or to the end if size is negative"""
+        chunks = []
+        while size < 0 or size > 0:
+            if self._pos >= len(self._data) and not self._next_block():
+                break
+            end = (len(self._data) if size < 0
+                   else min(len(self._data), self._pos + size))
+            chunks.append(self._data[self._pos:end])
+            if size > 0:
+                size -= end - self._pos
+            self._pos = end
+        return b"".join(chunks)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET) -> int:
+        """Seek to a virtual offset"""
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("BGZF files only seek to "
+                                          "virtual offsets.")
+        self._close_blocks()
+        self._fileobj.seek(offset >> 16)
+        self._data = b""
+        self._pos = 0
+        within = offset & 0xffff
+        if within:
+            self._next_block()
+            self._pos = within
+        return offset
+
+    def _close_blocks(self):
+        if self._blocks is not None:
+            self._blocks.close()
+            self._blocks = None
+
+    def close(self):
+        if not self.closed:
+            self._close_blocks()
+            self._fileobj.close()
+        super().close()
+
+class BgzfWriter(io.RawIOBase):
+    """Write a BGZF file, with the members compressed by `jobs` threads"""
+
+    def __init__(self, fileobj, jobs: int = 1, level: int = 6):
+        super().__init__()
+        self._fileobj = fileobj
+        self.level = level
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(jobs) if jobs > 1 else None
+        self.jobs = jobs
+        # bytes of the data compressed at a time
+        self._batch_size = BGZF_BLOCK_SIZE * BGZF_TASK_BLOCKS * jobs
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._batch_size:
+            self._compress(len(self._buffer) // BGZF_BLOCK_SIZE *
+                           BGZF_BLOCK_SIZE)
+        return len(data)
+
+    def _compress(self, size: int):
+        """Compress and write the first size bytes of the buffer"""
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        task_size = BGZF_BLOCK_SIZE * BGZF_TASK_BLOCKS
+        tasks = [data[pos:pos + task_size]
+                 for pos in range(0, len(data), task_size)]
+        if self._executor and len(tasks) > 1:
+            self._fileobj.writelines(
+                self._executor.map(_deflate_bgzf_blocks, tasks)
+            )
+        else:
+            self._fileobj.writelines(map(_deflate_bgzf_blocks, tasks))
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._compress(len(self._buffer))
+                self._fileobj.write(BGZF_EOF)
+            finally:
+                if self._executor:
+                    self._executor.shutdown()
+                self._fileobj.close()
+        super().close()
+
+class ReadAheadReader(io.RawIOBase):
+    """Read the chunks of a stream in a background thread, so that the
+    decompression of gzip and zstd streams, which cannot be split, runs
+    alongside the parsing of the data"""
+
+    def __init__(self, fileobj, chunk_size: int = READ_AHEAD_SIZE):
+        super().__init__()
+        self._fileobj = fileobj
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(1)
+        self._future = self._executor.submit(fileobj.read, chunk_size)
+        self._data = b""
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1) -> bytes:
+        chunks = []
+        while size < 0 or size > 0:
+            if self._pos >= len(self._data):
+                if self._future is None:
+                    break
+                self._data = self._future.result()
+                self._pos = 0
+                if not self._data:
+                    self._future = None
+                    break
+                self._future = self._executor.submit(self._fileobj.read,
+                                                     self.chunk_size)
+            end = (len(self._data) if size < 0
+                   else min(len(self._data), self._pos + size))
+            chunks.append(self._data[self._pos:end])
+            if size > 0:
+                size -= end - self._pos
+            self._pos = end
+        return b"".join(chunks)
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown()
+            self._fileobj.close()
+        super().close()
+
+def open_input(path, binary: bool = True, jobs: int = 1):
+    """Open a file to read, decompressing it if it is compressed, which is
+    detected by the magic bytes, so pipes work as well.
+    With jobs > 1, BGZF members are decompressed by `jobs` threads, and
+    gzip and zstd streams are decompressed in a background thread."""
+    fileobj = open(path, 'rb')
+    compression = _sniff(fileobj.peek(BGZF_HEADER.size))
+    if compression == "bgzf":
+        reader = BgzfReader(fileobj, jobs)
+    elif compression == "gzip":
+        reader = gzip.GzipFile(fileobj=fileobj)
+        # closed with the GzipFile, as gzip.open does
+        reader.myfileobj = fileobj
+    elif compression == "zstd":
+        reader = _import_zstd().ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True
+        )
+    else:
+        reader = fileobj
+
+    if compression in ("gzip", "zstd") and jobs > 1:
+        reader = ReadAheadReader(reader)
+    if binary:
+        return reader
+    if isinstance(reader, io.RawIOBase):
+        reader = io.BufferedReader(reader)
+    return io.TextIOWrapper(reader)
+
+def open_compressed_output(path, jobs: int = 1, buffer_size: int = None,
+                           binary: bool = False):
+    """Open a file to write, compressed by its suffix
+    (see COMPRESSION_SUFFIXES), with `jobs` threads to compress the data.
+    None is returned if the file is not to be compressed."""
+    compression = output_compression(path)
+    if compression is None:
+        return None
+    fileobj = open(path, 'wb')
+    if compression == "bgzf":
+        writer = io.BufferedWriter(BgzfWriter(fileobj, jobs),
+                                   buffer_size or io.DEFAULT_BUFFER_SIZE)
+    else:
+        compressor = _import_zstd().ZstdCompressor(
+            level=ZSTD_LEVEL, threads=jobs if jobs > 1 else 0
+        )
+        writer = compressor.stream_writer(fileobj)
+    return writer if binary else io.TextIOWrapper(writer)
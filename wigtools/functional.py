@@ -1,11 +1,28 @@
 """Implementation of functions for the tools"""
 import sys
 from pathlib import Path
-from typing import List, Iterable
-from wigtools.wiggle import Wiggle
+from typing import Dict, List, Iterable, Iterator, Tuple
+from wigtools.wiggle import (Wiggle, WiggleBlock, intersect_blocks, is_sorted,
+                             iter_block_stats, iter_windows, open_output,
+                             set_chrom_order, read_chrom_order)
+from wigtools.index import (build_index, copy_blocks, read_index,
+                            query_records, write_index, fetch_bigwig,
+                            fetch_wiggle)
+from wigtools.wbin import write_wbin
+from wigtools.compress import open_input
+from wigtools.bigwig import (ZOOM_STATISTICS, BigWigFile, WiggleBigWigError,
+                             is_bigwig, read_chrom_sizes, write_bigwig)
+from wigtools.sorting import (DEFAULT_MAX_MEMORY, can_copy_sorted,
+                              check_sorted as _check_sorted,
+                              copy_sorted_blocks, iter_sorted_blocks,
+                              parse_size)
+from wigtools.splitting import split_blocks
+from wigtools.merging import merge_blocks
+from wigtools.transform import transform_blocks
+from wigtools.collapse import COLLAPSE_MIN_RUN, collapse_blocks
 
 def _bed_to_regions(bedfile: str) -> Iterable:
-    with open(bedfile) as fbed:
+    with open_input(bedfile, binary=False) as fbed:
         for line in fbed:
             line = line.rstrip("\r\n")
             if line[:1] == '#':
@@ -13,70 +30,326 @@ def _bed_to_regions(bedfile: str) -> Iterable:
             parts = line.split("\t")[:3]
             yield parts[0], int(parts[1]), int(parts[2])
 
+def _intersect(infile: str, # pylint: disable=too-many-arguments
+               base: int,
+               qfile: str,
+               qbase: int,
+               reshape: bool = False,
+               partial: str = "fraction",
+               jobs: int = 1) -> Iterator[WiggleBlock]:
+    """Get the blocks that intersect with the query regions, or the reshaped
+    blocks.
 
-def switch_base(infile: str, outfile: str, from_base: int, to_base: int):
+    If the input file has an index file, only the blocks overlapping with
+    the query regions are read. Otherwise, sorted query regions are merged
+    with the blocks streamed from the input file if they are sorted as well,
+    which is checked up front for regular wiggle files by scanning the
+    locations of the blocks. If not, the blocks are indexed to look up the
+    regions, with only the overlapping ones read for regular wiggle files.
+    For bigWig files, only the data sections overlapping with the regions
+    are read.
+    """
+    regions = list(_bed_to_regions(qfile))
+    bigwig = is_bigwig(infile)
+    records = None if bigwig else read_index(infile, base=base)
+    if records is None and can_copy_sorted(infile):
+        records = build_index(infile, base, jobs)
+        if is_sorted(regions) and is_sorted(
+                (record.chrom, record.start, record.end)
+                for record in records
+        ):
+            records = None
+
+    if bigwig:
+        wiggle = fetch_bigwig(infile, regions, base, qbase, compact=True)
+    elif records is not None:
+        wiggle = fetch_wiggle(infile, regions, records, base, qbase,
+                              compact=True)
+    elif is_sorted(regions):
+        blocks = Wiggle.iter_blocks(infile, base, compact=True, jobs=jobs)
+        for _, block in intersect_blocks(blocks, regions, base, qbase,
+                                         reshape=reshape, partial=partial,
+                                         compact=True):
+            yield block
+        return
+    else:
+        wiggle = Wiggle(infile, base, compact=True, jobs=jobs)
+    wiggle = (wiggle.reshape(regions, qbase, partial)
+              if reshape else wiggle.query(regions, qbase))
+    yield from wiggle.blocks.values()
+
+def _collapse(blocks: Iterable[WiggleBlock],
+              collapse: bool,
+              tolerance: float,
+              fmt: str = 'wiggle') -> Iterable[WiggleBlock]:
+    """Collapse the blocks for output if asked, see collapse_blocks"""
+    if not collapse:
+        return blocks
+    return collapse_blocks(blocks, tolerance,
+                           2 if fmt == 'bedgraph' else COLLAPSE_MIN_RUN)
+
+def switch_base(infile: str, # pylint: disable=too-many-arguments
+                outfile: str,
+                from_base: int,
+                to_base: int,
+                jobs: int = 1,
+                collapse: bool = False,
+                tolerance: float = 0.):
     """Switch the coordinate base of a wiggle file"""
-    wiggle = Wiggle(infile, base=from_base)
-    wiggle.stringify(base=to_base, outfile=outfile)
+    blocks = Wiggle.iter_blocks(infile, base=from_base, compact=True,
+                                jobs=jobs)
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in _collapse(blocks, collapse, tolerance):
+            block.stringify(base=to_base, writer=fout)
 
-def sort(infile: str, outfile: str):
-    """Sort the blocks in a wiggle file by chrom and start. """
-    wiggle = Wiggle(infile)
-    wiggle.sort()
-    wiggle.stringify(outfile=outfile)
+def sort(infile: str,
+         outfile: str,
+         chroms: str = None,
+         max_memory=DEFAULT_MAX_MEMORY,
+         tmpdir: str = None,
+         jobs: int = 1):
+    """Sort the blocks in a wiggle file by chrom and start.
+    Blocks of regular wiggle files are copied in order without parsing,
+    otherwise, they are sorted in runs within max_memory, which are spilled
+    to tmpdir and merged"""
+    if chroms:
+        set_chrom_order(read_chrom_order(chroms))
+    if can_copy_sorted(infile):
+        copy_sorted_blocks(infile, outfile, jobs)
+        return
+    blocks = Wiggle.iter_blocks(infile, compact=True, jobs=jobs)
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in iter_sorted_blocks(blocks, parse_size(max_memory),
+                                        tmpdir):
+            block.stringify(writer=fout)
 
-def stats(infile: str, outfile: str, base: int,
-          statistics: List[str], header: bool):
-    "Statistics for data in a wiggle file for each block"
-    wiggle = Wiggle(infile, base)
+def check_sorted(infile: str, chroms: str = None, jobs: int = 1) -> bool:
+    """Check if the blocks in a wiggle file are sorted by chrom and start"""
+    if chroms:
+        set_chrom_order(read_chrom_order(chroms))
+    unsorted = _check_sorted(infile, jobs)
+    if unsorted is None:
+        sys.stderr.write("[wigtools] Sorted.\n")
+        return True
+    prev, block = unsorted
+    sys.stderr.write(f"[wigtools] Not sorted: {block.chrom}:{block.start} "
+                     f"appears after {prev.chrom}:{prev.start}.\n")
+    return False
 
-    with open(outfile, 'w') as fout:
+def stats(infile: str, # pylint: disable=too-many-arguments
+          outfile: str,
+          base: int,
+          statistics: List[str],
+          header: bool,
+          approx: bool = False,
+          jobs: int = 1):
+    "Statistics for data in a wiggle file for each block"
+    with open_output(outfile, jobs=jobs) as fout:
         if header:
             fout.write("Chrom\tStart\tEnd\t{}\n".format('\t'.join(statistics)))
-        for block in wiggle.blocks.values():
-            bstats = block.stats(statistics)
+        blocks = Wiggle.iter_blocks(infile, base, compact=True, jobs=jobs)
+        for chrom, start, end, bstats in iter_block_stats(blocks, statistics,
+                                                          jobs, approx):
             stats_str = "\t".join(str(bstats[stat]) for stat in statistics)
-            fout.write(f"{block.chrom}\t{block.start}\t"
-                       f"{block.end}\t{stats_str}\n")
+            fout.write(f"{chrom}\t{start}\t{end}\t{stats_str}\n")
 
 def reshape(infile: str, # pylint: disable=too-many-arguments
             outfile: str,
             base: int,
             qfile: str,
             qbase: int,
-            partial: str):
+            partial: str,
+            chroms: str = None,
+            jobs: int = 1,
+            collapse: bool = False,
+            tolerance: float = 0.):
     """Summarize data in a wiggle file for the regions in given region file"""
-    wiggle = Wiggle(infile, base)
-    regions = _bed_to_regions(qfile)
-
-    wiggle = wiggle.reshape(regions, qbase, partial)
-
-    wiggle.stringify(outfile=outfile)
+    if chroms:
+        set_chrom_order(read_chrom_order(chroms))
+    blocks = _intersect(infile, base, qfile, qbase,
+                        reshape=True, partial=partial, jobs=jobs)
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in _collapse(blocks, collapse, tolerance):
+            block.stringify(base, writer=fout)
 
 
-def query(infile: str,
+def query(infile: str, # pylint: disable=too-many-arguments
           outfile: str,
           base: int,
           qfile: str,
-          qbase: int):
-    """Summarize data in a wiggle file for the regions in given region file"""
-    wiggle = Wiggle(infile, base)
-    regions = _bed_to_regions(qfile)
+          qbase: int,
+          chroms: str = None,
+          jobs: int = 1):
+    """Get the blocks in a wiggle file overlapping with the regions in given
+    region file. For regular wiggle files (uncompressed or BGZF compressed),
+    the bytes of the blocks are copied to the output as they are, located
+    by the index file or a scan of the locations of the blocks."""
+    if chroms:
+        set_chrom_order(read_chrom_order(chroms))
+    if can_copy_sorted(infile):
+        records = read_index(infile, base=base)
+        if records is None:
+            records = build_index(infile, base, jobs)
+        records = query_records(records, _bed_to_regions(qfile), base, qbase)
+        with open_output(outfile, binary=True, jobs=jobs) as fout:
+            copy_blocks(infile, records, fout, add_span=True)
+        return
 
-    wiggle = wiggle.query(regions, qbase)
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in _intersect(infile, base, qfile, qbase, jobs=jobs):
+            block.stringify(base, writer=fout)
 
-    wiggle.stringify(outfile=outfile)
+def summarize(infile: str, # pylint: disable=too-many-arguments
+              outfile: str,
+              base: int,
+              qfile: str,
+              qbase: int,
+              statistics: List[str],
+              partial: str = "fraction",
+              header: bool = True,
+              approx: bool = False,
+              jobs: int = 1):
+    """Calculate the statistics of the data in each region of the query
+    file. Only the blocks overlapping with the regions are read if the
+    input file has an index file or it is a bigWig file"""
+    regions = list(_bed_to_regions(qfile))
+    if is_bigwig(infile):
+        results = _summarize_bigwig(infile, regions, base, qbase,
+                                    statistics, partial, approx)
+    else:
+        records = read_index(infile, base=base)
+        if records is not None:
+            wiggle = fetch_wiggle(infile, regions, records, base, qbase,
+                                  compact=True)
+        else:
+            wiggle = Wiggle(infile, base, compact=True, jobs=jobs)
+        results = wiggle.summarize(regions, qbase, statistics, partial,
+                                   approx)
 
-def split(infile: str, outprefix: str):
-    """Split blocks into different files"""
+    with open_output(outfile, jobs=jobs) as fout:
+        if header:
+            fout.write("Chrom\tStart\tEnd\t{}\n".format('\t'.join(statistics)))
+        for region, rstats in results:
+            stats_str = "\t".join(str(rstats[stat]) for stat in statistics)
+            fout.write(f"{region[0]}\t{region[1]}\t{region[2]}\t"
+                       f"{stats_str}\n")
+
+def _summarize_bigwig(bwfile: str, # pylint: disable=too-many-arguments
+                      regions: List[Tuple],
+                      base: int,
+                      qbase: int,
+                      statistics: List[str],
+                      partial: str = "fraction",
+                      approx: bool = False) -> Iterator[Tuple]:
+    """Summarize the regions of a bigWig file.
+    With approx, the statistics in ZOOM_STATISTICS are estimated from the
+    zoom levels, and only the regions too small for any zoom levels are
+    summarized from the data"""
+    qbase = base if qbase is None else qbase
+    rstats = [None] * len(regions)
+    if approx and set(statistics) <= set(ZOOM_STATISTICS):
+        with BigWigFile(bwfile) as bigwig:
+            rstats = [bigwig.zoom_stats(region, qbase, statistics)
+                      for region in regions]
+    exact = [region for region, stats in zip(regions, rstats)
+             if stats is None]
+    if exact:
+        wiggle = fetch_bigwig(bwfile, exact, base, qbase, compact=True)
+        exact_stats = wiggle.summarize(exact, qbase, statistics, partial,
+                                       approx)
+        rstats = [stats or next(exact_stats)[1] for stats in rstats]
+    return zip(regions, rstats)
+
+def _chrom_sizes(chroms: str) -> Dict[str, int]:
+    """Read the chromosome sizes needed by bigWig output"""
+    if not chroms:
+        raise WiggleBigWigError("A file with the sizes of chromosomes "
+                                "(`--chroms`) is required for bigWig "
+                                "output.")
+    return read_chrom_sizes(chroms)
+
+def index(infile: str, outfile: str = None, jobs: int = 1):
+    """Build the index file for a wiggle file"""
+    idxfile = write_index(infile, outfile, jobs)
+    sys.stderr.write(f"[wigtools] Index saved to: {idxfile}\n")
+
+def convert(infile: str, outfile: str, to: str, # pylint: disable=invalid-name
+            float32: bool = False, chroms: str = None, jobs: int = 1):
+    """Convert a wiggle file (or a wbin or bigWig file) to another format"""
+    blocks = Wiggle.iter_blocks(infile, compact=True, jobs=jobs)
+    if to in ('wbin', 'bigwig'):
+        nblocks = (write_wbin(blocks, outfile, float32) if to == 'wbin' else
+                   write_bigwig(blocks, outfile, _chrom_sizes(chroms)))
+        sys.stderr.write(f"[wigtools] {nblocks} blocks saved.\n")
+        return
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in blocks:
+            block.stringify(fmt=to, writer=fout)
+
+def window(infile: str, # pylint: disable=too-many-arguments
+           outfile: str,
+           base: int,
+           size: int,
+           step: int = None,
+           stat: str = "mean",
+           partial: str = "fraction",
+           fmt: str = "wiggle",
+           chroms: str = None,
+           jobs: int = 1):
+    """Bin the data of a wiggle file into fixed-size windows"""
+    blocks = Wiggle.iter_blocks(infile, base, compact=True, jobs=jobs)
+    windows = iter_windows(blocks, size, step, stat, partial, base,
+                           compact=True)
+    if fmt == 'bigwig':
+        write_bigwig(windows, outfile, _chrom_sizes(chroms))
+        return
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in windows:
+            block.stringify(fmt=fmt, writer=fout)
+
+def merge(infiles: List[str], # pylint: disable=too-many-arguments
+          outfile: str,
+          base: int,
+          op: str = "mean",
+          fmt: str = "wiggle",
+          chroms: str = None,
+          jobs: int = 1,
+          collapse: bool = False,
+          tolerance: float = 0.):
+    """Merge the data of multiple sorted wiggle files position by position"""
+    tracks = [Wiggle.iter_blocks(infile, base, compact=True)
+              for infile in infiles]
+    blocks = _collapse(merge_blocks(tracks, op, base, compact=True),
+                       collapse, tolerance, fmt)
+    if fmt == 'bigwig':
+        write_bigwig(blocks, outfile, _chrom_sizes(chroms))
+        return
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in blocks:
+            block.stringify(fmt=fmt, writer=fout)
+
+def transform(infile: str, # pylint: disable=too-many-arguments
+              outfile: str,
+              operations: List[str],
+              jobs: int = 1,
+              collapse: bool = False,
+              tolerance: float = 0.):
+    """Transform the values of a wiggle file by a chain of operations"""
+    blocks = transform_blocks(
+        Wiggle.iter_blocks(infile, compact=True, jobs=jobs),
+        operations, infile, jobs
+    )
+    with open_output(outfile, jobs=jobs) as fout:
+        for block in _collapse(blocks, collapse, tolerance):
+            block.stringify(writer=fout)
+
+def split(infile: str, outprefix: str, by: str = "block", jobs: int = 1):
+    """Split blocks into different files, one for each block or each
+    chromosome"""
     outdir = Path(outprefix).parent
     if not outdir.exists():
         outdir.mkdir()
 
-    wiggle = Wiggle(infile)
-    for block_id, block in wiggle.blocks.items():
-        sys.stderr.write(f"[wigtools] Saving block: {block_id}\n")
-        outfile = (outprefix + '_' + block_id.replace(':', '_') +
-                   '_' + str(block.end) + ".wig")
-        with open(outfile, 'w') as fout:
-            block.stringify(writer=fout)
+    blocks = Wiggle.iter_blocks(infile, compact=True, jobs=jobs)
+    nfiles = split_blocks(blocks, str(outprefix), by=by, jobs=jobs)
+    sys.stderr.write(f"[wigtools] {nfiles} files saved.\n")
@@ -0,0 +1,321 @@
+"""Index files (.idx) of wiggle files for random access to the blocks"""
+import io
+import os
+import sys
+from typing import Iterable, Iterator, List, Optional, Tuple
+import attr
+from wigtools.compress import (WiggleCompressionError, detect_compression,
+                               open_input, to_virtual_offsets)
+from wigtools.bigwig import BigWigFile
+from wigtools.wiggle import (Wiggle, WiggleBlock, BlockIndex, bigwig_blocks,
+                             _iter_chunks, _parse_meta_line)
+
+INDEX_SUFFIX = ".idx"
+# blocks with data at least this size are copied by os.sendfile
+SENDFILE_MIN_SIZE = 1 << 20
+# size of the pieces to copy the bytes of blocks in
+COPY_CHUNK_SIZE = 1 << 22
+INDEX_HEADER = "#wigtools index"
+INDEX_COLUMNS = ("chrom", "start", "end", "span", "step",
+                 "fixed", "offset", "length", "lines")
+
+@attr.s(kw_only=True, slots=True)
+class IndexRecord: # pylint: disable=too-many-instance-attributes
+    """The location and the region of a block in a wiggle file"""
+    chrom = attr.ib()
+    start = attr.ib()
+    # the end of the block, in the coordinate base used to read the index.
+    # It is saved in index files as 1-based.
+    end = attr.ib()
+    span = attr.ib(default=1)
+    step = attr.ib(default=None)
+    is_fixed = attr.ib()
+    # byte offset of the meta line of the block in the wiggle file, or the
+    # virtual offset of it for BGZF files
+    offset = attr.ib()
+    # bytes of the block (uncompressed), including the meta line
+    length = attr.ib()
+    # number of data lines
+    nlines = attr.ib()
+
+@attr.s(kw_only=True, slots=True)
+class _RecordBuilder:
+    """Collect the information of a block while scanning a wiggle file"""
+    meta = attr.ib()
+    offset = attr.ib()
+    end_offset = attr.ib(default=None)
+    first_line = attr.ib(default=None)
+    last_line = attr.ib(default=None)
+    nlines = attr.ib(default=0)
+
+    def take(self, chunk: bytes, offset: int):
+        """Take in a chunk of data lines of the block"""
+        chunk = bytes(chunk)
+        lines = chunk.strip()
+        if not lines:
+            return
+        self.nlines += _count_lines(chunk)
+        if self.first_line is None:
+            self.first_line = lines.split(b"\n", 1)[0]
+        self.last_line = lines.rsplit(b"\n", 1)[-1]
+        self.end_offset = offset + len(chunk)
+
+    def record(self, base: int = 1) -> Optional[IndexRecord]:
+        """Make the index record, None if the block has no data"""
+        if not self.nlines:
+            return None
+        span = self.meta.get("span", 1)
+        if self.meta["is_fixed"]:
+            start = self.meta["start"]
+            step = self.meta.get("step", 1)
+            last = start + (self.nlines - 1) * step
+        else:
+            start = int(self.first_line.split()[0])
+            step = None
+            last = int(self.last_line.split()[0])
+        return IndexRecord(chrom=self.meta["chrom"],
+                           start=start,
+                           end=last + span - base,
+                           span=span,
+                           step=step,
+                           is_fixed=self.meta["is_fixed"],
+                           offset=self.offset,
+                           length=self.end_offset - self.offset,
+                           nlines=self.nlines)
+
+def _count_lines(chunk: bytes) -> int:
+    """Count the non-empty lines in a chunk"""
+    nlines = chunk.count(b"\n") + (not chunk.endswith(b"\n"))
+    if (chunk[:1] in (b"\n", b"\r") or
+            b"\n\n" in chunk or b"\n\r\n" in chunk):
+        nlines -= sum(1 for line in chunk.splitlines() if not line.strip())
+    return nlines
+
+def index_file(wigfile) -> str:
+    """Get the path of the index file of a wiggle file"""
+    return str(wigfile) + INDEX_SUFFIX
+
+def build_index(wigfile, base: int = 1, jobs: int = 1) -> List[IndexRecord]:
+    """Scan a wiggle file for the locations and the regions of its blocks,
+    with the ends in the given coordinate base.
+    The data lines are not parsed, except the first and the last ones of
+    variableStep blocks. Blocks without data are skipped.
+    The wiggle file must be a regular file, either uncompressed or BGZF
+    compressed, of which the offsets of the blocks are virtual offsets.
+    BGZF compressed files are decompressed with `jobs` threads."""
+    compression = detect_compression(wigfile)
+    if compression not in (None, "bgzf"):
+        raise WiggleCompressionError(
+            f"Cannot index {compression} compressed files, "
+            "compress them with bgzip instead."
+        )
+    records = []
+    builder = None
+    for meta_line, chunk, offset in _iter_chunks(wigfile, binary=True,
+                                                  jobs=jobs):
+        if meta_line is not None:
+            if builder:
+                records.append(builder.record(base))
+            builder = _RecordBuilder(meta=_parse_meta_line(meta_line),
+                                     offset=offset)
+        elif builder:
+            builder.take(chunk, offset)
+    if builder:
+        records.append(builder.record(base))
+    records = [record for record in records if record]
+    if compression == "bgzf":
+        for record, offset in zip(records, to_virtual_offsets(
+                wigfile, [record.offset for record in records]
+        )):
+            record.offset = offset
+    return records
+
+def write_index(wigfile, idxfile=None, jobs: int = 1) -> str:
+    """Build the index of a wiggle file and save it to idxfile
+    (default: <wigfile>.idx). The size and the modification time of the
+    wiggle file are saved as well to detect outdated index files."""
+    idxfile = idxfile or index_file(wigfile)
+    records = build_index(wigfile, jobs=jobs)
+    stat = os.stat(wigfile)
+    with open(idxfile, 'w') as fidx:
+        fidx.write(f"{INDEX_HEADER}\tsize={stat.st_size}\t"
+                   f"mtime={stat.st_mtime_ns}\n")
+        fidx.write("#" + "\t".join(INDEX_COLUMNS) + "\n")
+        for record in records:
+            fidx.write("\t".join(str(item) for item in (
+                record.chrom, record.start, record.end, record.span,
+                "" if record.step is None else record.step,
+                int(record.is_fixed), record.offset, record.length,
+                record.nlines
+            )) + "\n")
+    return idxfile
+
+def read_index(wigfile,
+               idxfile=None,
+               base: int = 1) -> Optional[List[IndexRecord]]:
+    """Read the index of a wiggle file, with the ends of the blocks
+    converted to the given coordinate base.
+    None is returned if the index file does not exist, or it is outdated
+    (the size or the modification time of the wiggle file changed)."""
+    idxfile = idxfile or index_file(wigfile)
+    if not os.path.isfile(idxfile) or not os.path.isfile(wigfile):
+        return None
+
+    stat = os.stat(wigfile)
+    records = []
+    with open(idxfile) as fidx:
+        header = fidx.readline().rstrip("\r\n").split("\t")
+        info = dict(item.split("=", 1) for item in header[1:])
+        if (header[0] != INDEX_HEADER or
+                info.get("size") != str(stat.st_size) or
+                info.get("mtime") != str(stat.st_mtime_ns)):
+            sys.stderr.write(f"[wigtools] Index file is outdated, "
+                             f"ignored: {idxfile}\n")
+            return None
+        for line in fidx:
+            if line[:1] == "#":
+                continue
+            (chrom, start, end, span, step,
+             is_fixed, offset, length,
+             nlines) = line.rstrip("\r\n").split("\t")
+            records.append(IndexRecord(chrom=chrom,
+                                       start=int(start),
+                                       end=int(end) + 1 - base,
+                                       span=int(span),
+                                       step=int(step) if step else None,
+                                       is_fixed=is_fixed == "1",
+                                       offset=int(offset),
+                                       length=int(length),
+                                       nlines=int(nlines)))
+    return records
+
+def fetch_blocks(wigfile,
+                 records: Iterable[IndexRecord],
+                 base: int = 1,
+                 compact: bool = False) -> Iterator[WiggleBlock]:
+    """Read and parse only the blocks of the given index records"""
+    with open_input(wigfile) as fwig:
+        for record in records:
+            fwig.seek(record.offset)
+            meta_line, data = _split_meta_line(fwig.read(record.length))
+            block = WiggleBlock(**_parse_meta_line(meta_line),
+                                base=base, compact=compact)
+            block.take_chunk(data)
+            yield block
+
+def _split_meta_line(content: bytes) -> Tuple[bytes, bytes]:
+    """Split the meta line and the data lines of a block"""
+    meta_line, _, data = content.partition(b"\n")
+    return meta_line, data
+
+def fetch_wiggle(wigfile, # pylint: disable=too-many-arguments
+                 regions: Iterable[Tuple],
+                 records: List[IndexRecord],
+                 base: int = 1,
+                 qbase: int = None,
+                 compact: bool = False) -> Wiggle:
+    """Load only the blocks overlapping with the query regions,
+    using the index records of the wiggle file"""
+    needed = query_records(records, regions, base, qbase)
+    wiggle = Wiggle(None, base, compact)
+    for block in fetch_blocks(wigfile,
+                              sorted(needed,
+                                     key=lambda record: record.offset),
+                              base, compact):
+        wiggle.blocks.setdefault(block.block_id, block)
+    return wiggle
+
+def query_records(records: Iterable[IndexRecord],
+                  regions: Iterable[Tuple],
+                  base: int = 1,
+                  qbase: int = None) -> List[IndexRecord]:
+    """Get the index records of the blocks overlapping with the query
+    regions, in the order that Wiggle.query returns the blocks: for each
+    region, the blocks ordered by their starts. Of the blocks with the same
+    chromosome and start, only the first one in the file is kept."""
+    first = {}
+    for record in sorted(records, key=lambda record: record.offset):
+        first.setdefault((record.chrom, record.start), record)
+    index = BlockIndex(first.values(), base)
+    ret = {}
+    for region in regions:
+        for record in index.query(region, qbase):
+            ret.setdefault(record.offset, record)
+    return list(ret.values())
+
+def _copy_range(fwig, fout, length: int) -> bytes:
+    """Copy length bytes from the current position of fwig to fout.
+    Returns the last piece copied."""
+    content = b""
+    while length > 0:
+        content = fwig.read(min(length, COPY_CHUNK_SIZE))
+        if not content:
+            break
+        fout.write(content)
+        length -= len(content)
+    return content
+
+def _can_sendfile(fwig, fout) -> bool:
+    """Whether the bytes can be copied between the files by os.sendfile,
+    which needs both of them to be uncompressed files"""
+    return (hasattr(os, "sendfile") and
+            isinstance(fwig, io.BufferedReader) and
+            isinstance(fwig.raw, io.FileIO) and
+            isinstance(fout, io.BufferedWriter) and
+            isinstance(fout.raw, io.FileIO))
+
+def copy_blocks(wigfile,
+                records: Iterable[IndexRecord],
+                fout,
+                add_span: bool = False) -> int:
+    """Copy the bytes of the blocks of the index records from the wiggle
+    file to fout (opened in binary mode) as they are, without parsing and
+    formatting the data. With add_span, `span=` is added to the meta lines
+    without it. Large blocks are copied by os.sendfile if both files are
+    uncompressed. Returns the number of blocks copied."""
+    nblocks = 0
+    with open_input(wigfile) as fwig:
+        sendfile = _can_sendfile(fwig, fout)
+        for record in records:
+            nblocks += 1
+            fwig.seek(record.offset)
+            meta_line = fwig.readline()
+            length = record.length - len(meta_line)
+            if add_span and b"span=" not in meta_line:
+                meta_line = (meta_line.rstrip(b"\r\n") +
+                             f" span={record.span}\n".encode())
+            fout.write(meta_line)
+            if sendfile and length >= SENDFILE_MIN_SIZE:
+                fout.flush()
+                offset = record.offset + record.length - length
+                while length > 0:
+                    sent = os.sendfile(fout.fileno(), fwig.fileno(),
+                                       offset, length)
+                    if not sent:
+                        break
+                    offset += sent
+                    length -= sent
+                fwig.seek(offset - 1)
+                content = fwig.read(1)
+            else:
+                content = _copy_range(fwig, fout, length)
+            # the last block of the file may not end with a newline
+            if content[-1:] != b"\n":
+                fout.write(b"\n")
+    return nblocks
+
+def fetch_bigwig(bwfile,
+                 regions: Iterable[Tuple],
+                 base: int = 1,
+                 qbase: int = None,
+                 compact: bool = False) -> Wiggle:
+    """Load only the data sections of a bigWig file overlapping with the
+    query regions, located by the R-tree index of the file"""
+    qbase = base if qbase is None else qbase
+    wiggle = Wiggle(None, base, compact)
+    with BigWigFile(bwfile) as bigwig:
+        sections = bigwig.query_sections(regions, qbase)
+        for block in bigwig_blocks(bigwig.iter_blocks(sections, base),
+                                   base, compact):
+            wiggle.blocks.setdefault(block.block_id, block)
+    return wiggle
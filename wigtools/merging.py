@@ -0,0 +1,234 @@
+"""Merge the data of multiple tracks position by position"""
+from array import array
+from bisect import bisect_left
+from operator import add
+from typing import Iterable, Iterator, List, Tuple
+from wigtools.wiggle import WiggleBlock, WiggleUnsortedFile
+
+# number of bases of a chromosome to merge at a time
+MERGE_CHUNK_SIZE = 1 << 16
+# the value to fill the positions of a track without data, and the function
+# to accumulate the values of the tracks, for each operation
+MERGE_OPERATIONS = {
+    "sum": (0.0, add),
+    "mean": (0.0, add),
+    "max": (float("-inf"), max),
+    "min": (float("inf"), min),
+    "count": (None, None),
+}
+
+class WiggleUnsupportedMergeOperation(Exception):
+    """When the operation to merge the tracks is not supported"""
+
+def _stop(block: WiggleBlock) -> int:
+    """The exclusive end of a block, in the coordinate base of the block"""
+    return block.end + block.base
+
+class _Track:
+    """A sorted stream of the blocks of a track, with the blocks that
+    overlap with the current chunk pending"""
+
+    __slots__ = ("name", "blocks", "next_block", "pending", "last_key")
+
+    def __init__(self, blocks: Iterable[WiggleBlock], name: str):
+        self.name = name
+        self.blocks = iter(blocks)
+        self.next_block = None
+        self.pending = []
+        self.last_key = None
+        self._advance()
+
+    def _advance(self):
+        """Move to the next block, which must not be before the last one"""
+        block = next(self.blocks, None)
+        if block is not None:
+            key = (block.chrom_key, block.start)
+            if self.last_key is not None and key < self.last_key:
+                raise WiggleUnsortedFile(
+                    f"Track {self.name} is not sorted. Block "
+                    f"{block.block_id} appears after a later one, sort it "
+                    "with `wigtools sort` first."
+                )
+            self.last_key = key
+        self.next_block = block
+
+    def next_start(self, chrom_key) -> int:
+        """The start of the next block on the chromosome, None if none"""
+        if self.next_block is None or self.next_block.chrom_key != chrom_key:
+            return None
+        return self.next_block.start
+
+    def load(self, chrom_key, end: int):
+        """Take the blocks of the chromosome starting before end"""
+        while (self.next_block is not None and
+               self.next_block.chrom_key == chrom_key and
+               self.next_block.start < end):
+            self.pending.append(self.next_block)
+            self._advance()
+
+    def intervals(self, start: int, end: int) -> Tuple[list, list, list]:
+        """Get the data points overlapping with [start, end), as the lists
+        of their starts, ends and values, clipped to the range.
+        Whether any data point starts at start or ends at end (before
+        clipping) is returned as well."""
+        starts, ends, values = [], [], []
+        real_start = real_end = False
+        for block in self.pending:
+            regions = block.regions
+            span = block.span
+            i = bisect_left(regions, start - span + 1)
+            j = bisect_left(regions, end)
+            if i >= j:
+                continue
+            bstarts = list(regions[i:j])
+            bends = list(map(span.__add__, bstarts))
+            real_start = real_start or bstarts[0] == start
+            real_end = real_end or bends[-1] == end
+            # only the first and the last ones can be out of the range
+            bstarts[0] = max(bstarts[0], start)
+            bends[-1] = min(bends[-1], end)
+            starts.extend(bstarts)
+            ends.extend(bends)
+            values.extend(block.data[i:j])
+        return starts, ends, values, real_start, real_end
+
+    def release(self, end: int):
+        """Drop the pending blocks that end before end"""
+        self.pending = [block for block in self.pending
+                        if _stop(block) > end]
+
+def _merge_chunk(intervals: List[Tuple],
+                 op: str) -> Iterator[Tuple[int, int, float]]:
+    """Merge the data points of the tracks in a chunk, see
+    _Track.intervals.
+
+    The chunk is cut into segments at the boundaries of the data points,
+    and the values of each track are laid out over the segments by slice
+    assignments, then accumulated segment-wise across the tracks.
+    Yields (start, end, value) of the segments covered by any tracks."""
+    bounds = set()
+    for starts, ends, _, _, _ in intervals:
+        bounds.update(starts)
+        bounds.update(ends)
+    bounds = sorted(bounds)
+    nseg = len(bounds) - 1
+    if nseg < 1:
+        return
+    index = {pos: i for i, pos in enumerate(bounds)}
+    fill, func = MERGE_OPERATIONS[op]
+    counts = [0] * nseg
+    values = None if func is None else array('d', [fill]) * nseg
+    for starts, ends, tvalues, _, _ in intervals:
+        if not starts:
+            continue
+        covered = bytearray(nseg)
+        laid = None if func is None else array('d', [fill]) * nseg
+        for i, j, value in zip(map(index.__getitem__, starts),
+                               map(index.__getitem__, ends), tvalues):
+            if j - i == 1:
+                covered[i] = 1
+                if laid is not None:
+                    laid[i] = value
+                continue
+            covered[i:j] = b"\x01" * (j - i)
+            if laid is not None:
+                laid[i:j] = array('d', [value]) * (j - i)
+        counts = list(map(add, counts, covered))
+        if values is not None:
+            values = array('d', map(func, values, laid))
+
+    for i, count in enumerate(counts):
+        if not count:
+            continue
+        if op == "count":
+            value = float(count)
+        elif op == "mean":
+            value = values[i] / count
+        else:
+            value = values[i]
+        yield bounds[i], bounds[i + 1], value
+
+def _iter_chrom_segments(tracks: List[_Track],
+                         chrom_key,
+                         op: str,
+                         chunk_size: int) -> Iterator[Tuple[int, int, float]]:
+    """Merge the data of the tracks on a chromosome chunk by chunk.
+    Segments cut only by the chunk boundaries are joined back."""
+    held = None
+    cut_real = True
+    start = None
+    while True:
+        if not any(track.pending for track in tracks):
+            starts = [pos for pos in (track.next_start(chrom_key)
+                                      for track in tracks)
+                      if pos is not None]
+            if not starts:
+                break
+            # the next blocks start after the current chunk
+            start = min(starts)
+        end = start + chunk_size
+        for track in tracks:
+            track.load(chrom_key, end)
+        intervals = [track.intervals(start, end) for track in tracks]
+        cut_real = cut_real or any(track[3] for track in intervals)
+        for segment in _merge_chunk(intervals, op):
+            if held is not None:
+                if (not cut_real and held[1] == start and
+                        segment[0] == start):
+                    segment = (held[0], segment[1], segment[2])
+                else:
+                    yield held
+            held = segment
+        cut_real = any(track[4] for track in intervals)
+        for track in tracks:
+            track.release(end)
+        start = end
+    if held is not None:
+        yield held
+
+def merge_blocks(tracks: Iterable[Iterable[WiggleBlock]],
+                 op: str = "mean",
+                 base: int = 1,
+                 compact: bool = False,
+                 chunk_size: int = None) -> Iterator[WiggleBlock]:
+    """Merge the blocks of multiple tracks position by position, by a k-way
+    streaming merge of the sorted blocks of the tracks.
+
+    The value of each position covered by any of the tracks is the `op`
+    (sum, mean, max, min or count) of the values of the tracks covering it,
+    so that tracks with different spans and fixedStep or variableStep
+    blocks can be merged. The data points of a track should not overlap.
+
+    The chromosomes are merged in chunks of `chunk_size` (default:
+    MERGE_CHUNK_SIZE) bases, so only the blocks overlapping with the
+    current chunk are kept for each track. The merged positions are
+    yielded as variableStep blocks of at most `chunk_size` data points,
+    with the runs of the same length of positions in the same block.
+    All tracks must be sorted, and be read in the given coordinate base."""
+    if op not in MERGE_OPERATIONS:
+        raise WiggleUnsupportedMergeOperation(
+            f"Unsupported operation to merge the tracks: {op}"
+        )
+    chunk_size = chunk_size or MERGE_CHUNK_SIZE
+    tracks = [_Track(blocks, str(i + 1)) for i, blocks in enumerate(tracks)]
+    while True:
+        heads = [track.next_block for track in tracks
+                 if track.next_block is not None]
+        if not heads:
+            break
+        first = min(heads, key=lambda block: block.chrom_key)
+        block = None
+        for start, end, value in _iter_chrom_segments(
+                tracks, first.chrom_key, op, chunk_size
+        ):
+            if (block is None or end - start != block.span or
+                    len(block.data) >= chunk_size):
+                if block is not None:
+                    yield block
+                block = WiggleBlock(base=base, is_fixed=False,
+                                    chrom=first.chrom, start=start,
+                                    span=end - start, compact=compact)
+            block.data.append(value)
+            block._regions.append(start) # pylint: disable=protected-access
+        if block is not None:
+            yield block
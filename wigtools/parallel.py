@@ -0,0 +1,26 @@
+"""Helpers to run the tasks in parallel"""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Type
+
+def ordered_imap(func: Callable,
+                 iterable: Iterable,
+                 jobs: int,
+                 window: int = None,
+                 executor_class: Type[Executor] = ProcessPoolExecutor
+                 ) -> Iterator:
+    """Map func over the iterable with a pool of `jobs` workers, and yield
+    the results in the order of the iterable.
+
+    The iterable is consumed lazily, with at most `window` (default:
+    2 * jobs) tasks pending, so that the finished results waiting to be
+    reordered are bounded. func must be picklable for process pools."""
+    window = window or 2 * jobs
+    with executor_class(max_workers=jobs) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,139 @@
+"""Sort the blocks of wiggle files that may not fit in memory"""
+import heapq
+import os
+import re
+import shutil
+from tempfile import TemporaryDirectory
+from typing import Iterable, Iterator, List, Optional, Tuple
+from wigtools.wiggle import (Wiggle, WiggleBlock, READ_CHUNK_SIZE,
+                             _sort_key, find_unsorted_block,
+                             open_output)
+from wigtools.index import (IndexRecord, build_index, copy_blocks,
+                            read_index)
+from wigtools.wbin import is_wbin, write_wbin
+from wigtools.compress import detect_compression, open_input
+from wigtools.bigwig import is_bigwig
+
+# default memory budget of the blocks to sort in memory
+DEFAULT_MAX_MEMORY = 1 << 30
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+def parse_size(size) -> int:
+    """Parse a size like 512M or 2G to bytes"""
+    if isinstance(size, int):
+        return size
+    matched = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*",
+                           str(size), re.IGNORECASE)
+    if not matched:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(matched.group(1)) *
+               SIZE_UNITS[matched.group(2).upper()])
+
+def _block_key(block: WiggleBlock):
+    """The sort key of a block, the same as Wiggle.sort uses"""
+    return block.chrom_key, block.chrom, block.start
+
+def _block_size(block: WiggleBlock) -> int:
+    """Estimate the memory of a block in bytes"""
+    # data and regions of compact blocks take 8 bytes each, lists of
+    # python floats and ints take about 32 bytes each
+    itemsize = 8 if block.compact else 32
+    npoints = len(block.data)
+    return 256 + itemsize * npoints * (1 if block.is_fixed else 2)
+
+def sort_records(records: Iterable[IndexRecord]) -> List[IndexRecord]:
+    """Sort the index records of the blocks by chromosome and start.
+    Records of the same chromosome and start are dropped except the first
+    one, as Wiggle does for the blocks with the same id."""
+    ret = []
+    for record in sorted(records, key=_sort_key):
+        if (ret and ret[-1].chrom == record.chrom and
+                ret[-1].start == record.start):
+            continue
+        ret.append(record)
+    return ret
+
+def copy_sorted_blocks(wigfile, outfile, jobs: int = 1) -> int:
+    """Sort the blocks of a regular wiggle file by their locations only,
+    which are read from the index file if available, and copy the bytes
+    of the blocks to outfile in order, without parsing and formatting the
+    data. If the blocks are already sorted, the file is copied unchanged.
+    BGZF compressed files are scanned and copied with `jobs` threads to
+    decompress them, and the output is compressed with `jobs` threads.
+    Returns the number of blocks written."""
+    records = read_index(wigfile)
+    if records is None:
+        records = build_index(wigfile, jobs=jobs)
+    sorted_records = sort_records(records)
+    with open_output(outfile, binary=True, jobs=jobs) as fout:
+        if (len(sorted_records) == len(records) and
+                find_unsorted_block(records) is None):
+            with open_input(wigfile, jobs=jobs) as fwig:
+                shutil.copyfileobj(fwig, fout, READ_CHUNK_SIZE)
+            return len(records)
+        copy_blocks(wigfile, sorted_records, fout)
+    return len(sorted_records)
+
+def _spill(run: List[WiggleBlock], workdir: str, index: int) -> str:
+    """Sort the blocks of a run and save them to a wbin file"""
+    run.sort(key=_block_key)
+    runfile = os.path.join(workdir, f"run{index}.wbin")
+    write_wbin(run, runfile)
+    return runfile
+
+def iter_sorted_blocks(blocks: Iterable[WiggleBlock],
+                       max_memory: int = DEFAULT_MAX_MEMORY,
+                       tmpdir: str = None) -> Iterator[WiggleBlock]:
+    """Sort the blocks by chromosome and start, with at most about
+    max_memory bytes of blocks kept in memory.
+
+    The blocks are taken in runs within the memory budget, each run is
+    sorted and spilled to a temporary wbin file, and the runs are merged,
+    with the blocks read back lazily from the memory-mapped files. The
+    blocks with the same id are dropped except the first one, as Wiggle
+    does."""
+    with TemporaryDirectory(prefix="wigtools-sort-", dir=tmpdir) as workdir:
+        runfiles = []
+        run = []
+        run_size = 0
+        for block in blocks:
+            run.append(block)
+            run_size += _block_size(block)
+            if run_size >= max_memory:
+                runfiles.append(_spill(run, workdir, len(runfiles)))
+                run = []
+                run_size = 0
+
+        run.sort(key=_block_key)
+        # merge is stable, the last run is put last to keep the order
+        # of the blocks with the same key
+        runs = [Wiggle.iter_blocks(runfile, compact=True)
+                for runfile in runfiles]
+        runs.append(iter(run))
+        last_id = None
+        for block in heapq.merge(*runs, key=_block_key):
+            if block.block_id == last_id:
+                continue
+            last_id = block.block_id
+            yield block
+
+def check_sorted(wigfile, jobs: int = 1) -> Optional[Tuple]:
+    """Check if the blocks of a wiggle file are sorted by chrom and start,
+    in one streaming pass. Regular wiggle files are only scanned for the
+    locations of the blocks, without parsing the data.
+    Returns the first block (or index record) out of order and the one
+    before it, or None if sorted. Compressed files are decompressed with
+    `jobs` threads."""
+    if can_copy_sorted(wigfile):
+        records = read_index(wigfile)
+        return find_unsorted_block(build_index(wigfile, jobs=jobs)
+                                   if records is None else records)
+    return find_unsorted_block(Wiggle.iter_blocks(wigfile, compact=True,
+                                                  jobs=jobs))
+
+def can_copy_sorted(wigfile) -> bool:
+    """Tell if the blocks of a file can be sorted by copying the bytes,
+    that is, it is a regular wiggle file, uncompressed or BGZF compressed"""
+    return (os.path.isfile(wigfile) and not is_wbin(wigfile) and
+            not is_bigwig(wigfile) and
+            detect_compression(wigfile) in (None, "bgzf"))
@@ -0,0 +1,124 @@
+"""Split the blocks of wiggle files into different files"""
+import sys
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Tuple
+from wigtools.wiggle import WRITE_BUFFER_SIZE, WiggleBlock, open_output
+from wigtools.parallel import ordered_imap
+
+# number of data points of the blocks to format in a task
+SPLIT_TASK_SIZE = 1 << 18
+# max number of output files kept open when splitting by chromosome
+MAX_OPEN_FILES = 64
+SPLIT_MODES = ("block", "chrom")
+
+class WiggleUnsupportedSplitMode(Exception):
+    """When an unsupported way to split the blocks is given"""
+
+def block_outfile(outprefix: str, block: WiggleBlock, by: str = "block"):
+    """Get the output file of a block"""
+    if by == "chrom":
+        return f"{outprefix}_{block.chrom}.wig"
+    return (outprefix + '_' + block.block_id.replace(':', '_') +
+            '_' + str(block.end) + ".wig")
+
+def _iter_split_tasks(blocks: Iterable[WiggleBlock],
+                      outprefix: str,
+                      by: str) -> Iterator[List[Tuple]]:
+    """Group the blocks into tasks of about SPLIT_TASK_SIZE data points,
+    with the output files of the blocks"""
+    task = []
+    task_size = 0
+    for block in blocks:
+        if isinstance(block.data, memoryview):
+            # views of memory-mapped wbin files cannot be pickled
+            block.data = array(block.data.format, block.data)
+        task.append((by, block_outfile(outprefix, block, by), block))
+        task_size += len(block.data)
+        if task_size >= SPLIT_TASK_SIZE:
+            yield task
+            task = []
+            task_size = 0
+    if task:
+        yield task
+
+def _split_task(task: List[Tuple]) -> List[Tuple[str, str, str]]:
+    """Format the blocks of a task in a worker.
+    Blocks split by block are written to their own files here, and the
+    formatted blocks are returned when split by chromosome, to be written
+    in order to the shared files."""
+    ret = []
+    for by, outfile, block in task:
+        if by == "chrom":
+            ret.append((block.block_id, outfile, block.stringify()))
+            continue
+        with open_output(outfile) as fout:
+            block.stringify(writer=fout)
+        ret.append((block.block_id, outfile, None))
+    return ret
+
+class _OutputFiles:
+    """A pool of output files with at most `max_open` open at a time.
+    The least recently used one is closed when a file has to be opened,
+    and it is opened again to append when it is written to later."""
+
+    def __init__(self, max_open: int = MAX_OPEN_FILES):
+        self.max_open = max(max_open, 1)
+        self.handles = OrderedDict()
+        self.opened = set()
+
+    def write(self, outfile: str, content: str):
+        """Write the content to the file"""
+        handle = self.handles.get(outfile)
+        if handle is None:
+            if len(self.handles) >= self.max_open:
+                self.handles.popitem(last=False)[1].close()
+            handle = open(outfile, 'a' if outfile in self.opened else 'w',
+                          buffering=WRITE_BUFFER_SIZE)
+            self.opened.add(outfile)
+            self.handles[outfile] = handle
+        else:
+            self.handles.move_to_end(outfile)
+        handle.write(content)
+
+    def close(self):
+        """Close all the open files"""
+        while self.handles:
+            self.handles.popitem()[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def split_blocks(blocks: Iterable[WiggleBlock],
+                 outprefix: str,
+                 by: str = "block",
+                 jobs: int = 1,
+                 max_open: int = MAX_OPEN_FILES) -> int:
+    """Split the blocks into different files, one for each block or each
+    chromosome. Returns the number of files written.
+
+    The blocks are streamed, and with jobs > 1, they are grouped into tasks
+    balanced by the number of data points and formatted by a pool of
+    processes, which also write the files when split by block. When split
+    by chromosome, the formatted blocks are written in the order of the
+    input to the files of their chromosomes, with at most `max_open` files
+    open at a time."""
+    if by not in SPLIT_MODES:
+        raise WiggleUnsupportedSplitMode(
+            f"Unsupported way to split the blocks: {by}"
+        )
+    tasks = _iter_split_tasks(blocks, outprefix, by)
+    results = (map(_split_task, tasks) if jobs <= 1
+               else ordered_imap(_split_task, tasks, jobs))
+    outfiles = set()
+    with _OutputFiles(max_open) as files:
+        for result in results:
+            for block_id, outfile, content in result:
+                sys.stderr.write(f"[wigtools] Saved block: {block_id}\n")
+                outfiles.add(outfile)
+                if content is not None:
+                    files.write(outfile, content)
+    return len(outfiles)
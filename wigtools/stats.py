@@ -0,0 +1,294 @@
+"""Statistics of the data of the blocks"""
+import random
+from array import array
+from bisect import bisect_right, insort
+from typing import Callable, List, Sequence, Tuple
+
+STATISTICS = ('min', 'max', 'mean', 'median', 'sum', 'count', 'bp',
+              'std', 'q25', 'q75', 'nonzero', 'coverage')
+DEFAULT_STATISTICS = ('min', 'max', 'mean', 'median', 'sum', 'count', 'bp')
+QUANTILES = {'q25': .25, 'median': .5, 'q75': .75}
+# statistics that can be calculated from the count, the sum and the sum
+# of squares of the data
+SUM_STATISTICS = ('mean', 'sum', 'count', 'bp', 'std', 'coverage')
+
+class WiggleUnsupportedStatistic(Exception):
+    """When the statistic to calculate is not supported"""
+
+def normalize_statistics(what=None) -> List[str]:
+    """Get the list of statistics to calculate, with the default ones if
+    not given, and check if they are supported"""
+    what = what or list(DEFAULT_STATISTICS)
+    if not isinstance(what, list):
+        what = [what]
+    for stat in what:
+        if stat not in STATISTICS:
+            raise WiggleUnsupportedStatistic(
+                f"Unsupported statistic: {stat}, "
+                f"expect one of {', '.join(STATISTICS)}"
+            )
+    return what
+
+def _select(values: List[float], k: int) -> float:
+    """Get the k-th (0-based) smallest value with quickselect,
+    in expected O(n) time"""
+    while True:
+        pivot = values[random.randrange(len(values))]
+        lows = [value for value in values if value < pivot]
+        if k < len(lows):
+            values = lows
+            continue
+        highs = [value for value in values if value > pivot]
+        nlows_equals = len(values) - len(highs)
+        if k < nlows_equals:
+            return pivot
+        k -= nlows_equals
+        values = highs
+
+def quantile(values: Sequence[float], prob: float) -> float:
+    """Get the exact quantile of the values, linearly interpolated between
+    the closest ranks (as numpy.quantile does by default)"""
+    pos = prob * (len(values) - 1)
+    lower_rank = int(pos)
+    frac = pos - lower_rank
+    lower = _select(values, lower_rank)
+    if frac == 0:
+        return lower
+    upper = _select(values, lower_rank + 1)
+    return lower * (1 - frac) + upper * frac
+
+class P2Quantile:
+    """Approximate a quantile in constant memory with the P² algorithm
+    (Jain & Chlamtac, 1985), which keeps 5 markers of the distribution"""
+
+    __slots__ = ('prob', '_heights', '_positions', '_desired', '_increments')
+
+    def __init__(self, prob: float):
+        self.prob = prob
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * prob, 1 + 4 * prob, 3 + 2 * prob, 5]
+        self._increments = [0, prob / 2, prob, (1 + prob) / 2, 1]
+
+    def add(self, value: float):
+        """Add a value to the sketch"""
+        heights = self._heights
+        if len(heights) < 5:
+            insort(heights, value)
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect_right(heights, value) - 1
+
+        positions = self._positions
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        desired = self._desired
+        for i, increment in enumerate(self._increments):
+            desired[i] += increment
+
+        for i in (1, 2, 3):
+            diff = desired[i] - positions[i]
+            if ((diff >= 1 and positions[i + 1] - positions[i] > 1) or
+                    (diff <= -1 and positions[i - 1] - positions[i] < -1)):
+                diff = 1 if diff > 0 else -1
+                height = self._parabolic(i, diff)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, diff)
+                heights[i] = height
+                positions[i] += diff
+
+    def _parabolic(self, i: int, diff: int) -> float:
+        """The piecewise-parabolic prediction of marker i"""
+        heights = self._heights
+        positions = self._positions
+        return heights[i] + diff / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + diff) *
+            (heights[i + 1] - heights[i]) /
+            (positions[i + 1] - positions[i]) +
+            (positions[i + 1] - positions[i] - diff) *
+            (heights[i] - heights[i - 1]) /
+            (positions[i] - positions[i - 1])
+        )
+
+    def _linear(self, i: int, diff: int) -> float:
+        """The linear prediction of marker i"""
+        heights = self._heights
+        positions = self._positions
+        return heights[i] + diff * (heights[i + diff] - heights[i]) / (
+            positions[i + diff] - positions[i]
+        )
+
+    def value(self) -> float:
+        """The estimated quantile, exact if less than 5 values added"""
+        if not self._heights:
+            return float('nan')
+        if len(self._heights) < 5:
+            return quantile(self._heights, self.prob)
+        return self._heights[2]
+
+def _reduce_chunk(values: Sequence[float],
+                  adds: List[Callable]) -> Tuple:
+    """Reduce a chunk of values in one pass to their sum, the sum of their
+    squared deviations, min, max and the number of zeros, feeding them to
+    the sketches by `adds` as well.
+    The deviations are shifted by the first value to keep the precision,
+    see the shifted data algorithm of the variance."""
+    shift = low = high = values[0]
+    total = squares = 0.
+    zeros = 0
+    for value in values:
+        diff = value - shift
+        total += diff
+        squares += diff * diff
+        if value < low:
+            low = value
+        elif value > high:
+            high = value
+        if not value:
+            zeros += 1
+        for add in adds:
+            add(value)
+    size = len(values)
+    return (total + shift * size, max(0., squares - total * total / size),
+            low, high, zeros)
+
+class StatsAccumulator: # pylint: disable=too-many-instance-attributes
+    """Accumulate the statistics of the data in one pass.
+
+    The data can be fed in chunks as they are read. Each chunk is reduced
+    in one pass to its sum, min, max, number of zeros and sum of squared
+    deviations, which are merged into the running ones, with Chan's update
+    of Welford's mean and sum of squared deviations. When only the sum is
+    needed, it is taken by the builtin. The values are kept only if the
+    exact quantiles are requested, otherwise, with approx being True, the
+    quantiles are estimated by P² sketches in constant memory, fed in the
+    same pass."""
+
+    __slots__ = ('what', 'count', 'total', 'minimum', 'maximum', 'nonzero',
+                 '_mean', '_m2', '_values', '_sketches', '_sum_only')
+
+    def __init__(self, what=None, approx: bool = False):
+        self.what = what = normalize_statistics(what)
+        self.count = 0
+        self.total = 0.
+        self.minimum = float('nan')
+        self.maximum = float('nan')
+        self.nonzero = 0
+        self._mean = 0.
+        self._m2 = 0.
+        self._values = None
+        self._sketches = None
+
+        probs = [QUANTILES[stat] for stat in what if stat in QUANTILES]
+        if probs and approx:
+            self._sketches = {prob: P2Quantile(prob) for prob in probs}
+        elif probs:
+            self._values = array('d')
+        self._sum_only = (not self._sketches and
+                          set(what) <= set(SUM_STATISTICS) - {'std'})
+
+    def update(self, values: Sequence[float]):
+        """Update the statistics with a chunk of values"""
+        size = len(values)
+        if not size:
+            return
+        if self._sum_only:
+            self.count += size
+            self.total += sum(values)
+        else:
+            total, m2, low, high, zeros = _reduce_chunk(
+                values,
+                [sketch.add for sketch in self._sketches.values()]
+                if self._sketches else []
+            )
+            if self.count:
+                self.minimum = min(self.minimum, low)
+                self.maximum = max(self.maximum, high)
+            else:
+                self.minimum, self.maximum = low, high
+            self.nonzero += size - zeros
+            self._merge_moments(size, total / size, m2)
+            self.count += size
+            self.total += total
+
+        if self._values is not None:
+            # an array('d') cannot be extended by arrays of other types
+            self._values.extend(values
+                                if getattr(values, 'typecode', 'd') == 'd'
+                                else iter(values))
+
+    def update_sums(self, count: int, total: float, total_sq: float = None):
+        """Update the statistics with the count, the sum and the sum of the
+        squares (needed for `std`) of a chunk of values, for example, got
+        from the cumulative sums. Only SUM_STATISTICS are updated."""
+        if not count:
+            return
+        if 'std' in self.what:
+            mean = total / count
+            self._merge_moments(count, mean, max(0., total_sq - total * mean))
+        self.count += count
+        self.total += total
+
+    def _merge_moments(self, size: int, mean: float, m2: float):
+        """Merge the mean and the sum of squared deviations of a chunk
+        into the running ones (Chan's parallel update of Welford's)"""
+        count = self.count + size
+        delta = mean - self._mean
+        self._mean += delta * size / count
+        self._m2 += m2 + delta * delta * self.count * size / count
+
+    def _quantile(self, prob: float) -> float:
+        if self._sketches:
+            return self._sketches[prob].value()
+        if not self._values:
+            return float('nan')
+        return quantile(self._values, prob)
+
+    def result(self, span: int = 1, length: int = None) -> dict:
+        """Get the requested statistics.
+        The span of the data points and the length of the region covered
+        by the block are used for `bp` and `coverage`"""
+        ret = {}
+        for stat in self.what:
+            if stat == 'min':
+                ret[stat] = self.minimum
+            elif stat == 'max':
+                ret[stat] = self.maximum
+            elif stat == 'mean':
+                ret[stat] = (self.total / self.count
+                             if self.count else float('nan'))
+            elif stat == 'sum':
+                ret[stat] = self.total
+            elif stat == 'count':
+                ret[stat] = self.count
+            elif stat == 'bp':
+                ret[stat] = self.count * span
+            elif stat == 'std':
+                # population standard deviation
+                ret[stat] = ((self._m2 / self.count) ** .5
+                             if self.count else float('nan'))
+            elif stat == 'nonzero':
+                ret[stat] = self.nonzero
+            elif stat == 'coverage':
+                ret[stat] = (min(self.count * span, length) / length
+                             if length else float('nan'))
+            else:
+                ret[stat] = self._quantile(QUANTILES[stat])
+        return ret
+
+def block_stats(data: Sequence[float],
+                span: int = 1,
+                what=None,
+                length: int = None,
+                approx: bool = False) -> dict:
+    """Calculate stats of the data of a block"""
+    accumulator = StatsAccumulator(what, approx)
+    accumulator.update(data)
+    return accumulator.result(span, length)
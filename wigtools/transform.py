@@ -0,0 +1,245 @@
+"""Transform the values of wiggle files with a chain of operations"""
+import json
+import math
+import os
+import sys
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from wigtools.wiggle import Wiggle, WiggleBlock
+from wigtools.stats import StatsAccumulator
+
+# suffix of the files caching the summaries of the first passes
+SUMMARY_SUFFIX = ".wsum"
+SUMMARY_HEADER = "wigtools summary"
+# operations that need the summary of the values of the whole file
+TWO_PASS_OPERATIONS = ("cpm", "zscore")
+OPERATIONS = ("scale", "add", "abs", "log", "log1p", "clip") + \
+    TWO_PASS_OPERATIONS
+
+class WiggleTransformError(Exception):
+    """When an operation is invalid or cannot be applied"""
+
+class _LogDomainError(Exception):
+    """When a log operation gets values out of its domain.
+    Not a ValueError, so that it is not caught again by the log operations
+    chained after the one raising it"""
+
+def _float(value: str, spec: str) -> float:
+    """Convert an argument of an operation to float"""
+    try:
+        return float(value)
+    except ValueError:
+        raise WiggleTransformError(
+            f"Invalid argument of operation {spec}: {value}"
+        ) from None
+
+def parse_operation(spec: str) -> Tuple[str, List[float]]:
+    """Parse an operation like `scale:2`, `clip:0:10` or `clip::10`,
+    with the arguments separated by colons. Empty arguments are None."""
+    name, *args = spec.split(":")
+    if name not in OPERATIONS:
+        raise WiggleTransformError(
+            f"Unsupported operation: {name}, expect one of "
+            f"{', '.join(OPERATIONS)}"
+        )
+    args = [None if arg == "" else _float(arg, spec) for arg in args]
+    nargs = {"scale": (1, 1), "add": (1, 1), "log": (0, 1),
+             "clip": (1, 2)}.get(name, (0, 0))
+    if not nargs[0] <= len(args) <= nargs[1]:
+        raise WiggleTransformError(
+            f"Operation {name} takes {nargs[0]} to {nargs[1]} arguments, "
+            f"got: {spec}"
+        )
+    if (name == "log" and args and args[0] is not None and
+            (args[0] <= 0 or args[0] == 1)):
+        raise WiggleTransformError(
+            f"The base of operation log must be positive and not 1, "
+            f"got: {spec}"
+        )
+    return name, args
+
+def _scale(factor: float) -> Callable:
+    """Multiply the values by factor"""
+    return partial(map, float(factor).__mul__)
+
+def _add(value: float) -> Callable:
+    """Add value to the values"""
+    return partial(map, float(value).__add__)
+
+def _map_log(func: Callable,
+             values: Iterable[float],
+             name: str) -> Iterator[float]:
+    """Map the log function over the values, with the ValueError for values
+    out of its domain raised as _LogDomainError of the operation name"""
+    try:
+        yield from map(func, values)
+    except ValueError:
+        raise _LogDomainError(name) from None
+
+def _log(values: Iterable[float], base: float = None) -> Iterator[float]:
+    """Take the logarithms of the values, natural if no base given.
+    Raises _LogDomainError for non-positive values"""
+    logs = _map_log(math.log, values, "log")
+    if base is None:
+        return logs
+    return map((1. / math.log(base)).__mul__, logs)
+
+def _clip(minimum: float = None, maximum: float = None) -> List[Callable]:
+    """Limit the values to [minimum, maximum], either can be None"""
+    funcs = []
+    if minimum is not None:
+        funcs.append(partial(map, partial(max, minimum)))
+    if maximum is not None:
+        funcs.append(partial(map, partial(min, maximum)))
+    return funcs
+
+def compile_operation(name: str,
+                      args: List[float],
+                      summary: Dict[str, dict] = None,
+                      chrom: str = None) -> List[Callable]:
+    """Make the functions of an operation for WiggleBlock.apply.
+    The operations of TWO_PASS_OPERATIONS need the summary of the values
+    (see summarize_values), and the chromosome of the block for zscore"""
+    if name == "scale":
+        return [_scale(args[0])]
+    if name == "add":
+        return [_add(args[0])]
+    if name == "abs":
+        return [partial(map, abs)]
+    if name == "log1p":
+        return [partial(_map_log, math.log1p, name="log1p")]
+    if name == "log":
+        return [partial(_log, base=args[0] if args else None)]
+    if name == "clip":
+        return _clip(*args)
+    if name == "cpm":
+        total = sum(stats["sum"] for stats in summary.values())
+        return [_scale(1e6 / total if total else 0.)]
+    # zscore
+    stats = summary[chrom]
+    if not stats["std"]:
+        return [partial(map, (0.).__mul__)]
+    return [_add(-stats["mean"]), _scale(1. / stats["std"])]
+
+def _compile_operations(operations: List[Tuple[str, List[float]]],
+                        summaries: List[Dict[str, dict]],
+                        chrom: str) -> List[Callable]:
+    """Make the functions of the operations for a block on chrom"""
+    funcs = []
+    for (name, args), summary in zip(operations, summaries):
+        funcs.extend(compile_operation(name, args, summary, chrom))
+    return funcs
+
+def _apply(block: WiggleBlock, funcs: List[Callable]) -> WiggleBlock:
+    """Apply the functions to the block, see WiggleBlock.apply"""
+    try:
+        return block.apply(*funcs)
+    except _LogDomainError as err:
+        name = err.args[0]
+        domain = ("values not greater than -1" if name == "log1p"
+                  else "non-positive values")
+        raise WiggleTransformError(
+            f"Cannot apply {name} to {domain} in block {block.block_id}, "
+            "add a pseudo count (e.g. add:1) or clip the values first."
+        ) from None
+
+def summarize_values(blocks: Iterable[WiggleBlock],
+                     operations: List[Tuple[str, List[float]]],
+                     summaries: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """Get the count, the sum, the mean and the standard deviation of the
+    values of each chromosome, transformed by the operations with their
+    summaries"""
+    accumulators = {}
+    for block in blocks:
+        _apply(block, _compile_operations(operations, summaries, block.chrom))
+        if block.chrom not in accumulators:
+            accumulators[block.chrom] = StatsAccumulator(
+                ["count", "sum", "mean", "std"]
+            )
+        accumulators[block.chrom].update(block.data)
+    return {chrom: accumulator.result()
+            for chrom, accumulator in accumulators.items()}
+
+def summary_file(wigfile) -> str:
+    """Get the path of the file caching the summaries of a wiggle file"""
+    return str(wigfile) + SUMMARY_SUFFIX
+
+def _read_summaries(wigfile) -> dict:
+    """Read the cached summaries, empty if the wiggle file is modified"""
+    sumfile = summary_file(wigfile)
+    if not os.path.isfile(sumfile):
+        return {}
+    stat = os.stat(wigfile)
+    with open(sumfile) as fsum:
+        try:
+            cached = json.load(fsum)
+        except ValueError:
+            return {}
+    if (cached.get("header") != SUMMARY_HEADER or
+            cached.get("size") != stat.st_size or
+            cached.get("mtime") != stat.st_mtime_ns):
+        return {}
+    return cached["summaries"]
+
+def _write_summaries(wigfile, summaries: dict):
+    """Cache the summaries, skipped if the file cannot be written"""
+    stat = os.stat(wigfile)
+    try:
+        with open(summary_file(wigfile), 'w') as fsum:
+            json.dump(dict(header=SUMMARY_HEADER, size=stat.st_size,
+                           mtime=stat.st_mtime_ns, summaries=summaries),
+                      fsum)
+    except OSError:
+        sys.stderr.write("[wigtools] Cannot cache the summary of the "
+                         f"values to: {summary_file(wigfile)}\n")
+
+def load_summary(wigfile,
+                 operations: List[Tuple[str, List[float]]],
+                 summaries: List[Dict[str, dict]],
+                 jobs: int = 1) -> Dict[str, dict]:
+    """Get the summary of the values of a wiggle file transformed by the
+    operations, from the cache file (<wigfile>.wsum) if it is not outdated,
+    otherwise by reading the file, which is cached then."""
+    key = " ".join(":".join([name] + ["" if arg is None else repr(arg)
+                                      for arg in args])
+                   for name, args in operations) or "-"
+    cached = _read_summaries(wigfile)
+    if key not in cached:
+        sys.stderr.write(f"[wigtools] Summarizing the values "
+                         f"(operations: {key})\n")
+        cached[key] = summarize_values(
+            Wiggle.iter_blocks(wigfile, compact=True, jobs=jobs),
+            operations, summaries
+        )
+        _write_summaries(wigfile, cached)
+    return cached[key]
+
+def transform_blocks(blocks: Iterable[WiggleBlock],
+                     operations: List[str],
+                     wigfile=None,
+                     jobs: int = 1) -> Iterator[WiggleBlock]:
+    """Transform the values of the blocks by the chain of operations in one
+    streaming pass, see OPERATIONS.
+
+    cpm scales the values so that they sum up to a million, and zscore
+    standardizes the values by the mean and the standard deviation of each
+    chromosome, which are taken from the summary of the values transformed
+    by the operations before them. The summaries are calculated by reading
+    the regular wiggle file `wigfile` beforehand, and cached."""
+    operations = [parse_operation(spec) for spec in operations]
+    summaries = []
+    for i, (name, _) in enumerate(operations):
+        if name not in TWO_PASS_OPERATIONS:
+            summaries.append(None)
+            continue
+        if wigfile is None or not os.path.isfile(wigfile):
+            raise WiggleTransformError(
+                f"Operation {name} needs to read the values first, "
+                "which requires a regular input file."
+            )
+        summaries.append(load_summary(wigfile, operations[:i],
+                                      summaries[:i], jobs))
+
+    for block in blocks:
+        yield _apply(block, _compile_operations(operations, summaries,
+                                                block.chrom))
@@ -0,0 +1,124 @@
+"""A binary columnar format (wbin) to cache the parsed wiggle files.
+
+Layout of a wbin file:
+    MAGIC
+    for each block:
+        the values (float64 or float32), padded to 8 bytes
+        (variableStep only) the first position followed by the deltas of
+        the positions (int32, or int64 if any delta overflows int32),
+        padded to 8 bytes
+    the header: JSON with the metadata of the blocks and the byte offsets
+        of their arrays
+    the size of the header (uint64, little-endian)
+    MAGIC
+
+The arrays are saved in native byte order, which is recorded in the header,
+so that the values can be memory-mapped without copying.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+from itertools import accumulate, islice
+from operator import sub
+from typing import Iterable, Iterator, Tuple
+
+MAGIC = b"WIGBIN01"
+WBIN_SUFFIX = ".wbin"
+INT32_MAX = (1 << 31) - 1
+
+def is_wbin(path) -> bool:
+    """Tell if a file is a wbin file.
+    Only regular files are checked, since pipes cannot be peeked"""
+    try:
+        with open(path, 'rb') as fin:
+            if not fin.seekable():
+                return False
+            return fin.read(len(MAGIC)) == MAGIC
+    except (OSError, TypeError):
+        return False
+
+def _write_array(fout, arr: array, offset: int) -> int:
+    """Write an array padded to 8 bytes, return the new offset"""
+    content = arr.tobytes()
+    fout.write(content)
+    padding = -len(content) % 8
+    fout.write(b"\0" * padding)
+    return offset + len(content) + padding
+
+def write_wbin(blocks: Iterable, outfile, float32: bool = False) -> int:
+    """Save the blocks to a wbin file. The blocks are written one by one,
+    so they can be streamed. Returns the number of blocks written."""
+    metas = []
+    with open(outfile, 'wb') as fout:
+        fout.write(MAGIC)
+        offset = len(MAGIC)
+        for block in blocks:
+            meta = dict(chrom=block.chrom,
+                        start=block.start,
+                        step=block.step,
+                        span=block.span,
+                        is_fixed=block.is_fixed,
+                        size=len(block.data),
+                        dtype='f' if float32 else 'd',
+                        data=offset)
+            offset = _write_array(fout, array(meta['dtype'], block.data),
+                                  offset)
+            if not block.is_fixed:
+                regions = block.regions
+                deltas = array('q', regions[:1])
+                deltas.extend(map(sub, islice(regions, 1, None), regions))
+                if all(abs(delta) <= INT32_MAX for delta in deltas):
+                    deltas = array('i', deltas)
+                meta['rtype'] = deltas.typecode
+                meta['regions'] = offset
+                offset = _write_array(fout, deltas, offset)
+            metas.append(meta)
+
+        header = json.dumps(dict(byteorder=sys.byteorder,
+                                 blocks=metas)).encode()
+        fout.write(header)
+        fout.write(struct.pack("<Q", len(header)))
+        fout.write(MAGIC)
+    return len(metas)
+
+def _view(buffer: memoryview, offset: int, size: int,
+          typecode: str, swap: bool):
+    """Get the array at the offset of the buffer, without copying if
+    the byte order is the same"""
+    itemsize = array(typecode).itemsize
+    view = buffer[offset:offset + size * itemsize].cast(typecode)
+    if not swap:
+        return view
+    arr = array(typecode, view)
+    arr.byteswap()
+    return arr
+
+def read_wbin(path) -> Iterator[Tuple[dict, memoryview, array]]:
+    """Read the blocks from a wbin file.
+    Yields the metadata, the values and the positions (None for fixedStep
+    blocks) of each block. The values are read-only views of the
+    memory-mapped file, the positions are decoded from the deltas."""
+    with open(path, 'rb') as fin:
+        mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapped)
+    tail = len(buffer) - len(MAGIC) - 8
+    if (buffer[:len(MAGIC)] != MAGIC or
+            buffer[tail + 8:] != MAGIC):
+        raise ValueError(f"Not a wbin file: {path}")
+    header_size = struct.unpack("<Q", buffer[tail:tail + 8])[0]
+    header = json.loads(bytes(buffer[tail - header_size:tail]))
+    swap = header['byteorder'] != sys.byteorder
+
+    for meta in header['blocks']:
+        data = _view(buffer, meta.pop('data'), meta['size'],
+                     meta.pop('dtype'), swap)
+        regions = None
+        if not meta['is_fixed']:
+            regions = array('q', accumulate(
+                _view(buffer, meta.pop('regions'), meta['size'],
+                      meta.pop('rtype'), swap)
+            ))
+        meta.pop('size')
+        yield meta, data, regions
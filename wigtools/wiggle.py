@@ -1,9 +1,51 @@
 """Classes for wigtools"""
+import os
+import re
 import sys
-import hashlib
-from typing import Tuple
+import mmap
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from functools import lru_cache
+from itertools import accumulate, chain
+from operator import mul
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 import attr
 from diot import OrderedDiot
+from wigtools.wbin import is_wbin, read_wbin, write_wbin
+from wigtools.bigwig import BigWigFile, is_bigwig
+from wigtools.compress import (detect_compression, open_compressed_output,
+                               open_input)
+from wigtools.parallel import ordered_imap
+from wigtools.stats import (STATISTICS, SUM_STATISTICS, StatsAccumulator,
+                            WiggleUnsupportedStatistic, block_stats,
+                            normalize_statistics)
+
+# size of the text chunks to read from a wiggle file at a time
+READ_CHUNK_SIZE = 1 << 22
+
+# number of data lines to format at a time when stringifying
+STRINGIFY_CHUNK_SIZE = 1 << 16
+# buffer size of the output files
+WRITE_BUFFER_SIZE = 1 << 20
+# number of data points of the blocks to calculate the stats of in a task
+STATS_TASK_SIZE = 1 << 18
+
+META_LINE_REGEX = {
+    str: re.compile(r'^(?:fixedStep|variableStep)[^\n]*\n?', re.M),
+    bytes: re.compile(rb'^(?:fixedStep|variableStep)[^\n]*\n?', re.M),
+}
+NON_NUMBER_CHROM_MAPPINGS = {
+    "X": 23,
+    "Y": 24,
+    "M": 25,
+    "MT": 26
+}
+# user-defined ranks of chromosomes, see set_chrom_order
+_CHROM_ORDER = {}
+
+# separators of columns in data lines
+COLUMN_SEPARATORS = {str: (" ", "\t"), bytes: (b" ", b"\t")}
 
 def _is_meta_line(line):
     """Check if a line is a meta line or a data line"""
@@ -11,6 +53,8 @@ def _is_meta_line(line):
 
 def _parse_meta_line(line) -> dict:
     """Parse the meta line"""
+    if isinstance(line, bytes):
+        line = line.decode()
     ret = {}
     parts = line.rstrip("\r\n").split()
     blocktype = parts.pop(0)
@@ -26,6 +70,10 @@ def _parse_meta_line(line) -> dict:
                          else items[1])
     return ret
 
+def _sortable_region(region: Tuple) -> Tuple:
+    """Replace the chromosome of a region with its sort key"""
+    return (_chrom_to_sortable(region[0]), region[1], region[2])
+
 def _compare_regions(region1: Tuple, region2: Tuple) -> int:
     """Compare two regions using the chrom and start
     A region is considered smaller if:
@@ -33,20 +81,28 @@ def _compare_regions(region1: Tuple, region2: Tuple) -> int:
     2. end position is smaller than the end position of the other region
     No need to consider base, since 0-based coordinate doesn't include end
     and 1-based does"""
-    chr1 = _chrom_to_sortable(region1[0])
-    chr2 = _chrom_to_sortable(region2[0])
-    end2 = region2[2]
+    return _compare_sortable_regions(_sortable_region(region1),
+                                     _sortable_region(region2))
 
-    return (0 if (chr1, region1[2]) == (chr2, end2)
-            else 1 if (chr1, region1[2]) > (chr2, end2)
-            else -1)
+def _compare_sortable_regions(region1: Tuple, region2: Tuple) -> int:
+    """Compare two regions with chromosomes replaced by their sort keys"""
+    key1 = (region1[0], region1[2])
+    key2 = (region2[0], region2[2])
+    return (key1 > key2) - (key1 < key2)
 
 def _intersect_regions(region1: Tuple, region2: Tuple,
                        base1: int = None, base2: int = None) -> bool:
     """Tell if two regions are overlapping"""
-    chr1 = _chrom_to_sortable(region1[0])
-    chr2 = _chrom_to_sortable(region2[0])
-    if chr1 != chr2:
+    return _intersect_sortable_regions(_sortable_region(region1),
+                                       _sortable_region(region2),
+                                       base1, base2)
+
+def _intersect_sortable_regions(region1: Tuple, region2: Tuple,
+                                base1: int = None,
+                                base2: int = None) -> bool:
+    """Tell if two regions with chromosomes replaced by their sort keys
+    are overlapping"""
+    if region1[0] != region2[0]:
         return False
     # convert all to 1-based
     start1 = region1[1] if base1 is None else region1[1] + 1 - base1
@@ -55,20 +111,240 @@ def _intersect_regions(region1: Tuple, region2: Tuple,
         return False
     return True
 
-def _chrom_to_sortable(chrom):
-    """Convert chromosomes to numbers that are sorted like version sort"""
-    non_number_chrom_mappings = {
-        "X": 23,
-        "Y": 24,
-        "M": 25,
-        "MT": 26
-    }
-    chrom = chrom[3:] if chrom[:3] == "chr" else chrom
-    chrom = non_number_chrom_mappings.get(chrom, chrom)
-    if not str(chrom).isdigit():
-        chrom = int(hashlib.sha1(chrom.encode()).hexdigest(),
-                    16) % (10 ** 8)
-    return int(chrom)
+def is_sorted(regions: Iterable[Tuple]) -> bool:
+    """Tell if the regions are sorted by chrom and end, which is required to
+    merge them with the blocks of a sorted wiggle file"""
+    prev_region = None
+    for region in map(_sortable_region, regions):
+        if (prev_region and
+                _compare_sortable_regions(prev_region, region) == 1):
+            return False
+        prev_region = region
+    return True
+
+def find_unsorted_block(blocks: Iterable) -> Optional[Tuple]:
+    """Find the first block out of order by chrom and start, in one pass.
+    Returns the block and the one before it, or None if all blocks are
+    sorted. Any objects with `chrom` and `start` can be checked, such as
+    index records."""
+    prev_block = prev_key = None
+    for block in blocks:
+        key = _sort_key(block)
+        if prev_block is not None and key < prev_key:
+            return prev_block, block
+        prev_block, prev_key = block, key
+    return None
+
+def open_output(outfile, buffer_size: int = None, binary: bool = False,
+                jobs: int = 1):
+    """Open a file to write with a large buffer, so that the formatted
+    chunks are written to the file in bulk.
+    Files with suffixes of compressed files (.gz, .bgz, .zst, .zstd) are
+    compressed with `jobs` threads."""
+    buffer_size = buffer_size or WRITE_BUFFER_SIZE
+    fout = open_compressed_output(outfile, jobs, buffer_size, binary)
+    if fout is not None:
+        return fout
+    return open(outfile, 'wb' if binary else 'w', buffering=buffer_size)
+
+def _iter_chunks(wigfile, binary: bool = False,
+                 jobs: int = 1) -> Iterator[Tuple]:
+    """Read a wiggle file in large chunks and split them by the meta lines.
+    Yields (meta_line, None, offset) for meta lines and (None, chunk, offset)
+    for the chunks of data lines between them. A chunk always ends at a line
+    boundary.
+
+    Regular files are memory-mapped, with the meta lines in bytes and the
+    chunks being memoryviews of the mapped file, and the offsets are the
+    byte offsets in the file. Other files (i.e. pipes and compressed files)
+    are read as streams, in bytes if binary is True, otherwise in text, and
+    the offsets are the ones in the uncompressed data. Compressed files are
+    decompressed with `jobs` threads, see open_input."""
+    if os.path.isfile(wigfile) and not detect_compression(wigfile):
+        yield from _iter_mmap_chunks(wigfile)
+    else:
+        yield from _iter_stream_chunks(wigfile, binary, jobs)
+
+def _iter_mmap_chunks(wigfile) -> Iterator[Tuple]:
+    """Scan the memory-mapped wiggle file for the meta lines in bytes,
+    without decoding it or creating objects for the lines"""
+    with open(wigfile, 'rb') as fwig:
+        size = os.fstat(fwig.fileno()).st_size
+        if not size:
+            return
+        # the mapping is closed when all views of it are released
+        mapped = mmap.mmap(fwig.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    meta_regex = META_LINE_REGEX[bytes]
+    pos = 0
+    while pos < size:
+        end = min(pos + READ_CHUNK_SIZE, size)
+        if end < size:
+            cut = mapped.rfind(b"\n", pos, end) + 1
+            if not cut:
+                # a line longer than the chunk size
+                cut = mapped.find(b"\n", end) + 1 or size
+            end = cut
+
+        for match in meta_regex.finditer(mapped, pos, end):
+            if match.start() > pos:
+                yield None, view[pos:match.start()], pos
+            yield match.group(), None, match.start()
+            pos = match.end()
+        if pos < end:
+            yield None, view[pos:end], pos
+        pos = end
+        sys.stderr.write(f"[wigtools] {pos * 100 // size}% read.\r")
+
+def _iter_parallel_tasks(wigfile) -> Iterator[Tuple]:
+    """Scan the wiggle file for the byte ranges of the data lines, and group
+    them into tasks of about READ_CHUNK_SIZE bytes.
+    Each task is the wiggle file and a list of (meta, is_fixed, offset,
+    length), with meta being the parsed meta line for the first range of
+    a block, or None for the rest ranges of the block. Data lines before
+    any meta lines are ignored."""
+    task = []
+    task_size = 0
+    is_fixed = None
+    for meta_line, chunk, offset in _iter_mmap_chunks(wigfile):
+        if meta_line is not None:
+            meta = _parse_meta_line(meta_line)
+            is_fixed = meta["is_fixed"]
+            task.append((meta, is_fixed, offset, 0))
+            continue
+        if is_fixed is None:
+            continue
+        task.append((None, is_fixed, offset, len(chunk)))
+        task_size += len(chunk)
+        if task_size >= READ_CHUNK_SIZE:
+            yield wigfile, task
+            task = []
+            task_size = 0
+    if task:
+        yield wigfile, task
+
+def _parse_task(task: Tuple) -> List[Tuple]:
+    """Parse the byte ranges of a task in a worker process.
+    Returns the meta, the data (array('d')) and the starts of regions
+    (array('q') for variableStep blocks, otherwise None) of each range,
+    which are pickled compactly to send back."""
+    wigfile, ranges = task
+    ret = []
+    with open(wigfile, 'rb') as fwig:
+        for meta, is_fixed, offset, length in ranges:
+            block = WiggleBlock(is_fixed=is_fixed, chrom="", compact=True)
+            if length:
+                fwig.seek(offset)
+                block.take_chunk(fwig.read(length))
+            ret.append((meta, block.data,
+                        None if is_fixed else block._regions))
+    return ret
+
+def _iter_parallel_blocks(wigfile, base: int, compact: bool,
+                          jobs: int) -> Iterator["WiggleBlock"]:
+    """Iterate over the blocks of a regular wiggle file, with the data lines
+    parsed by a pool of processes and the blocks assembled in order"""
+    current_block = None
+    for results in ordered_imap(_parse_task,
+                                _iter_parallel_tasks(wigfile), jobs):
+        for meta, data, regions in results:
+            if meta is not None:
+                if current_block and current_block.data:
+                    yield current_block
+                current_block = WiggleBlock(**meta, base=base,
+                                            compact=compact)
+            current_block.take_parsed(data, regions)
+    if current_block and current_block.data:
+        yield current_block
+
+def _iter_stream_chunks(wigfile, binary: bool = False,
+                        jobs: int = 1) -> Iterator[Tuple]:
+    """Read the wiggle file as a stream in large chunks, decompressed if
+    it is compressed"""
+    nlines = 0
+    newline = b"\n" if binary else "\n"
+    meta_regex = META_LINE_REGEX[bytes if binary else str]
+    offset = 0
+    with open_input(wigfile, binary, jobs) as fwig:
+        rest = newline[:0]
+        while True:
+            text = fwig.read(READ_CHUNK_SIZE)
+            if not text:
+                text = rest
+                rest = newline[:0]
+            else:
+                text = rest + text
+                cut = text.rfind(newline) + 1
+                if not cut:
+                    rest = text
+                    continue
+                text, rest = text[:cut], text[cut:]
+            if not text:
+                break
+
+            pos = 0
+            for match in meta_regex.finditer(text):
+                if match.start() > pos:
+                    yield None, text[pos:match.start()], offset + pos
+                yield match.group(), None, offset + match.start()
+                pos = match.end()
+            if pos < len(text):
+                yield None, text[pos:], offset + pos
+            offset += len(text)
+
+            nlines += text.count(newline)
+            sys.stderr.write(f"[wigtools] {nlines} lines read.\r")
+
+@lru_cache(maxsize=None)
+def _chrom_to_sortable(chrom: str) -> Tuple:
+    """Convert chromosomes to keys that are sorted like version sort.
+    The keys are (group, number, name parts), where the group is:
+    0. chromosomes in the order set by set_chrom_order, numbered by their
+       ranks,
+    1. numeric ones (with `chr` stripped and X, Y, M, MT mapped to numbers),
+    2. the others, sorted by their names (`chr` stripped) with the digits
+       compared as numbers.
+    `chr1` and `1` share a key, so that they are taken as the same
+    chromosome by comparing and intersecting regions. See _sort_key for
+    sorting the blocks. The key is computed only once for each chromosome."""
+    if chrom in _CHROM_ORDER:
+        return (0, _CHROM_ORDER[chrom], ())
+    name = chrom[3:] if chrom[:3] == "chr" else chrom
+    name = NON_NUMBER_CHROM_MAPPINGS.get(name, name)
+    if str(name).isdigit():
+        return (1, int(name), ())
+    return (2, 0, tuple(int(part) if i % 2 else part
+                        for i, part in enumerate(re.split(r"(\d+)", name))))
+
+def _sort_key(block) -> Tuple:
+    """The key to sort blocks (or index records) by chrom and start, with
+    the chromosomes sharing a sort key (e.g. `chr1` and `1`) kept apart by
+    their names, so that the order is deterministic"""
+    return (_chrom_to_sortable(block.chrom), block.chrom, block.start)
+
+def set_chrom_order(chroms: Iterable[str] = None):
+    """Set the order of chromosomes, which assigns ranks to them by their
+    positions. Chromosomes not in the order are put after them.
+
+    This should be done before reading any wiggle files, since the sort keys
+    of the chromosomes are stored with the blocks.
+    Use None to reset the order to the default one."""
+    _CHROM_ORDER.clear()
+    for chrom in chroms or ():
+        _CHROM_ORDER.setdefault(chrom, len(_CHROM_ORDER))
+    _chrom_to_sortable.cache_clear()
+
+def read_chrom_order(chromfile) -> List[str]:
+    """Read the order of chromosomes from the first column of a file,
+    for example, a `.fai` or a `chrom.sizes` file"""
+    chroms = []
+    with open(chromfile) as fchrom:
+        for line in fchrom:
+            line = line.strip()
+            if not line or line[:1] == '#':
+                continue
+            chroms.append(line.split()[0])
+    return chroms
 
 class WiggleInvalidDataLine(Exception):
     """When the format of a data line is invalid"""
@@ -85,6 +361,45 @@ class WiggleUnsortedFile(Exception):
 class WiggleReshapeError(Exception):
     """When trying to merge blocks with different spans"""
 
+class FixedStepRegions(Sequence):
+    """The starts of regions of a fixedStep block.
+    A lazy, O(1)-indexable view like `range`, which follows the data
+    taken in by the block"""
+
+    __slots__ = ('block', )
+
+    def __init__(self, block: "WiggleBlock"):
+        self.block = block
+
+    def _range(self) -> range:
+        start, step = self.block.start, self.block.step
+        return range(start, start + len(self.block.data) * step, step)
+
+    def __len__(self):
+        return len(self.block.data)
+
+    def __getitem__(self, index):
+        return self._range()[index]
+
+    def __iter__(self):
+        return iter(self._range())
+
+    def __contains__(self, value):
+        return value in self._range()
+
+    def __eq__(self, other):
+        if isinstance(other, FixedStepRegions):
+            return self._range() == other._range()
+        try:
+            return list(self._range()) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"FixedStepRegions({self._range()!r})"
+
 @attr.s(kw_only=True, slots=True)
 class WiggleBlock: # pylint: disable=too-many-instance-attributes
     """A wiggle block that marked by variableStep or fixedStep
@@ -97,27 +412,73 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
     start = attr.ib(default=None)
     step = attr.ib(default=None)
     span = attr.ib(default=1)
+    # store data and regions in typed arrays (array('d') and array('q'))
+    # instead of lists of python objects, which takes much less memory
+    compact = attr.ib(default=False, repr=False)
+    # the sort key of the chromosome
+    chrom_key = attr.ib(init=False, repr=False, default=None)
     # infer the end of the block to check overlaps
     _end = attr.ib(init=False, repr=False, default=None)
+    # the cumulative sums of data and the squares of data,
+    # built on first use, and reset when data is taken in
+    _cumsum = attr.ib(init=False, repr=False, eq=False, default=None)
+    _cumsum_sq = attr.ib(init=False, repr=False, eq=False, default=None)
 
     data = attr.ib(init=False, repr=False, default=attr.Factory(list))
     # the start positions of each regions
     # this will be inferred for fixedStep blocks after intaking is done
     _regions = attr.ib(init=False, repr=False, default=attr.Factory(list))
 
+    def __attrs_post_init__(self):
+        self.chrom_key = _chrom_to_sortable(self.chrom)
+        if self.compact:
+            self.data = array('d')
+            self._regions = array('q')
+
+    def _reset_cache(self):
+        """Reset the cached end and cumulative sums when data is taken in"""
+        self._end = None
+        self._cumsum = None
+        self._cumsum_sq = None
+
+    @property
+    def cumsum(self) -> array:
+        """The cumulative sums of data, with a leading 0, so that the sum of
+        data[i:j] is cumsum[j] - cumsum[i]"""
+        if self._cumsum is None:
+            self._cumsum = array('d', accumulate(chain((0.,), self.data)))
+        return self._cumsum
+
+    @property
+    def cumsum_sq(self) -> array:
+        """The cumulative sums of the squares of data, with a leading 0"""
+        if self._cumsum_sq is None:
+            self._cumsum_sq = array('d', accumulate(
+                chain((0.,), map(mul, self.data, self.data))
+            ))
+        return self._cumsum_sq
+
     @property
     def end(self):
-        """Get the end position of block"""
-        if self._end:
-            return self._end
-        return self.regions[-1] + self.span - self.base
+        """Get the end position of block.
+        The end is cached, and reset when data is taken in"""
+        if self._end is None:
+            if self.is_fixed and not self._regions:
+                # closed form, no need to infer the regions
+                self._end = (self.start + (len(self.data) - 1) * self.step +
+                             self.span - self.base)
+            else:
+                self._end = self.regions[-1] + self.span - self.base
+        return self._end
 
     @property
     def regions(self):
-        """Get the starts of regions"""
-        if self._regions:
+        """Get the starts of regions.
+        For fixedStep blocks, a lazy view is returned instead of building
+        the list of starts"""
+        if self._regions or not self.is_fixed:
             return self._regions
-        return [self.start + i * self.step for i in range(len(self.data))]
+        return FixedStepRegions(self)
 
     @property
     def block_id(self):
@@ -135,6 +496,7 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
             raise WiggleInvalidDataLine("Wrong columns in data line "
                                         "for a variableStep block")
 
+        self._reset_cache()
         if self.is_fixed:
             self.data.append(float(parts[0]))
         else:
@@ -143,9 +505,47 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
             self.data.append(float(parts[1]))
             self._regions.append(int(parts[0]))
 
-    def _stringify_to_wiggle(self, base=None, writer=None):
-        """Stringify the block to wiggle format"""
-        base = self.base if base is None else base
+    def take_chunk(self, chunk):
+        """Take in a chunk of data lines at once.
+        The chunk (str, bytes or a memoryview of bytes) is split and converted
+        as a whole instead of line by line, with the columns of the lines
+        still validated. Empty lines are ignored."""
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        ctype = type(chunk)
+        space, tab = COLUMN_SEPARATORS[ctype]
+        # Without any separators, each line of a fixedStep block has
+        # exactly one column, otherwise check the columns of each line
+        if ((not self.is_fixed or space in chunk or tab in chunk) and
+                set(map(len, map(ctype.split,
+                                 filter(None, chunk.splitlines())))) -
+                {1 if self.is_fixed else 2}):
+            raise WiggleInvalidDataLine(
+                "Wrong columns in data line for a "
+                f"{'fixedStep' if self.is_fixed else 'variableStep'} block"
+            )
+
+        parts = chunk.split()
+        if self.is_fixed:
+            self.take_parsed(map(float, parts))
+        else:
+            self.take_parsed(map(float, parts[1::2]),
+                             list(map(int, parts[::2])))
+
+    def take_parsed(self, data: Iterable[float], regions: Sequence = None):
+        """Take in the parsed data (and the starts of regions for
+        variableStep blocks), for example, arrays parsed by other processes"""
+        self._reset_cache()
+        self.data.extend(data)
+        if self.is_fixed or not regions:
+            return
+        if not self.start:
+            # the same as take: start from the first non-zero position
+            self.start = next(filter(None, regions), regions[-1])
+        self._regions.extend(regions)
+
+    def _wiggle_meta_line(self, base):
+        """Get the meta line of the block for wiggle format"""
         meta = [
             "fixedStep" if self.is_fixed else "variableStep",
             f"chrom={self.chrom}",
@@ -156,37 +556,56 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
                 f"start={self.start + base - self.base}",
                 f"step={self.step}"
             ])
-        ret = " ".join(meta) + "\n"
-
-        if writer:
-            writer.write(ret)
-            # clear buffer
-            ret = ""
+        return " ".join(meta) + "\n"
 
-        for i, dat in enumerate(self.data):
+    def _iter_wiggle_chunks(self, base):
+        """Format the block to wiggle format in chunks of lines.
+        Each chunk is formatted at once instead of line by line"""
+        yield self._wiggle_meta_line(base)
+        offset = base - self.base
+        for i in range(0, len(self.data), STRINGIFY_CHUNK_SIZE):
+            data = self.data[i:i + STRINGIFY_CHUNK_SIZE]
             if self.is_fixed:
-                ret += f"{dat}\n"
-            else:
-                ret += f"{self._regions[i] + base - self.base}\t{dat}\n"
-            if writer:
-                writer.write(ret)
-                ret = ""
+                yield "\n".join(map(str, data)) + "\n"
+                continue
+            regions = self._regions[i:i + STRINGIFY_CHUNK_SIZE]
+            if offset:
+                regions = map(offset.__add__, regions)
+            yield "\n".join(map("{}\t{}".format, regions, data)) + "\n"
 
-        return ret
+    def _iter_bedgraph_chunks(self, base):
+        """Format the block to bedGraph format in chunks of lines"""
+        offset = base - self.base
+        width = self.span - self.base
+        template = (self.chrom.replace("{", "{{").replace("}", "}}") +
+                    "\t{}\t{}\t{}")
+        regions = self.regions
+        for i in range(0, len(self.data), STRINGIFY_CHUNK_SIZE):
+            data = self.data[i:i + STRINGIFY_CHUNK_SIZE]
+            starts = regions[i:i + STRINGIFY_CHUNK_SIZE]
+            if offset:
+                starts = list(map(offset.__add__, starts))
+            ends = map(width.__add__, starts)
+            yield "\n".join(map(template.format, starts, ends, data)) + "\n"
+
+    @staticmethod
+    def _write_chunks(chunks: Iterable[str], writer=None) -> str:
+        """Write the chunks to the writer, or join them if no writer given"""
+        if writer:
+            for chunk in chunks:
+                writer.write(chunk)
+            return ""
+        return "".join(chunks)
+
+    def _stringify_to_wiggle(self, base=None, writer=None):
+        """Stringify the block to wiggle format"""
+        base = self.base if base is None else base
+        return self._write_chunks(self._iter_wiggle_chunks(base), writer)
 
     def _stringify_to_bedgraph(self, base=None, writer=None):
         """Stringify the block to bedGraph"""
         base = self.base if base is None else base
-        ret = ""
-        for start, dat in zip(self.regions, self.data):
-            start = start + base - self.base
-            ret += (f"{self.chrom}\t{start}\t"
-                    f"{start+self.span-self.base}\t{dat}\n")
-            if writer:
-                writer.write(ret)
-                ret = ""
-
-        return ret
+        return self._write_chunks(self._iter_bedgraph_chunks(base), writer)
 
     def stringify(self, base=None, fmt='wiggle', writer=None):
         """Stringify the block"""
@@ -199,6 +618,19 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
             "Unsupported stringifying format"
         )
 
+    def _locate(self, query: Tuple, qbase: int = None) -> Tuple[int, int]:
+        """Get the range of indexes of the data points overlapping with the
+        query region, by binary search over the (ascending) regions"""
+        qbase = self.base if qbase is None else qbase
+        if _chrom_to_sortable(query[0]) != self.chrom_key:
+            return 0, 0
+        regions = self.regions
+        # region + span - base >= qstart and region <= qend, with qstart and
+        # region converted to 1-based (end is the same for both bases)
+        return (bisect_left(regions,
+                            query[1] + 1 - qbase - self.span + self.base),
+                bisect_right(regions, query[2] + self.base - 1))
+
     def subset(self, query: Tuple,
                qbase: int = None,
                partial: str = "fraction"):
@@ -207,12 +639,11 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
         qstart = query[1] - qbase + self.base
         qend = query[2]
         ret = WiggleBlock(is_fixed=False, chrom=self.chrom,
-                          span=self.span, base=self.base)
-        for i, region in enumerate(self.regions):
+                          span=self.span, base=self.base,
+                          compact=self.compact)
+        start, end = self._locate(query, qbase)
+        for i, region in zip(range(start, end), self.regions[start:end]):
             regend = region + self.span - self.base
-            if not _intersect_regions((self.chrom, region, regend),
-                                      query, self.base, qbase):
-                continue
             intersect_start = max(qstart, region)
             intersect_end = min(qend, regend)
             ret._regions.append(intersect_start)
@@ -224,32 +655,148 @@ class WiggleBlock: # pylint: disable=too-many-instance-attributes
                 ret.data.append(self.data[i])
         return ret
 
-    def stats(self, what=None):
-        """Calculate stats of this block"""
-        what = what or ['min', 'max', 'mean', 'median', 'sum', 'count', 'bp']
-        if not isinstance(what, list):
-            what = [what]
-        ret = {}
-        lendata = len(self.data)
-        if 'min' in what:
-            ret['min'] = min(self.data)
-        if 'max' in what:
-            ret['max'] = max(self.data)
-        if 'mean' in what:
-            ret['mean'] = sum(self.data) / lendata
-        if 'median' in what:
-            if lendata % 2 == 1:
-                ret['median'] = self.data[lendata // 2]
-            else:
-                ret['median'] = (self.data[lendata // 2 - 1] +
-                                 self.data[lendata // 2]) / 2.
-        if 'sum' in what:
-            ret['sum'] = sum(self.data)
-        if 'count' in what:
-            ret['count'] = lendata
-        if 'bp' in what:
-            ret['bp'] = lendata * self.span
-        return ret
+    def _partial_weights(self,
+                         first: int,
+                         last: int,
+                         qstart: int,
+                         qend: int) -> Iterator[Tuple[int, float]]:
+        """Get the indexes of the data points first...last-1 partially in the
+        1-based query region, and the fractions of them in the region.
+        Only the data points at both ends can be partially in the region"""
+        span = self.span
+        if span == 1 or first == last:
+            return
+        regions = self.regions
+        offset = 1 - self.base
+        for i in range(first, last):
+            rstart = regions[i] + offset
+            if rstart >= qstart:
+                break
+            yield i, (min(qend, rstart + span - 1) - qstart + 1) / span
+        for i in range(last - 1, first - 1, -1):
+            rstart = regions[i] + offset
+            if rstart < qstart or rstart + span - 1 <= qend:
+                break
+            yield i, (qend - rstart + 1) / span
+
+    def _slice_data(self, # pylint: disable=too-many-arguments
+                    first: int,
+                    last: int,
+                    qstart: int,
+                    qend: int,
+                    partial: str = "fraction"):
+        """Get the data of points first...last-1 in the 1-based query region,
+        with the partial points assigned as subset does"""
+        values = self.data[first:last]
+        if partial != "fraction":
+            return values
+        weights = list(self._partial_weights(first, last, qstart, qend))
+        if not weights:
+            return values
+        values = list(values)
+        for i, weight in weights:
+            values[i - first] *= weight
+        return values
+
+    def subset_data(self, query: Tuple,
+                    qbase: int = None,
+                    partial: str = "fraction"):
+        """Get the data of the subset by query region, the same as
+        `subset(query, qbase, partial).data`, without creating the block"""
+        qbase = self.base if qbase is None else qbase
+        first, last = self._locate(query, qbase)
+        return self._slice_data(first, last, query[1] + 1 - qbase, query[2],
+                                partial)
+
+    def region_sums(self, query: Tuple,
+                    qbase: int = None,
+                    partial: str = "fraction",
+                    squares: bool = False) -> Tuple[int, float, float]:
+        """Get the number, the sum and (if squares is True, otherwise None)
+        the sum of the squares of the data of the subset by query region, as
+        subset_data does, in O(log n) with the cumulative sums"""
+        qbase = self.base if qbase is None else qbase
+        first, last = self._locate(query, qbase)
+        cumsum = self.cumsum
+        total = cumsum[last] - cumsum[first]
+        total_sq = None
+        if squares:
+            cumsum_sq = self.cumsum_sq
+            total_sq = cumsum_sq[last] - cumsum_sq[first]
+        if partial == "fraction":
+            for i, weight in self._partial_weights(
+                    first, last, query[1] + 1 - qbase, query[2]
+            ):
+                value = self.data[i]
+                total += value * (weight - 1)
+                if squares:
+                    total_sq += value * value * (weight * weight - 1)
+        return last - first, total, total_sq
+
+    def stats(self, what=None, approx: bool = False):
+        """Calculate stats of this block.
+        With approx, the quantiles are estimated in constant memory"""
+        return block_stats(self.data, self.span, what,
+                           length=self.end - self.start + self.base,
+                           approx=approx)
+
+    def apply(self, *funcs: Callable[[Iterable[float]], Iterable[float]]):
+        """Transform the data with a chain of functions in one pass.
+        Each function takes an iterable of the values and returns an
+        iterable of the new values, for example, `map` over a builtin, so
+        the functions are chained lazily and run together, value by value.
+        Returns the block itself."""
+        values = iter(self.data)
+        for func in funcs:
+            values = func(values)
+        self.data = array('d', values) if self.compact else list(values)
+        self._reset_cache()
+        return self
+
+class BlockIndex:
+    """An in-memory interval index of blocks.
+    For each chromosome, the blocks are sorted by their starts, with the
+    running maximum of their ends, so that the blocks overlapping a query
+    region are found in O(log n + k), and the blocks or the query regions
+    do not need to be sorted.
+
+    Any objects with `chrom`, `start` and `end` can be indexed."""
+
+    __slots__ = ('base', '_index')
+
+    def __init__(self, blocks: Iterable, base: int = 1):
+        self.base = base
+        chrom_blocks = {}
+        for block in blocks:
+            chrom_blocks.setdefault(_chrom_to_sortable(block.chrom),
+                                    []).append(block)
+
+        self._index = {}
+        for chrom_key, cblocks in chrom_blocks.items():
+            cblocks.sort(key=lambda block: block.start)
+            # convert starts to 1-based, ends are the same for both bases
+            starts = [block.start + 1 - base for block in cblocks]
+            ends = [block.end for block in cblocks]
+            max_ends = list(accumulate(ends, max))
+            self._index[chrom_key] = (starts, ends, max_ends, cblocks)
+
+    def __len__(self):
+        return sum(len(index[0]) for index in self._index.values())
+
+    def query(self, query: Tuple, qbase: int = None) -> List:
+        """Get the blocks overlapping with the query region,
+        ordered by their starts"""
+        qbase = self.base if qbase is None else qbase
+        index = self._index.get(_chrom_to_sortable(query[0]))
+        if not index:
+            return []
+        starts, ends, max_ends, blocks = index
+        qstart = query[1] + 1 - qbase
+        # blocks after `end` start after the query region,
+        # blocks before `start` all end before the query region
+        end = bisect_right(starts, query[2])
+        start = bisect_left(max_ends, qstart, 0, end)
+        return [blocks[i] for i in range(start, end) if ends[i] >= qstart]
 
 @attr.s(slots=True)
 class Wiggle:
@@ -257,6 +804,10 @@ class Wiggle:
 
     wigfile = attr.ib()
     base = attr.ib(default=1)
+    # whether to store the data of blocks in typed arrays
+    compact = attr.ib(default=False)
+    # number of processes to parse the file
+    jobs = attr.ib(default=1)
 
     blocks = attr.ib(init=False, default=attr.Factory(OrderedDiot),
                      repr=False)
@@ -270,41 +821,96 @@ class Wiggle:
         """Get the number of blocks"""
         return len(self.blocks)
 
+    @staticmethod
+    def iter_blocks(wigfile,
+                    base: int = 1,
+                    compact: bool = False,
+                    jobs: int = 1) -> Iterator[WiggleBlock]:
+        """Iterate over the blocks of a wiggle file.
+        A block is yielded once all its data lines are read, so that only
+        one block is kept in memory at a time. Blocks without data are
+        skipped.
+
+        wbin files are detected and loaded, with the data of the blocks
+        being read-only views of the memory-mapped file. bigWig files are
+        detected as well, with the blocks being the data sections of them.
+
+        With jobs > 1, the data lines of regular files are parsed by a pool
+        of processes, see _iter_parallel_blocks. Compressed files are
+        decompressed with `jobs` threads instead."""
+        if (jobs > 1 and os.path.isfile(wigfile) and
+                not is_wbin(wigfile) and not is_bigwig(wigfile) and
+                not detect_compression(wigfile)):
+            yield from _iter_parallel_blocks(wigfile, base, compact, jobs)
+            return
+
+        if is_wbin(wigfile):
+            for meta, data, regions in read_wbin(wigfile):
+                block = WiggleBlock(**meta, base=base, compact=compact)
+                block.data = data
+                if regions is not None:
+                    block._regions = regions if compact else list(regions)
+                yield block
+            return
+
+        if is_bigwig(wigfile):
+            with BigWigFile(wigfile) as bigwig:
+                yield from bigwig_blocks(bigwig.iter_blocks(base=base),
+                                         base, compact)
+            return
+
+        current_block = None
+        for meta_line, chunk, _ in _iter_chunks(wigfile, jobs=jobs):
+            if meta_line is not None:
+                if current_block and current_block.data:
+                    yield current_block
+                meta = _parse_meta_line(meta_line)
+                current_block = WiggleBlock(**meta, base=base,
+                                            compact=compact)
+                # start cannot be calculated for variableStep
+            elif current_block:
+                current_block.take_chunk(chunk)
+        if current_block and current_block.data:
+            yield current_block
+
     def _read(self):
         """Read the wiggle file"""
-        current_block = None
-        with open(self.wigfile, 'r') as fwig:
-            for i, line in enumerate(fwig):
-                if _is_meta_line(line):
-                    meta = _parse_meta_line(line)
-                    current_block = WiggleBlock(**meta, base=self.base)
-                    # start cannot be calculated for variableStep
-                elif line.rstrip("\r\n") and current_block:
-                    current_block.take(line)
-                    if current_block.block_id not in self.blocks:
-                        self.blocks[current_block.block_id] = current_block
-                if i % 10000 == 0:
-                    sys.stderr.write(f"[wigtools] {i} lines read.\r")
-
-    def stringify(self, fmt='wiggle', base=None, outfile=None):
+        for block in self.iter_blocks(self.wigfile, self.base,
+                                      self.compact, self.jobs):
+            if block.block_id not in self.blocks:
+                self.blocks[block.block_id] = block
+
+    def stringify(self, fmt='wiggle', base=None, outfile=None,
+                  buffer_size: int = None):
         """Stringify the object.
-        Only to it for small file, otherwise there may be memory issues"""
+        If outfile is given, the blocks are written to it one by one through
+        a writer buffering `buffer_size` bytes (default WRITE_BUFFER_SIZE),
+        and an empty string is returned. Otherwise, only do it for small file,
+        since the whole string is returned."""
         base = self.base if base is None else base
 
-        fout = open(outfile, 'w') if outfile else None
-        ret = ""
-        for block in self.blocks.values():
-            ret += block.stringify(base, fmt, fout)
-        if fout:
-            fout.close()
-        return ret
+        if outfile:
+            with open_output(outfile, buffer_size, jobs=self.jobs) as fout:
+                for block in self.blocks.values():
+                    block.stringify(base, fmt, fout)
+            return ""
+        return "".join(block.stringify(base, fmt)
+                       for block in self.blocks.values())
+
+    def save_wbin(self, outfile, float32: bool = False) -> int:
+        """Save the blocks to a wbin file, which loads almost instantly.
+        The values are saved as float32 if float32 is True, otherwise
+        float64. Returns the number of blocks saved."""
+        return write_wbin(self.blocks.values(), outfile, float32)
 
     def sort(self):
-        """Sort the blocks in a wiggle file by chrom and start. """
+        """Sort the blocks in a wiggle file by chrom and start.
+        Nothing is done if the blocks are already sorted."""
+        if find_unsorted_block(self.blocks.values()) is None:
+            return
         block_ids = sorted(
             self.blocks.keys(),
-            key=lambda block: (_chrom_to_sortable(self.blocks[block].chrom),
-                               self.blocks[block].start)
+            key=lambda block: _sort_key(self.blocks[block])
         )
         orig_blocks = self.blocks
         self.blocks = OrderedDiot()
@@ -312,100 +918,409 @@ class Wiggle:
             self.blocks[block_id] = orig_blocks[block_id]
         del orig_blocks
 
-    def _region(self, block_id):
-        """Make a block id a region to compare"""
-        return (self.blocks[block_id].chrom,
-                self.blocks[block_id].start,
-                self.blocks[block_id].end)
-
     def _intersect(self, qreg, qbase=None,
                    reshape=False, partial="fraction"):
         """Get the blocks that have intersect with qreg. Blocks will be subset
         with the query regions"""
-        # pylint: disable=too-many-branches
+        ret = Wiggle(None, self.base, self.compact)
+        for block_id, block in intersect_blocks(self.blocks.values(), qreg,
+                                                self.base, qbase,
+                                                reshape, partial,
+                                                self.compact):
+            ret.blocks[block_id] = block
+        return ret
+
+    def query(self, query, qbase=None):
+        """Query the blocks that have intersection with query.
+        The blocks are looked up in an interval index, so neither the blocks
+        nor the query regions need to be sorted"""
+        ret = Wiggle(None, self.base, self.compact)
+        index = BlockIndex(self.blocks.values(), self.base)
+        for region in query:
+            for block in index.query(region, qbase):
+                ret.blocks.setdefault(block.block_id, block)
+        return ret
+
+    def reshape(self, query, qbase=None, partial="fraction"):
+        """Reshape the blocks in the query regions.
+        The blocks are looked up in an interval index, so neither the blocks
+        nor the query regions need to be sorted"""
         qbase = self.base if qbase is None else qbase
-        iter_self = iter(self.blocks)
-        iter_query = iter(qreg)
-        curr_self = curr_query = None
-        prev_self = prev_query = None
+        ret = Wiggle(None, self.base, self.compact)
+        index = BlockIndex(self.blocks.values(), self.base)
+        for region in query:
+            block_id, block = _new_reshaped_block(region, qbase, self.compact)
+            for source in index.query(region, qbase):
+                _reshape_take(block, source, region, qbase, partial)
+            if _finish_reshaped_block(block):
+                ret.blocks[block_id] = block
+        return ret
 
-        ret = Wiggle(None, self.base)
-        block = None
-        while True:
-            if curr_query is None:
-                try:
-                    curr_query = next(iter_query)
-                except StopIteration:
-                    break
-                if (prev_query and _compare_regions(prev_query,
-                                                    curr_query) == 1):
-                    raise WiggleUnsortedFile(
-                        "Query file is not sorted. "
-                        "Region {} appears after {}".format(curr_query,
-                                                            prev_query)
-                    )
-                if reshape:
-                    # We are doing reshape, we should generate new blocks
-                    # We can't do fixedStep, since we don't know if the
-                    # coming blocks are fixedStep or not
-                    if block and block.regions and not block.start:
-                        block.start = block.regions[0]
-                    # have to update the span
-                    block = WiggleBlock(base=qbase,
-                                        is_fixed=False,
-                                        chrom=curr_query[0],
-                                        span=None)
-                    ret.blocks[f"{curr_query[0]}:{curr_query[1]}"] = block
-            if curr_self is None:
-                try:
-                    curr_self = next(iter_self)
-                except StopIteration:
-                    break
-                if (prev_self and
-                        _compare_regions(self._region(prev_self),
-                                         self._region(curr_self)) == 1):
-                    raise WiggleUnsortedFile(
-                        "Current wiggle file is not sorted. "
-                        "Region {} appears after {}".format(curr_self,
-                                                            prev_self)
-                    )
-
-            if _intersect_regions(self._region(curr_self),
-                                  curr_query, self.base, qbase):
-
-                if not reshape:
-                    ret.blocks[curr_self] = self.blocks[curr_self]
+    def summarize(self, # pylint: disable=too-many-arguments
+                  query: Iterable[Tuple],
+                  qbase: int = None,
+                  what=None,
+                  partial: str = "fraction",
+                  approx: bool = False) -> Iterator[Tuple]:
+        """Calculate the stats of the data in each query region, with the
+        partial data points assigned as reshape does, but without creating
+        the reshaped blocks.
+        Yields the regions and their stats, in the order of the regions"""
+        qbase = self.base if qbase is None else qbase
+        what = normalize_statistics(what)
+        # only the cumulative sums are needed, which are built once for
+        # each block and reused by all the regions
+        by_sums = set(what) <= set(SUM_STATISTICS)
+        squares = 'std' in what
+        index = BlockIndex(self.blocks.values(), self.base)
+        for region in query:
+            accumulator = StatsAccumulator(what, approx)
+            span = 1
+            for block in index.query(region, qbase):
+                if by_sums:
+                    accumulator.update_sums(*block.region_sums(
+                        region, qbase, partial, squares
+                    ))
                 else:
-                    ssblock = self.blocks[curr_self].subset(curr_query,
-                                                            qbase,
-                                                            partial)
-                    if block.span and block.span != self.blocks[curr_self].span:
-                        raise WiggleReshapeError(
-                            "Cannot merge blocks with different spans "
-                            f"({block.span}, {self.blocks[curr_self].span}) "
-                            f"that intersect with region: {curr_query}"
-                        )
-                    block.span = self.blocks[curr_self].span
-                    block._regions.extend(ssblock._regions)
-                    block.data.extend(ssblock.data)
-                    block._end = None
-            comp = _compare_regions(self._region(curr_self), curr_query)
-            if comp <= 0:
-                prev_self = curr_self
-                curr_self = None
+                    accumulator.update(block.subset_data(region, qbase,
+                                                         partial))
+                span = block.span
+            yield region, accumulator.result(span,
+                                             region[2] - region[1] + qbase)
+
+def bigwig_blocks(blocks: Iterable[Tuple], base: int = 1,
+                  compact: bool = False) -> Iterator[WiggleBlock]:
+    """Make the blocks of a bigWig file, see BigWigFile.iter_blocks"""
+    for meta, data, regions in blocks:
+        block = WiggleBlock(**meta, base=base, compact=compact)
+        block.take_parsed(data, regions)
+        yield block
+
+def _block_region(block: WiggleBlock) -> Tuple:
+    """Make a block a region to compare, with the chromosome replaced by
+    its sort key"""
+    return (block.chrom_key, block.start, block.end)
+
+def _new_reshaped_block(query: Tuple, qbase: int, compact: bool) -> Tuple:
+    """Create a new block to reshape the data into the query region.
+    We can't do fixedStep, since we don't know if the blocks intersecting
+    with the query region are fixedStep or not.
+    Span will be updated by the blocks."""
+    return (f"{query[0]}:{query[1]}",
+            WiggleBlock(base=qbase,
+                        is_fixed=False,
+                        chrom=query[0],
+                        span=None,
+                        compact=compact))
+
+def _reshape_take(block: WiggleBlock, source: WiggleBlock,
+                  query: Tuple, qbase: int, partial: str):
+    """Take in the data of the source block subset by the query region
+    for a reshaped block"""
+    ssblock = source.subset(query, qbase, partial)
+    if block.span and block.span != source.span:
+        raise WiggleReshapeError(
+            "Cannot merge blocks with different spans "
+            f"({block.span}, {source.span}) "
+            f"that intersect with region: {query}"
+        )
+    block.span = source.span
+    block._regions.extend(ssblock._regions)
+    block.data.extend(ssblock.data)
+    block._reset_cache()
+
+def _finish_reshaped_block(block: WiggleBlock) -> Optional[WiggleBlock]:
+    """Infer the start of a reshaped block after all data taken in.
+    None if the block has no data, which has no span to write either"""
+    if not block.data:
+        return None
+    if not block.start:
+        block.start = block.regions[0]
+    return block
+
+def intersect_blocks(blocks: Iterable[WiggleBlock],
+                     qreg: Iterable[Tuple],
+                     base: int = 1,
+                     qbase: int = None,
+                     reshape: bool = False,
+                     partial: str = "fraction",
+                     compact: bool = False) -> Iterator[Tuple]:
+    """Merge the sorted blocks with the sorted query regions.
+    Both are consumed lazily, so the blocks can be streamed from
+    `Wiggle.iter_blocks`.
+
+    Yields (block_id, block) tuples. The intersecting blocks themselves are
+    yielded when not reshaping, otherwise a new block for each query region,
+    with the data subset to that region, whose storage is compact if
+    `compact` is True."""
+    # pylint: disable=too-many-branches,too-many-arguments
+    qbase = base if qbase is None else qbase
+    iter_self = iter(blocks)
+    iter_query = iter(qreg)
+    curr_self = curr_query = None
+    prev_self = prev_query = None
+    # the regions with the chromosomes replaced by their sort keys
+    self_region = query_region = None
+    prev_self_region = prev_query_region = None
+    # the block yielded lastly, in case it intersects multiple regions
+    last_self = None
+
+    block = block_id = None
+    while True:
+        if curr_query is None:
+            try:
+                curr_query = next(iter_query)
+            except StopIteration:
+                break
+            query_region = _sortable_region(curr_query)
+            if (prev_query and _compare_sortable_regions(
+                    prev_query_region, query_region) == 1):
+                raise WiggleUnsortedFile(
+                    "Query file is not sorted. "
+                    "Region {} appears after {}".format(curr_query,
+                                                        prev_query)
+                )
+            if reshape:
+                # We are doing reshape, we should generate new blocks
+                if block and _finish_reshaped_block(block):
+                    yield block_id, block
+                block_id, block = _new_reshaped_block(curr_query, qbase,
+                                                      compact)
+        if curr_self is None:
+            try:
+                curr_self = next(iter_self)
+            except StopIteration:
+                break
+            self_region = _block_region(curr_self)
+            if (prev_self and _compare_sortable_regions(
+                    prev_self_region, self_region) == 1):
+                raise WiggleUnsortedFile(
+                    "Current wiggle file is not sorted. "
+                    "Region {} appears after {}".format(curr_self.block_id,
+                                                        prev_self.block_id)
+                )
+
+        if _intersect_sortable_regions(self_region, query_region,
+                                       base, qbase):
+
+            if not reshape:
+                if curr_self is not last_self:
+                    last_self = curr_self
+                    yield curr_self.block_id, curr_self
             else:
-                prev_query = curr_query
-                curr_query = None
+                _reshape_take(block, curr_self, curr_query, qbase, partial)
+        comp = _compare_sortable_regions(self_region, query_region)
+        if comp <= 0:
+            prev_self = curr_self
+            prev_self_region = self_region
+            curr_self = None
+        else:
+            prev_query = curr_query
+            prev_query_region = query_region
+            curr_query = None
 
-        if reshape and block and block.regions and not block.start:
-            block.start = block.regions[0]
+    if reshape and block and _finish_reshaped_block(block):
+        yield block_id, block
 
-        return ret
+def _iter_stats_tasks(blocks: Iterable[WiggleBlock],
+                      what,
+                      approx: bool) -> Iterator[Tuple]:
+    """Group the blocks into tasks of about STATS_TASK_SIZE data points"""
+    task = []
+    task_size = 0
+    for block in blocks:
+        data = block.data
+        if isinstance(data, memoryview):
+            # views of memory-mapped wbin files cannot be pickled
+            data = array(data.format, data)
+        task.append((block.chrom, block.start, block.end, block.span,
+                     block.end - block.start + block.base, data))
+        task_size += len(data)
+        if task_size >= STATS_TASK_SIZE:
+            yield what, approx, task
+            task = []
+            task_size = 0
+    if task:
+        yield what, approx, task
 
-    def query(self, query, qbase=None):
-        """Query the blocks that have intersection with query"""
-        return self._intersect(query, qbase)
+def _stats_task(task: Tuple) -> List[Tuple]:
+    """Calculate the stats of the blocks of a task in a worker process"""
+    what, approx, blocks = task
+    return [(chrom, start, end,
+             block_stats(data, span, what, length=length, approx=approx))
+            for chrom, start, end, span, length, data in blocks]
 
-    def reshape(self, query, qbase=None, partial="fraction"):
-        """Reshape the blocks in the query regions"""
-        return self._intersect(query, qbase, reshape=True, partial=partial)
+def iter_block_stats(blocks: Iterable[WiggleBlock],
+                     what=None,
+                     jobs: int = 1,
+                     approx: bool = False) -> Iterator[Tuple]:
+    """Calculate the stats of the blocks, and yield the chrom, start, end
+    and the stats of each block, in the order of the blocks.
+
+    With jobs > 1, the blocks are grouped into tasks balanced by the number
+    of data points and sent to a pool of processes. The results are put back
+    in order with a bounded number of tasks pending, so the blocks can be
+    streamed."""
+    if jobs <= 1:
+        for block in blocks:
+            yield (block.chrom, block.start, block.end,
+                   block.stats(what, approx))
+        return
+    for results in ordered_imap(_stats_task,
+                                _iter_stats_tasks(blocks, what, approx),
+                                jobs):
+        yield from results
+
+def _window_range(start: int, end: int, size: int, step: int) -> range:
+    """Get the indexes of the windows overlapping with the 1-based region.
+    Window i covers [i * step + 1, i * step + size]"""
+    return range(max(0, -((size - start) // step)), (end - 1) // step + 1)
+
+def _take_windows(block: WiggleBlock,
+                  windows: dict,
+                  size: int,
+                  step: int,
+                  partial: str):
+    """Take the data of the block into the windows it overlaps.
+    The data points of each window are located by binary search and taken
+    in as a slice, and windows without data are skipped."""
+    regions = block.regions
+    nregions = len(regions)
+    # the regions of fixedStep blocks are located arithmetically
+    fixed = isinstance(regions, FixedStepRegions)
+    # to convert the regions to 1-based
+    offset = 1 - block.base
+    wrange = _window_range(regions[0] + offset, block.end, size, step)
+    window = wrange.start
+    first = 0
+    while window < wrange.stop:
+        wstart = window * step + 1
+        wend = wstart + size - 1
+        low = wstart - block.span + 1 - offset
+        high = wend - offset
+        if fixed:
+            first = min(nregions,
+                        max(0, -((block.start - low) // block.step)))
+            last = min(nregions,
+                       max(first, (high - block.start) // block.step + 1))
+        else:
+            first = bisect_left(regions, low, first)
+            last = bisect_right(regions, high, first)
+        if first == last:
+            if first == nregions:
+                break
+            # jump to the first window with the next data point
+            window = max(window + 1, _window_range(
+                regions[first] + offset, regions[first] + offset,
+                size, step
+            ).start)
+            continue
+        values = block._slice_data(first, last, wstart, wend, partial)
+        if window in windows:
+            windows[window][1].append(values)
+        else:
+            windows[window] = (block.span, [values])
+        window += 1
+
+# statistics of windows that are reduced by the builtins directly
+_WINDOW_REDUCERS = {
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'count': len,
+    'mean': lambda values: sum(values) / len(values),
+}
+
+def _reduce_windows(chrom: str,
+                    windows: dict,
+                    size: int,
+                    stat: str) -> Iterator[Tuple]:
+    """Reduce the values of the finished windows by the statistic, and yield
+    the chrom, the index and the value of the windows in order"""
+    reducer = _WINDOW_REDUCERS.get(stat)
+    for window in sorted(windows):
+        span, chunks = windows[window]
+        values = (chunks[0] if len(chunks) == 1
+                  else list(chain.from_iterable(chunks)))
+        yield chrom, window, (
+            reducer(values) if reducer
+            else block_stats(values, span, stat, length=size)[stat]
+        )
+
+def _iter_reduced_windows(blocks: Iterable[WiggleBlock],
+                          size: int,
+                          step: int,
+                          stat: str,
+                          partial: str) -> Iterator[Tuple]:
+    """Take the blocks into the windows, and yield the reduced windows
+    once they are finished"""
+    windows = {}
+    chrom = None
+    last_start = None
+    done_chroms = set()
+    for block in blocks:
+        # block.start skips position 0 of 0-based variableStep blocks
+        start = block.regions[0] + 1 - block.base
+        if block.chrom != chrom:
+            yield from _reduce_windows(chrom, windows, size, stat)
+            windows = {}
+            if block.chrom in done_chroms:
+                raise WiggleUnsortedFile(
+                    f"Blocks of chromosome {block.chrom} are not adjacent"
+                )
+            done_chroms.add(block.chrom)
+            chrom = block.chrom
+        elif start < last_start:
+            raise WiggleUnsortedFile(
+                "Current wiggle file is not sorted. "
+                f"Region {block.block_id} appears after "
+                f"{chrom}:{last_start + block.base - 1}"
+            )
+        else:
+            finished = {window: windows.pop(window)
+                        for window in list(windows)
+                        if window * step + size < start}
+            yield from _reduce_windows(chrom, finished, size, stat)
+        last_start = start
+        _take_windows(block, windows, size, step, partial)
+    yield from _reduce_windows(chrom, windows, size, stat)
+
+def iter_windows(blocks: Iterable[WiggleBlock],
+                 size: int,
+                 step: int = None,
+                 stat: str = "mean",
+                 partial: str = "fraction",
+                 base: int = 1,
+                 compact: bool = False) -> Iterator[WiggleBlock]:
+    """Bin the data of the blocks into fixed-size windows along the
+    chromosomes, in one pass of the blocks.
+
+    Window i of a chromosome covers [i * step + 1, i * step + size] in
+    1-based coordinates (step defaults to size, for non-overlapping windows),
+    and the `stat` of the data points in it, subset to the window as
+    WiggleBlock.subset does with `partial`, is the value of the window.
+    Windows without data are skipped, and the runs of the consecutive ones
+    are yielded as fixedStep blocks with span being the window size.
+
+    The blocks of a chromosome must be adjacent and sorted by their
+    starts. A window is finished once a block starts after it, so only the
+    windows of the last blocks are kept."""
+    # pylint: disable=too-many-arguments
+    if stat not in STATISTICS:
+        raise WiggleUnsupportedStatistic(f"Unsupported statistic: {stat}")
+    step = step or size
+    block = None
+    last_window = None
+    for chrom, window, value in _iter_reduced_windows(blocks, size, step,
+                                                      stat, partial):
+        if (block is None or chrom != block.chrom or
+                window != last_window + 1):
+            if block is not None:
+                yield block
+            block = WiggleBlock(base=base, is_fixed=True, chrom=chrom,
+                                start=window * step + base, step=step,
+                                span=size, compact=compact)
+        block.data.append(value)
+        last_window = window
+    if block is not None:
+        yield block